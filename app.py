@@ -1,17 +1,45 @@
 import streamlit as st
-import requests
 import json
+import math
 import time
 import os
 from dotenv import load_dotenv
 
-# 加载环境变量
+# 加载环境变量；spo 的各模块在导入时读取配置，必须先于它们加载
 load_dotenv()
 
+from spo.checkpoint import CheckpointStore
+from spo.client import SPOClient
+from spo.engine import OptimizationState, Optimizer, OptimizerSettings
+from spo.metrics import MetricsRecorder
+from spo.transport import TransportError
+from spo.worker import CANCELLING, FINISHED, PAUSED, PAUSING, RUNNING, OptimizationWorker
+
 # 配置
 API_BASE_URL = os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn")
 DEFAULT_PORT = os.getenv("PORT", "3000")
 BACKEND_URL = f"http://localhost:{DEFAULT_PORT}/api"
+USE_CACHE = os.getenv("RESPONSE_CACHE", "on") != "off"
+
+# 后台优化运行时页面刷新进度的间隔（秒），流式显示输出时刷新得更频繁
+POLL_INTERVAL = 1.0
+STREAM_POLL_INTERVAL = 0.3
+
+# Streamlit 1.37 起提供 st.fragment，面板可以按自己的间隔单独重跑，
+# 进度刷新时不必重绘整个页面；旧版本退化为整页轮询
+FRAGMENTS_SUPPORTED = hasattr(st, "fragment")
+
+# 样本和优化历史分页显示，每页的条数
+SAMPLES_PER_PAGE = 5
+HISTORY_PER_PAGE = 5
+
+# 提前判定的置信度选项，None 表示仅在结果数学上确定时提前结束
+DECISION_CONFIDENCE_OPTIONS = {
+    "仅在结果确定时": None,
+    "90% 置信度": 0.9,
+    "95% 置信度": 0.95,
+    "99% 置信度": 0.99
+}
 
 # 页面配置
 st.set_page_config(
@@ -67,250 +95,110 @@ if 'initialized' not in st.session_state:
     st.session_state.initialized = False
     st.session_state.api_configured = False
     st.session_state.current_view = "config"
-    st.session_state.current_iteration = 0
-    st.session_state.max_iterations = 10
-    st.session_state.samples = []
-    st.session_state.current_best_prompt = ""
-    st.session_state.current_best_outputs = {}
-    st.session_state.new_prompt = ""
-    st.session_state.new_outputs = {}
-    st.session_state.evaluations = {}
-    st.session_state.analysis = ""
-    st.session_state.optimization_history = []
-    st.session_state.is_optimizing = False
+    st.session_state.worker = None
+    st.session_state.auto_mode = True
     st.session_state.available_models = []
+    st.session_state.messages = []
+    st.session_state.live_outputs = {}
+    st.session_state.client = SPOClient(BACKEND_URL, use_cache=USE_CACHE, metrics=MetricsRecorder())
+    st.session_state.settings = OptimizerSettings()
+    st.session_state.state = OptimizationState()
+    st.session_state.checkpoint = None
+    st.session_state.pending = None
 
 # 获取可用模型列表
 def get_available_models():
     try:
-        response = requests.get(f"{BACKEND_URL}/models")
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                return data.get('models', [])
-        return []
-    except Exception as e:
+        return st.session_state.client.get_available_models()
+    except TransportError as e:
         st.error(f"获取模型列表失败: {str(e)}")
         return []
 
-# 调用API
-def call_api(endpoint, data=None):
-    try:
-        if data:
-            response = requests.post(f"{BACKEND_URL}/{endpoint}", json=data)
-        else:
-            response = requests.get(f"{BACKEND_URL}/{endpoint}")
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            error_data = response.json()
-            st.error(f"API错误: {error_data.get('error', '未知错误')}")
-            return None
-    except Exception as e:
-        st.error(f"API调用失败: {str(e)}")
-        return None
-
 # 配置API
 def configure_api(api_key, base_url, models):
-    data = {
-        "apiKey": api_key,
-        "baseUrl": base_url,
-        "models": models
-    }
-    
-    response = call_api("config", data)
-    if response and response.get('success'):
-        st.session_state.api_configured = True
-        return True
-    return False
-
-# 生成测试样本
-def generate_samples(task_description):
-    data = {
-        "taskDescription": task_description
-    }
-    
-    response = call_api("generate-samples", data)
-    if response and response.get('success'):
-        return response.get('samples', [])
-    return []
-
-# 执行提示词
-def execute_prompt(prompt, question):
-    data = {
-        "prompt": prompt,
-        "question": question
-    }
-    
-    response = call_api("execute-prompt", data)
-    if response and response.get('success'):
-        return response.get('output', "")
-    return ""
-
-# 优化提示词
-def optimize_prompt(current_prompt, current_output, task_description, history=""):
-    data = {
-        "currentPrompt": current_prompt,
-        "currentOutput": current_output,
-        "taskDescription": task_description,
-        "history": history
-    }
-    
-    response = call_api("optimize-prompt", data)
-    if response and response.get('success'):
-        return response.get('newPrompt', "")
-    return ""
-
-# 评估输出
-def evaluate_outputs(output_a, output_b, task_description, question):
-    data = {
-        "outputA": output_a,
-        "outputB": output_b,
-        "taskDescription": task_description,
-        "question": question
-    }
+    try:
+        st.session_state.client.configure(api_key, base_url, models)
+    except TransportError as e:
+        st.error(f"API调用失败: {str(e)}")
+        return False
     
-    response = call_api("evaluate-outputs", data)
-    if response and response.get('success'):
-        return response.get('evaluation', "相似")
-    return "相似"
+    st.session_state.api_configured = True
+    return True
 
-# 分析提示变化
-def analyze_changes(old_prompt, new_prompt, task_description):
-    data = {
-        "oldPrompt": old_prompt,
-        "newPrompt": new_prompt,
-        "taskDescription": task_description
-    }
-    
-    response = call_api("analyze-changes", data)
-    if response and response.get('success'):
-        return response.get('analysis', "")
-    return ""
+# 创建绑定到当前会话的优化引擎
+# 引擎可能在工作线程中发出事件，因此只把消息和流式输出写入普通的列表和字典，留到页面重绘时显示
+def get_optimizer():
+    # 每次运行的列表和字典由 stop_optimization 重新创建，已停止的运行写不到新的运行中
+    messages = st.session_state.messages
+    # {候选提示: {样本 id: 已收到的输出}}，只保留当前迭代
+    live_outputs = st.session_state.live_outputs
+    optimizer = None
+    
+    def on_event(event, data):
+        # 取消后工作线程仍在收尾，此后的事件不再显示
+        if optimizer is not None and optimizer.cancelled.is_set():
+            return
+        if event in ("warning", "error"):
+            messages.append((event, data["message"]))
+        elif event in ("iteration_started", "iteration_finished"):
+            live_outputs.clear()
+        elif event == "output_token":
+            outputs = live_outputs.setdefault(data["prompt"], {})
+            outputs[data["sample_id"]] = outputs.get(data["sample_id"], "") + data["token"]
+    
+    optimizer = Optimizer(
+        st.session_state.client,
+        st.session_state.state,
+        st.session_state.settings,
+        on_event=on_event,
+        checkpoint=st.session_state.checkpoint,
+        pending=st.session_state.pending
+    )
+    return optimizer
 
-# 执行当前最佳提示词
-def run_current_best_prompt():
-    outputs = {}
-    
-    with st.spinner("正在执行当前提示词..."):
-        for sample in st.session_state.samples:
-            output = execute_prompt(st.session_state.current_best_prompt, sample['question'])
-            outputs[sample['id']] = output
-    
-    st.session_state.current_best_outputs = outputs
-    return outputs
+# 显示并清空引擎产生的消息
+def show_messages():
+    for level, message in st.session_state.messages:
+        if level == "error":
+            st.error(message)
+        else:
+            st.warning(message)
+    st.session_state.messages.clear()
 
-# 获取优化历史摘要
-def get_optimization_history_summary():
-    if not st.session_state.optimization_history:
-        return ""
-    
-    # 只取最近3次迭代的历史
-    recent_history = st.session_state.optimization_history[-3:]
-    
-    return "\n".join([
-        f"迭代{item['iteration']}: {'改进成功' if item['is_better'] else '未改进'}"
-        for item in recent_history
-    ])
+# 在后台线程中启动优化循环
+def start_optimization():
+    # 取消的迭代中已完成的调用保存在检查点中，继续时复用
+    checkpoint = st.session_state.checkpoint
+    if st.session_state.pending is None and checkpoint is not None:
+        st.session_state.pending = checkpoint.load().pending
+    
+    worker = OptimizationWorker(get_optimizer(), auto_mode=st.session_state.auto_mode)
+    # 恢复的未完成迭代只在第一步复用
+    st.session_state.pending = None
+    st.session_state.worker = worker
+    worker.start()
 
-# 判断是否应该更新最佳提示
-def should_update_best_prompt(evaluations):
-    better_count = 0
-    worse_count = 0
-    
-    for sample_id, result in evaluations.items():
-        if result == "B更好":
-            better_count += 1
-        elif result == "A更好":
-            worse_count += 1
-    
-    # 如果有更多样本认为新提示更好，则更新
-    return better_count > worse_count
+# 取消当前会话中正在运行的后台优化
+def stop_optimization():
+    worker = st.session_state.worker
+    if worker is not None:
+        worker.cancel()
+    st.session_state.worker = None
+    # 下一次运行使用新的消息列表和流式输出，被取消的工作线程只会写入旧的对象
+    st.session_state.messages = []
+    st.session_state.live_outputs = {}
 
-# 运行优化步骤
-def run_optimization_step():
-    if st.session_state.current_iteration >= st.session_state.max_iterations:
-        st.session_state.is_optimizing = False
-        st.session_state.current_view = "results"
-        return
-    
-    st.session_state.current_iteration += 1
-    
-    # 1. 生成新提示候选
-    with st.spinner(f"正在执行第 {st.session_state.current_iteration} 次优化..."):
-        new_prompt = optimize_prompt(
-            st.session_state.current_best_prompt,
-            json.dumps(st.session_state.current_best_outputs),
-            st.session_state.task_description,
-            get_optimization_history_summary()
-        )
-        
-        if not new_prompt:
-            st.error("优化提示词失败")
-            st.session_state.is_optimizing = False
-            return
-        
-        st.session_state.new_prompt = new_prompt
-        
-        # 2. 执行新提示
-        new_outputs = {}
-        for sample in st.session_state.samples:
-            output = execute_prompt(new_prompt, sample['question'])
-            new_outputs[sample['id']] = output
-        
-        st.session_state.new_outputs = new_outputs
-        
-        # 3. 评估新旧输出
-        evaluations = {}
-        for sample in st.session_state.samples:
-            sample_id = sample['id']
-            output_a = st.session_state.current_best_outputs.get(sample_id, "")
-            output_b = new_outputs.get(sample_id, "")
-            
-            evaluation = evaluate_outputs(
-                output_a,
-                output_b,
-                st.session_state.task_description,
-                sample['question']
-            )
-            
-            evaluations[sample_id] = evaluation
-        
-        st.session_state.evaluations = evaluations
-        
-        # 4. 分析提示变化
-        analysis = analyze_changes(
-            st.session_state.current_best_prompt,
-            new_prompt,
-            st.session_state.task_description
-        )
-        
-        st.session_state.analysis = analysis
-        
-        # 5. 根据评估结果更新最佳提示
-        is_better = should_update_best_prompt(evaluations)
-        if is_better:
-            st.session_state.current_best_prompt = new_prompt
-            st.session_state.current_best_outputs = new_outputs
-        
-        # 记录优化历史
-        st.session_state.optimization_history.append({
-            "iteration": st.session_state.current_iteration,
-            "prompt": new_prompt,
-            "is_better": is_better,
-            "analysis": analysis,
-            "evaluations": evaluations
-        })
-    
-    # 如果是自动模式，继续优化
-    if st.session_state.auto_mode:
-        time.sleep(1)  # 短暂延迟，让UI更新
-        run_optimization_step()
+# 后台优化是否仍在运行或等待继续
+def is_optimizing():
+    worker = st.session_state.worker
+    return worker is not None and worker.active
 
 # 配置视图
 def show_config_view():
+    settings = st.session_state.settings
+    
     st.markdown("<h1 class='main-header'>增强型自监督提示优化系统</h1>", unsafe_allow_html=True)
+    show_messages()
     
     # 获取可用模型列表
     if not st.session_state.available_models:
@@ -352,18 +240,170 @@ def show_config_view():
                 index=1 if len(st.session_state.available_models) > 1 else 0
             )
         
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            cascade_enabled = st.checkbox(
+                "分级评估",
+                value=settings.cascade_enabled,
+                help="先由快速评估模型判定，只有判为相似或置信度不足时才交给评估模型"
+            )
+        
+        with col2:
+            screener_model = st.selectbox(
+                "快速评估模型",
+                options=st.session_state.available_models,
+                index=5 if len(st.session_state.available_models) > 5 else 0
+            )
+        
+        with col3:
+            cascade_confidence = st.slider(
+                "直接采用所需置信度",
+                min_value=0.5,
+                max_value=1.0,
+                value=settings.cascade_confidence,
+                step=0.05
+            )
+            cascade_accept_ties = st.checkbox(
+                "直接采用“相似”",
+                value=settings.cascade_accept_ties,
+                help="有把握的“相似”判定也不再交给评估模型复核；可能改变是否采用新提示的结果"
+            )
+        
         st.markdown("<h2 class='sub-header'>任务设置</h2>", unsafe_allow_html=True)
         
         task_description = st.text_area("任务需求描述", height=100)
         initial_prompt = st.text_area("初始提示词", height=150)
         
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         
         with col1:
             max_iterations = st.number_input("最大迭代次数", min_value=1, max_value=20, value=10)
         
         with col2:
+            max_concurrency = st.number_input("最大并发数", min_value=1, max_value=20, value=settings.max_concurrency)
+        
+        with col3:
             auto_mode = st.checkbox("自动模式 (无需人工干预)", value=True)
+            use_cache = st.checkbox(
+                "复用缓存的响应",
+                value=st.session_state.client.use_cache,
+                help="关闭后每次都重新调用模型，适用于需要在非零温度下重新采样的场景"
+            )
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            early_stopping = st.checkbox(
+                "提前判定胜负",
+                value=settings.early_stopping,
+                help="胜负已定时跳过剩余的评估；新提示确定落败时同时取消剩余的执行"
+            )
+        
+        with col2:
+            confidence_label = st.selectbox("提前判定条件", options=list(DECISION_CONFIDENCE_OPTIONS.keys()))
+        
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            racing_enabled = st.checkbox(
+                "竞速模式",
+                value=settings.racing_enabled,
+                help="候选提示先在随机的小样本子集上与当前最佳提示比较，胜出后才扩大到更多样本"
+            )
+        
+        with col2:
+            racing_stages_text = st.text_input(
+                "子集大小（逗号分隔）",
+                value=", ".join(str(size) for size in settings.racing_stages)
+            )
+        
+        with col3:
+            promotion_threshold = st.slider(
+                "晋级所需胜率",
+                min_value=0.5,
+                max_value=1.0,
+                value=settings.promotion_threshold,
+                step=0.05
+            )
+        
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            population_size = st.number_input(
+                "每轮候选数",
+                min_value=1,
+                max_value=8,
+                value=settings.population_size,
+                help="大于 1 时并行生成多个不同温度的候选提示，选出胜过当前最佳提示且净胜票最多的一个"
+            )
+        
+        with col2:
+            stream_outputs = st.checkbox(
+                "流式显示输出",
+                value=settings.stream_outputs,
+                help="新候选提示的输出在生成过程中逐段显示，而不是等待全部完成"
+            )
+        
+        with col3:
+            speculative = st.checkbox(
+                "提前生成下一轮候选",
+                value=settings.speculative,
+                help="评估本轮候选的同时假定其不会胜出，提前生成下一轮的候选；本轮候选胜出时提前生成的候选作废"
+            )
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            packed_judging = st.checkbox(
+                "打包评估",
+                value=settings.packed_judging,
+                help="全部样本执行完成后，把多个样本的比较放在一次评估调用中，按评估模型的上下文长度分块；解析失败的样本改为逐个评估"
+            )
+        
+        with col2:
+            max_packed_samples = st.number_input(
+                "每次评估的样本数",
+                min_value=2,
+                max_value=20,
+                value=settings.max_packed_samples
+            )
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            deduplicate = st.checkbox(
+                "跳过重复候选",
+                value=settings.deduplicate,
+                help="候选与已尝试的提示相同时沿用记录的评估结果；过于相似时重新生成一次，仍然相似则跳过评估"
+            )
+        
+        with col2:
+            similarity_threshold = st.slider(
+                "相似度阈值",
+                min_value=0.5,
+                max_value=1.0,
+                value=settings.similarity_threshold,
+                step=0.05
+            )
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            reuse_samples = st.checkbox(
+                "复用保存的测试样本",
+                value=settings.reuse_samples,
+                help="同一任务（忽略空白和大小写差异）再次运行时直接使用上次保存的样本，不再调用模型生成；样本不足时补充生成并保存为新版本"
+            )
+        
+        with col2:
+            sample_count = st.number_input(
+                "测试样本数",
+                min_value=0,
+                max_value=100,
+                value=settings.sample_count or 0,
+                help="0 表示使用后端一次生成的样本数；较多时拆成多个并行的生成请求，并去掉重复的问题"
+            )
         
         submitted = st.form_submit_button("开始优化")
         
@@ -380,19 +420,62 @@ def show_config_view():
                 st.error("请输入初始提示词")
                 return
             
+            try:
+                racing_stages = [int(size) for size in racing_stages_text.split(",") if size.strip()]
+            except ValueError:
+                st.error("子集大小必须是以逗号分隔的整数")
+                return
+            
             # 配置模型
             models = {
                 "optimizer": optimizer_model,
                 "executor": executor_model,
                 "evaluator": evaluator_model,
-                "analyzer": analyzer_model
+                "analyzer": analyzer_model,
+                "screener": screener_model
             }
             
+            stop_optimization()
+            
             # 保存配置到会话状态
-            st.session_state.task_description = task_description
-            st.session_state.current_best_prompt = initial_prompt
-            st.session_state.max_iterations = max_iterations
+            st.session_state.settings = OptimizerSettings(
+                max_iterations=max_iterations,
+                max_concurrency=max_concurrency,
+                early_stopping=early_stopping,
+                decision_confidence=DECISION_CONFIDENCE_OPTIONS[confidence_label],
+                racing_enabled=racing_enabled,
+                racing_stages=racing_stages,
+                promotion_threshold=promotion_threshold,
+                population_size=population_size,
+                stream_outputs=stream_outputs,
+                speculative=speculative,
+                packed_judging=packed_judging,
+                max_packed_samples=max_packed_samples,
+                cascade_enabled=cascade_enabled,
+                cascade_confidence=cascade_confidence,
+                cascade_accept_ties=cascade_accept_ties,
+                deduplicate=deduplicate,
+                similarity_threshold=similarity_threshold,
+                reuse_samples=reuse_samples,
+                sample_count=sample_count or None
+            )
+            st.session_state.state = OptimizationState(
+                task_description=task_description,
+                current_best_prompt=initial_prompt
+            )
             st.session_state.auto_mode = auto_mode
+            st.session_state.client.use_cache = use_cache
+            st.session_state.client.metrics = MetricsRecorder()
+            st.session_state.pending = None
+            st.session_state.checkpoint = CheckpointStore().create(
+                st.session_state.state,
+                st.session_state.settings,
+                models,
+                base_url,
+                auto_mode
+            )
+            
+            optimizer = get_optimizer()
             
             # 配置API
             with st.spinner("正在配置API..."):
@@ -400,45 +483,307 @@ def show_config_view():
                     st.success("API配置成功")
                     
                     # 生成测试样本
-                    with st.spinner("正在生成测试样本..."):
-                        samples = generate_samples(task_description)
+                    with st.spinner("正在准备测试样本..."):
+                        samples = optimizer.generate_samples()
                         
                         if samples:
-                            st.session_state.samples = samples
-                            
                             # 执行初始提示
-                            outputs = run_current_best_prompt()
+                            with st.spinner("正在执行当前提示词..."):
+                                outputs = optimizer.run_current_best_prompt()
                             
                             if outputs:
                                 st.session_state.initialized = True
                                 st.session_state.current_view = "optimization"
-                                st.session_state.is_optimizing = True
+                                start_optimization()
                                 st.rerun()
-                        else:
-                            st.error("生成测试样本失败")
+                    
+                    show_messages()
                 else:
                     st.error("API配置失败")
+    
+    show_resume_form()
 
-# 优化视图
-def show_optimization_view():
-    st.markdown("<h1 class='main-header'>优化过程</h1>", unsafe_allow_html=True)
+# 从检查点恢复中断的运行
+def show_resume_form():
+    store = CheckpointStore()
+    runs = store.list_runs()
+    if not runs:
+        return
+    
+    with st.expander("恢复中断的运行"):
+        with st.form("resume_form"):
+            labels = [
+                f"{run['run_id']} · 迭代 {run['iteration']}/{run['max_iterations']} · {run['task_description'][:30]}"
+                for run in runs
+            ]
+            selected = st.selectbox("已保存的运行", options=labels)
+            api_key = st.text_input("API Key", type="password", key="resume_api_key")
+            base_url = st.text_input("Base URL", value=API_BASE_URL, key="resume_base_url")
+            
+            submitted = st.form_submit_button("恢复运行")
+            
+            if submitted:
+                if not api_key:
+                    st.error("请输入API Key")
+                    return
+                
+                stop_optimization()
+                checkpoint = store.open(runs[labels.index(selected)]["run_id"])
+                recovery = checkpoint.load()
+                
+                with st.spinner("正在配置API..."):
+                    if not configure_api(api_key, base_url, recovery.meta.get("models") or None):
+                        st.error("API配置失败")
+                        return
+                
+                st.session_state.client.metrics = MetricsRecorder()
+                st.session_state.settings = recovery.settings
+                st.session_state.state = recovery.state
+                st.session_state.pending = recovery.pending
+                st.session_state.checkpoint = checkpoint
+                st.session_state.auto_mode = recovery.meta.get("auto_mode", True)
+                
+                # 中断发生在初始输出完成之前时重新准备
+                if not recovery.state.current_best_outputs:
+                    with st.spinner("正在准备测试样本和当前提示词输出..."):
+                        if not get_optimizer().prepare():
+                            show_messages()
+                            return
+                
+                st.session_state.initialized = True
+                st.session_state.current_view = "optimization"
+                start_optimization()
+                st.rerun()
+
+# 调用统计面板：各角色的延迟分位数、每次迭代的调用数和累计用量
+def show_metrics_panel():
+    metrics = st.session_state.client.metrics
+    if metrics is None:
+        return
+    
+    summary = metrics.summary()
+    if not summary["calls"]:
+        return
+    
+    with st.expander("调用统计", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.metric("调用次数", summary["calls"])
+        
+        with col2:
+            st.metric("Token 用量", summary["total_tokens"])
+        
+        with col3:
+            st.metric("累计成本", f"{summary['total_cost']:.4f}" if metrics.prices else "未配置单价")
+        
+        st.table([{
+            "角色": role,
+            "调用": stats["calls"],
+            "缓存命中": stats["cached"],
+            "失败": stats["errors"],
+            "p50 (秒)": f"{stats['p50']:.2f}" if stats["p50"] is not None else "-",
+            "p95 (秒)": f"{stats['p95']:.2f}" if stats["p95"] is not None else "-",
+            "Token": stats["tokens"]
+        } for role, stats in summary["by_role"].items()])
+        
+        cascade = summary.get("cascade")
+        if cascade:
+            reasons = {"tie": "判为相似", "low_confidence": "置信度不足", "error": "调用失败"}
+            escalations = "，".join(f"{reasons.get(reason, reason)} {count} 次" for reason, count in cascade["escalations"].items())
+            st.markdown(
+                f"**分级评估:** 快速评估 {cascade['screened']} 次，直接采用 {cascade['accepted']} 次"
+                f"（{cascade['hit_rate']:.0%}）" + (f"；交给评估模型：{escalations}" if escalations else "")
+            )
+        
+        payload = summary.get("payload")
+        if payload:
+            st.markdown(
+                f"**优化器输入:** 当前输出部分平均约 {payload['mean_tokens']:.0f} token，最多 {payload['max_tokens']} token；"
+                f"{payload['trimmed']} 次因超出预算省略或截断了部分样本"
+            )
+        
+        st.markdown("**每次迭代的调用数**")
+        st.bar_chart({"调用数": {str(iteration): count for iteration, count in summary["calls_per_iteration"].items()}})
+
+# 显示一个面板，支持片段时按 run_every 间隔单独重跑
+def show_panel(panel, run_every=None):
+    if FRAGMENTS_SUPPORTED:
+        panel = st.fragment(panel, run_every=run_every)
+    panel()
+
+def is_polling():
+    worker = st.session_state.worker
+    # 请求暂停后当前迭代仍在运行，继续轮询直到暂停真正生效
+    return worker is not None and worker.status in (RUNNING, PAUSING, CANCELLING)
+
+# 分页：只渲染当前页，长列表不会在每次重跑时全部发送到浏览器
+def paginate(items, key, page_size):
+    pages = max(1, math.ceil(len(items) / page_size))
+    if pages == 1:
+        return items
+    
+    page = st.number_input(f"页码（共 {pages} 页）", min_value=1, max_value=pages, value=1, step=1, key=key)
+    start = (page - 1) * page_size
+    return items[start:start + page_size]
+
+# 进度面板
+def show_progress_panel():
+    state = st.session_state.state
+    settings = st.session_state.settings
+    worker = st.session_state.worker
+    
+    # 作为片段单独重跑时，工作线程状态或迭代变化需要整页重跑以更新提示词和按钮
+    signature = (worker.status if worker is not None else None, state.current_iteration)
+    if FRAGMENTS_SUPPORTED and st.session_state.get("panel_signature", signature) != signature:
+        st.session_state.panel_signature = signature
+        st.rerun()
+    st.session_state.panel_signature = signature
     
-    # 状态栏
     col1, col2, col3 = st.columns([2, 6, 2])
     
     with col1:
-        st.markdown(f"**迭代进度:** {st.session_state.current_iteration}/{st.session_state.max_iterations}")
+        st.markdown(f"**迭代进度:** {state.current_iteration}/{settings.max_iterations}")
     
     with col2:
-        progress = st.progress(st.session_state.current_iteration / st.session_state.max_iterations)
+        st.progress(state.current_iteration / settings.max_iterations)
     
     with col3:
-        if st.session_state.is_optimizing:
-            status = "正在优化..."
-        else:
+        if worker is None or not worker.active:
             status = "等待操作..."
+        elif worker.status == PAUSING:
+            status = "正在暂停（当前迭代结束后生效）..."
+        elif worker.status == PAUSED:
+            status = "已暂停"
+        elif worker.status == CANCELLING:
+            status = "正在取消..."
+        else:
+            status = "正在优化..."
         st.markdown(f"**状态:** {status}")
     
+    if worker is not None and worker.status in (RUNNING, PAUSING, CANCELLING) and worker.iteration > state.current_iteration:
+        st.caption(f"第 {worker.iteration} 次优化：已完成 {worker.samples_done} 次样本评估")
+
+# 样本面板：当前页的样本及当前输出、新输出和评估结果
+def show_samples_panel():
+    state = st.session_state.state
+    worker = st.session_state.worker
+    
+    # 正在生成的输出：工作线程可能同时写入，先取快照；种群模式下只显示第一个候选
+    live_outputs = {}
+    if worker is not None and worker.status in (RUNNING, PAUSING):
+        live_candidates = st.session_state.live_outputs.copy()
+        if live_candidates:
+            live_outputs = next(iter(live_candidates.values())).copy()
+    
+    if state.sample_version:
+        st.caption(f"样本集第 {state.sample_version} 版，共 {len(state.samples)} 个样本")
+    
+    for sample in paginate(state.samples, "samples_page", SAMPLES_PER_PAGE):
+        sample_id = sample['id']
+        
+        with st.expander(f"样本 {sample_id}: {sample['question'][:50]}...", expanded=True):
+            st.markdown(f"**问题:** {sample['question']}")
+            
+            if sample_id in state.current_best_outputs:
+                st.markdown("**当前输出:**")
+                current_output = state.current_best_outputs[sample_id]
+                st.markdown(f"<div class='output-container'>{current_output}</div>", unsafe_allow_html=True)
+            
+            if sample_id in live_outputs:
+                st.markdown("**新输出（生成中）:**")
+                st.markdown(f"<div class='output-container'>{live_outputs[sample_id]}</div>", unsafe_allow_html=True)
+            elif state.new_outputs and sample_id in state.new_outputs:
+                st.markdown("**新输出:**")
+                new_output = state.new_outputs[sample_id]
+                
+                # 添加评估结果样式
+                css_class = ""
+                if state.evaluations and sample_id in state.evaluations:
+                    result = state.evaluations[sample_id]
+                    if result == "B更好":
+                        css_class = "better"
+                    elif result == "A更好":
+                        css_class = "worse"
+                    else:
+                        css_class = "similar"
+                
+                st.markdown(f"<div class='output-container {css_class}'>{new_output}</div>", unsafe_allow_html=True)
+                
+                if state.evaluations and sample_id in state.evaluations:
+                    result = state.evaluations[sample_id]
+                    st.markdown(f"**评估结果:** {result}")
+
+# 优化历史：最近的迭代在前，分页显示；提示词、分析和输出只在展开某条记录时读取
+def show_history(state, key):
+    indexes = paginate(list(reversed(range(len(state.optimization_history)))), f"{key}_page", HISTORY_PER_PAGE)
+    
+    for index in indexes:
+        entry = state.optimization_history[index]
+        label = f"迭代 {entry['iteration']} - {'改进成功' if entry['is_better'] else '未改进'} (净胜 {entry['score']})"
+        if not st.toggle(label, key=f"{key}_open_{entry['iteration']}"):
+            continue
+        
+        item = state.history_item(index)
+        with st.container(border=True):
+            if item.get('decided_early'):
+                st.markdown("*已提前判定胜负，部分样本的评估被跳过*")
+            if item.get('eliminated_at'):
+                st.markdown(f"*在 {item['eliminated_at']} 个样本的子集上被淘汰*")
+            if item.get('duplicate_of') is not None:
+                st.markdown(f"*与迭代 {item['duplicate_of']} 中的提示重复或过于相似，未重新执行和评估*")
+            if item.get('speculation') == "hit":
+                st.markdown("*候选在上一轮评估期间提前生成*")
+            elif item.get('speculation') == "miss":
+                st.markdown("*上一轮候选胜出，提前生成的候选已作废*")
+            if item.get('candidates'):
+                st.markdown("**本轮候选:**")
+                for number, candidate in enumerate(item['candidates'], 1):
+                    status = "胜出" if candidate['is_better'] else "未胜出"
+                    if candidate.get('duplicate_of') is not None:
+                        status += f"，与迭代 {candidate['duplicate_of']} 重复"
+                    st.markdown(f"- 候选 {number} (温度 {candidate['temperature']}): 净胜 {candidate['score']}，{status}")
+            
+            st.markdown(f"**提示词:**")
+            st.text_area(f"{key}_prompt_{item['iteration']}", value=item['prompt'], height=100, label_visibility="collapsed")
+            
+            st.markdown("**评估结果:**")
+            for sample_id, result in item['evaluations'].items():
+                st.markdown(f"- 样本 {sample_id}: {result}")
+            
+            if item.get('failures'):
+                st.markdown("**失败的调用:**")
+                for sample_id, error in item['failures'].items():
+                    st.markdown(f"- 样本 {sample_id}: {error}")
+            
+            st.markdown("**分析:**")
+            st.markdown(item['analysis'])
+            
+            if item.get('output_refs') and st.checkbox("显示各样本输出", key=f"{key}_outputs_{item['iteration']}"):
+                for sample_id, output in state.history_outputs(index).items():
+                    st.markdown(f"**样本 {sample_id}:**")
+                    st.markdown(f"<div class='output-container'>{output}</div>", unsafe_allow_html=True)
+
+# 优化视图
+def show_optimization_view():
+    state = st.session_state.state
+    settings = st.session_state.settings
+    worker = st.session_state.worker
+    
+    # 全部迭代完成后进入结果页
+    if worker is not None and worker.status == FINISHED:
+        st.session_state.worker = None
+        st.session_state.current_view = "results"
+        st.rerun()
+    
+    st.markdown("<h1 class='main-header'>优化过程</h1>", unsafe_allow_html=True)
+    show_messages()
+    
+    polling = is_polling()
+    show_panel(show_progress_panel, POLL_INTERVAL if polling else None)
+    
+    show_metrics_panel()
+    
     # 主要内容
     col1, col2 = st.columns([1, 1])
     
@@ -446,24 +791,38 @@ def show_optimization_view():
         st.markdown("<h2 class='sub-header'>提示词比较</h2>", unsafe_allow_html=True)
         
         st.markdown("**当前最佳提示**")
-        st.text_area("current_best_prompt", value=st.session_state.current_best_prompt, height=200, label_visibility="collapsed")
+        st.text_area("current_best_prompt", value=state.current_best_prompt, height=200, label_visibility="collapsed")
         
-        if st.session_state.new_prompt:
+        if state.new_prompt:
             st.markdown("**新候选提示**")
-            st.text_area("new_prompt", value=st.session_state.new_prompt, height=200, label_visibility="collapsed")
+            st.text_area("new_prompt", value=state.new_prompt, height=200, label_visibility="collapsed")
         
-        if st.session_state.analysis:
+        if state.analysis:
             st.markdown("<h2 class='sub-header'>改进分析</h2>", unsafe_allow_html=True)
-            st.markdown(st.session_state.analysis)
+            st.markdown(state.analysis)
         
         # 控制按钮
-        if not st.session_state.is_optimizing:
-            col1, col2 = st.columns(2)
+        col1, col2 = st.columns(2)
+        
+        if is_optimizing():
+            with col1:
+                if worker.status == RUNNING:
+                    if st.button("暂停", key="pause_btn", help="当前迭代结束后暂停"):
+                        worker.pause()
+                        st.rerun()
+                elif worker.status in (PAUSING, PAUSED):
+                    if st.button("继续优化", key="resume_btn"):
+                        worker.resume()
+                        st.rerun()
             
+            with col2:
+                if worker.status != CANCELLING and st.button("取消", key="cancel_btn"):
+                    worker.cancel()
+                    st.rerun()
+        else:
             with col1:
-                if st.button("继续优化", key="continue_btn"):
-                    st.session_state.is_optimizing = True
-                    run_optimization_step()
+                if st.button("继续优化", key="continue_btn", disabled=state.current_iteration >= settings.max_iterations):
+                    start_optimization()
                     st.rerun()
             
             with col2:
@@ -474,65 +833,29 @@ def show_optimization_view():
     with col2:
         st.markdown("<h2 class='sub-header'>测试样本</h2>", unsafe_allow_html=True)
         
-        # 显示样本和输出
-        for sample in st.session_state.samples:
-            sample_id = sample['id']
-            
-            with st.expander(f"样本 {sample_id}: {sample['question'][:50]}...", expanded=True):
-                st.markdown(f"**问题:** {sample['question']}")
-                
-                if sample_id in st.session_state.current_best_outputs:
-                    st.markdown("**当前输出:**")
-                    current_output = st.session_state.current_best_outputs[sample_id]
-                    st.markdown(f"<div class='output-container'>{current_output}</div>", unsafe_allow_html=True)
-                
-                if st.session_state.new_outputs and sample_id in st.session_state.new_outputs:
-                    st.markdown("**新输出:**")
-                    new_output = st.session_state.new_outputs[sample_id]
-                    
-                    # 添加评估结果样式
-                    css_class = ""
-                    if st.session_state.evaluations and sample_id in st.session_state.evaluations:
-                        result = st.session_state.evaluations[sample_id]
-                        if result == "B更好":
-                            css_class = "better"
-                        elif result == "A更好":
-                            css_class = "worse"
-                        else:
-                            css_class = "similar"
-                    
-                    st.markdown(f"<div class='output-container {css_class}'>{new_output}</div>", unsafe_allow_html=True)
-                    
-                    if st.session_state.evaluations and sample_id in st.session_state.evaluations:
-                        result = st.session_state.evaluations[sample_id]
-                        st.markdown(f"**评估结果:** {result}")
+        if not polling:
+            run_every = None
+        elif settings.stream_outputs:
+            run_every = STREAM_POLL_INTERVAL
+        else:
+            run_every = POLL_INTERVAL
+        show_panel(show_samples_panel, run_every)
         
-        # 优化历史
-        if st.session_state.optimization_history:
+        if state.optimization_history:
             st.markdown("<h2 class='sub-header'>优化历史</h2>", unsafe_allow_html=True)
-            
-            for item in st.session_state.optimization_history:
-                css_class = "better" if item["is_better"] else "not-better"
-                
-                with st.expander(f"迭代 {item['iteration']} - {'改进成功' if item['is_better'] else '未改进'}", expanded=False):
-                    st.markdown(f"**提示词:**")
-                    st.text_area(f"prompt_{item['iteration']}", value=item['prompt'], height=100, label_visibility="collapsed")
-                    
-                    st.markdown("**评估结果:**")
-                    for sample_id, result in item['evaluations'].items():
-                        st.markdown(f"- 样本 {sample_id}: {result}")
-                    
-                    st.markdown("**分析:**")
-                    st.markdown(item['analysis'])
-        
-        # 如果是自动模式且正在优化，自动触发下一步
-        if st.session_state.auto_mode and st.session_state.is_optimizing and st.session_state.current_iteration > 0:
-            run_optimization_step()
-            st.rerun()
+            show_history(state, "history")
+    
+    # 不支持片段时，后台优化运行期间整页定期刷新以显示进度
+    if polling and not FRAGMENTS_SUPPORTED:
+        time.sleep(STREAM_POLL_INTERVAL if settings.stream_outputs else POLL_INTERVAL)
+        st.rerun()
 
 # 结果视图
 def show_results_view():
+    state = st.session_state.state
+    
     st.markdown("<h1 class='main-header'>优化结果</h1>", unsafe_allow_html=True)
+    show_messages()
     
     # 结果摘要
     st.markdown("<h2 class='sub-header'>优化摘要</h2>", unsafe_allow_html=True)
@@ -540,42 +863,29 @@ def show_results_view():
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("总迭代次数", st.session_state.current_iteration)
+        st.metric("总迭代次数", state.current_iteration)
     
     with col2:
-        better_count = sum(1 for item in st.session_state.optimization_history if item["is_better"])
+        better_count = sum(1 for item in state.optimization_history if item["is_better"])
         st.metric("成功改进次数", better_count)
     
     with col3:
-        improvement_rate = better_count / st.session_state.current_iteration if st.session_state.current_iteration > 0 else 0
+        improvement_rate = better_count / state.current_iteration if state.current_iteration > 0 else 0
         st.metric("改进成功率", f"{improvement_rate:.0%}")
     
     # 最终提示词
     st.markdown("<h2 class='sub-header'>最终优化提示词</h2>", unsafe_allow_html=True)
     
-    final_prompt = st.text_area("final_prompt", value=st.session_state.current_best_prompt, height=300, label_visibility="collapsed")
+    final_prompt = st.text_area("final_prompt", value=state.current_best_prompt, height=300, label_visibility="collapsed")
     
     if st.button("复制提示词"):
-        st.code(st.session_state.current_best_prompt)
+        st.code(state.current_best_prompt)
         st.success("提示词已复制到剪贴板（可以通过上方代码块复制）")
     
     # 优化历史
-    if st.session_state.optimization_history:
+    if state.optimization_history:
         st.markdown("<h2 class='sub-header'>优化历史</h2>", unsafe_allow_html=True)
-        
-        for item in st.session_state.optimization_history:
-            css_class = "better" if item["is_better"] else "not-better"
-            
-            with st.expander(f"迭代 {item['iteration']} - {'改进成功' if item['is_better'] else '未改进'}", expanded=False):
-                st.markdown(f"**提示词:**")
-                st.text_area(f"result_prompt_{item['iteration']}", value=item['prompt'], height=100, label_visibility="collapsed")
-                
-                st.markdown("**评估结果:**")
-                for sample_id, result in item['evaluations'].items():
-                    st.markdown(f"- 样本 {sample_id}: {result}")
-                
-                st.markdown("**分析:**")
-                st.markdown(item['analysis'])
+        show_history(state, "result")
     
     # 导出和重置按钮
     col1, col2 = st.columns(2)
@@ -584,17 +894,21 @@ def show_results_view():
         if st.button("导出历史"):
             export_data = {
                 "date": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "task_description": st.session_state.task_description,
-                "initial_prompt": st.session_state.current_best_prompt,
-                "iterations": st.session_state.current_iteration,
+                "task_description": state.task_description,
+                "initial_prompt": state.initial_prompt,
+                "iterations": state.current_iteration,
                 "history": [{
                     "iteration": item["iteration"],
                     "prompt": item["prompt"],
                     "is_better": item["is_better"],
                     "analysis": item["analysis"]
-                } for item in st.session_state.optimization_history]
+                } for item in state.to_dict()["optimization_history"]]
             }
             
+            # 附带每次后端调用的耗时和用量
+            if st.session_state.client.metrics is not None:
+                export_data["metrics"] = st.session_state.client.metrics.to_dict()
+            
             st.download_button(
                 label="下载JSON文件",
                 data=json.dumps(export_data, ensure_ascii=False, indent=2),
@@ -604,6 +918,8 @@ def show_results_view():
     
     with col2:
         if st.button("开始新的优化"):
+            stop_optimization()
+            
             # 重置会话状态
             for key in list(st.session_state.keys()):
                 if key != "available_models":
@@ -612,17 +928,15 @@ def show_results_view():
             st.session_state.initialized = False
             st.session_state.api_configured = False
             st.session_state.current_view = "config"
-            st.session_state.current_iteration = 0
-            st.session_state.max_iterations = 10
-            st.session_state.samples = []
-            st.session_state.current_best_prompt = ""
-            st.session_state.current_best_outputs = {}
-            st.session_state.new_prompt = ""
-            st.session_state.new_outputs = {}
-            st.session_state.evaluations = {}
-            st.session_state.analysis = ""
-            st.session_state.optimization_history = []
-            st.session_state.is_optimizing = False
+            st.session_state.worker = None
+            st.session_state.auto_mode = True
+            st.session_state.messages = []
+            st.session_state.live_outputs = {}
+            st.session_state.client = SPOClient(BACKEND_URL, use_cache=USE_CACHE, metrics=MetricsRecorder())
+            st.session_state.settings = OptimizerSettings()
+            st.session_state.state = OptimizationState()
+            st.session_state.checkpoint = None
+            st.session_state.pending = None
             
             st.rerun()
 
@@ -648,6 +962,17 @@ def main():
                 st.session_state.current_view = "results"
                 st.rerun()
         
+        st.markdown("---")
+        st.markdown("### 响应缓存")
+        response_cache = st.session_state.client.cache
+        st.markdown(f"命中: {response_cache.hits} / 未命中: {response_cache.misses}")
+        
+        scheduler = st.session_state.client.scheduler
+        if scheduler is not None and scheduler.snapshot():
+            st.markdown("### 调用并发")
+            for model, stats in scheduler.snapshot().items():
+                st.markdown(f"{model}: 上限 {stats['limit']:g}，进行中 {stats['in_flight']}，排队 {stats['waiting']}")
+        
         st.markdown("---")
         st.markdown("### 关于")
         st.markdown("""
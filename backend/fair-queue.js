@@ -0,0 +1,68 @@
+/**
+ * 按会话轮转的公平队列
+ *
+ * 所有会话的模型调用共享一个并发上限；等待中的调用按会话分组，
+ * 每次有空闲额度时依次从下一个会话取出一个调用，
+ * 一个排队很多的会话（如自动模式下的大批量运行）不会让其他会话一直等待。
+ */
+class FairQueue {
+  /**
+   * @param {number} limit - 同时进行的调用数上限
+   */
+  constructor(limit) {
+    this.limit = limit;
+    this.active = 0;
+    // Map 保持插入顺序：取出一个调用后把该会话移到末尾，实现轮转
+    this.queues = new Map();
+  }
+
+  /**
+   * 在获得额度后执行 task
+   * @param {string} key - 会话标识
+   * @param {Function} task - 返回 Promise 的函数
+   * @returns {Promise} - task 的结果
+   */
+  run(key, task) {
+    return new Promise((resolve, reject) => {
+      if (!this.queues.has(key)) {
+        this.queues.set(key, []);
+      }
+      this.queues.get(key).push({ task, resolve, reject });
+      this.drain();
+    });
+  }
+
+  drain() {
+    while (this.active < this.limit && this.queues.size > 0) {
+      const [key, queue] = this.queues.entries().next().value;
+      const job = queue.shift();
+      this.queues.delete(key);
+      if (queue.length > 0) {
+        this.queues.set(key, queue);
+      }
+
+      this.active++;
+      Promise.resolve()
+        .then(job.task)
+        .then(job.resolve, job.reject)
+        .finally(() => {
+          this.active--;
+          this.drain();
+        });
+    }
+  }
+
+  /**
+   * 当前进行中、排队中的调用数，以及有调用在排队的会话数
+   * @returns {Object}
+   */
+  snapshot() {
+    let waiting = 0;
+    for (const queue of this.queues.values()) {
+      waiting += queue.length;
+    }
+    return { limit: this.limit, active: this.active, waiting, sessions: this.queues.size };
+  }
+}
+
+module.exports = FairQueue;
@@ -1,4 +1,48 @@
 const axios = require('axios');
+const http = require('http');
+const https = require('https');
+
+// 所有会话共享的长连接池，避免每次调用都重新建立到模型服务的连接
+const UPSTREAM_MAX_SOCKETS = parseInt(process.env.UPSTREAM_MAX_SOCKETS || '64', 10);
+// 模型服务调用的超时（秒）；应小于客户端的 API_READ_TIMEOUT，使客户端收到 504 并降低并发
+const UPSTREAM_TIMEOUT = parseFloat(process.env.UPSTREAM_TIMEOUT || '150');
+const httpClient = axios.create({
+  timeout: UPSTREAM_TIMEOUT * 1000,
+  httpAgent: new http.Agent({ keepAlive: true, maxSockets: UPSTREAM_MAX_SOCKETS }),
+  httpsAgent: new https.Agent({ keepAlive: true, maxSockets: UPSTREAM_MAX_SOCKETS })
+});
+
+/**
+ * 把服务商返回的 token 用量写入调用方提供的对象
+ * @param {Object} usage - 调用方提供的对象，可能为空
+ * @param {Object} reported - 服务商返回的 usage 字段
+ */
+function recordUsage(usage, reported) {
+  if (!usage || !reported) return;
+  usage.promptTokens = reported.prompt_tokens;
+  usage.completionTokens = reported.completion_tokens;
+  usage.totalTokens = reported.total_tokens;
+}
+
+/**
+ * 解析快速评估模型返回的判定和置信度
+ * @param {string} response - 模型响应，应为 {"evaluation": ..., "confidence": ...} 形式的 JSON
+ * @returns {Object} - { evaluation, confidence }，无法解析时判为相似且置信度为 0
+ */
+function parseScreening(response) {
+  const evaluationMatch = response.match(/A更好|B更好|相似/);
+  const confidenceMatch = response.match(/"?confidence"?\s*[:：]\s*([0-9.]+)/);
+  
+  if (!evaluationMatch) {
+    return { evaluation: "相似", confidence: 0 };
+  }
+  
+  const confidence = confidenceMatch ? parseFloat(confidenceMatch[1]) : 0;
+  return {
+    evaluation: evaluationMatch[0],
+    confidence: Number.isFinite(confidence) ? Math.min(1, Math.max(0, confidence)) : 0
+  };
+}
 
 /**
  * LLM服务 - 与硅基流动API集成
@@ -9,15 +53,21 @@ class LLMService {
    * @param {string} apiKey - API密钥
    * @param {string} baseUrl - API基础URL
    * @param {Object} defaultModels - 默认使用的模型配置
+   * @param {Object} options - 可选，sessionId 为会话标识，queue 为各会话共享的 FairQueue
    */
-  constructor(apiKey, baseUrl, defaultModels = null) {
+  constructor(apiKey, baseUrl, defaultModels = null, options = {}) {
     this.apiKey = apiKey;
     this.baseUrl = baseUrl;
-    this.defaultModels = defaultModels || {
+    this.sessionId = options.sessionId || null;
+    this.queue = options.queue || null;
+    // 未指定的模型角色使用环境变量中的默认模型
+    this.defaultModels = {
       optimizer: process.env.DEFAULT_OPTIMIZER_MODEL || "Qwen/QwQ-32B",
       executor: process.env.DEFAULT_EXECUTOR_MODEL || "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
       evaluator: process.env.DEFAULT_EVALUATOR_MODEL || "Pro/deepseek-ai/DeepSeek-V3",
-      analyzer: process.env.DEFAULT_ANALYZER_MODEL || "Pro/deepseek-ai/DeepSeek-R1"
+      analyzer: process.env.DEFAULT_ANALYZER_MODEL || "Pro/deepseek-ai/DeepSeek-R1",
+      screener: process.env.DEFAULT_SCREENER_MODEL || "Qwen/Qwen2.5-7B-Instruct",
+      ...(defaultModels || {})
     };
     
     this.headers = {
@@ -28,15 +78,25 @@ class LLMService {
     this.enableStreaming = process.env.ENABLE_STREAMING === 'true';
   }
   
+  /**
+   * 通过共享队列发起对模型服务的请求，未配置队列时直接执行
+   * @param {Function} task - 返回 Promise 的函数
+   * @returns {Promise}
+   */
+  schedule(task) {
+    return this.queue ? this.queue.run(this.sessionId, task) : task();
+  }
+  
   /**
    * 调用模型
    * @param {string} prompt - 提示词
    * @param {string} modelType - 模型类型 (optimizer, executor, evaluator, analyzer)
    * @param {number} temperature - 温度参数
    * @param {boolean} stream - 是否使用流式输出
+   * @param {Object} usage - 可选，调用完成后写入所用模型和服务商报告的 token 用量
    * @returns {Promise<string>} - 模型响应
    */
-  async callModel(prompt, modelType, temperature = 0.7, stream = false) {
+  async callModel(prompt, modelType, temperature = 0.7, stream = false, usage = null) {
     try {
       const model = this.defaultModels[modelType];
       
@@ -57,16 +117,21 @@ class LLMService {
         response_format: { type: "text" }
       };
       
+      if (usage) {
+        usage.model = model;
+      }
+      
       if (stream && this.enableStreaming) {
-        return this.streamResponse(payload);
+        return this.streamResponse(payload, null, usage);
       } else {
-        const response = await axios.post(
+        const response = await this.schedule(() => httpClient.post(
           `${this.baseUrl}/v1/chat/completions`,
           payload,
           { headers: this.headers }
-        );
+        ));
         
         if (response.status === 200 && response.data.choices && response.data.choices.length > 0) {
+          recordUsage(usage, response.data.usage);
           return response.data.choices[0].message.content;
         } else {
           throw new Error(`API响应异常: ${JSON.stringify(response.data)}`);
@@ -78,14 +143,58 @@ class LLMService {
     }
   }
   
+  /**
+   * 调用模型并逐段回调生成的文本
+   * 未开启流式输出时整段回调一次
+   * @param {string} prompt - 提示词
+   * @param {string} modelType - 模型类型
+   * @param {number} temperature - 温度参数
+   * @param {Function} onToken - 每收到一段文本时调用
+   * @param {Object} usage - 可选，写入所用模型和 token 用量
+   * @returns {Promise<string>} - 完整响应
+   */
+  async callModelStream(prompt, modelType, temperature, onToken, usage = null) {
+    if (!this.enableStreaming) {
+      const output = await this.callModel(prompt, modelType, temperature, false, usage);
+      onToken(output);
+      return output;
+    }
+    
+    const model = this.defaultModels[modelType];
+    if (!model) {
+      throw new Error(`未知的模型类型: ${modelType}`);
+    }
+    if (usage) {
+      usage.model = model;
+    }
+    
+    return this.streamResponse({
+      model: model,
+      messages: [{ role: "user", content: prompt }],
+      temperature: temperature,
+      stream: true,
+      max_tokens: 2048,
+      top_p: 0.7,
+      top_k: 50,
+      frequency_penalty: 0.5,
+      n: 1,
+      response_format: { type: "text" }
+    }, onToken, usage);
+  }
+  
   /**
    * 流式响应处理
    * @param {Object} payload - 请求负载
+   * @param {Function} onToken - 可选，每收到一段文本时调用
+   * @param {Object} usage - 可选，写入服务商在流中报告的 token 用量
    * @returns {Promise<string>} - 完整响应
    */
-  async streamResponse(payload) {
-    return new Promise((resolve, reject) => {
+  async streamResponse(payload, onToken = null, usage = null) {
+    // 整个流读取完毕后才释放队列额度
+    return this.schedule(() => new Promise((resolve, reject) => {
       let fullResponse = '';
+      // 一行数据可能被拆到两个 chunk 中，未结束的行留到下一次处理
+      let buffer = '';
       
       const config = {
         method: 'post',
@@ -98,11 +207,14 @@ class LLMService {
         responseType: 'stream'
       };
       
-      axios(config)
+      httpClient(config)
         .then(response => {
           response.data.on('data', (chunk) => {
             try {
-              const lines = chunk.toString().split('\n').filter(line => line.trim() !== '');
+              buffer += chunk.toString();
+              const parts = buffer.split('\n');
+              buffer = parts.pop();
+              const lines = parts.filter(line => line.trim() !== '');
               
               for (const line of lines) {
                 if (line.includes('[DONE]')) continue;
@@ -113,8 +225,12 @@ class LLMService {
                 
                 try {
                   const parsedData = JSON.parse(jsonData);
+                  // 部分服务商在最后一个数据块中附带用量
+                  recordUsage(usage, parsedData.usage);
                   if (parsedData.choices && parsedData.choices[0].delta && parsedData.choices[0].delta.content) {
-                    fullResponse += parsedData.choices[0].delta.content;
+                    const token = parsedData.choices[0].delta.content;
+                    fullResponse += token;
+                    if (onToken) onToken(token);
                   }
                 } catch (e) {
                   console.warn('解析流数据失败:', e);
@@ -136,7 +252,7 @@ class LLMService {
         .catch(error => {
           reject(error);
         });
-    });
+    }));
   }
   
   /**
@@ -145,9 +261,11 @@ class LLMService {
    * @param {string} currentOutput - 当前输出
    * @param {string} taskDescription - 任务描述
    * @param {string} history - 优化历史
+   * @param {number} temperature - 温度参数，用于生成多样化的候选
+   * @param {Object} usage - 可选，写入模型和 token 用量
    * @returns {Promise<string>} - 优化后的提示词
    */
-  async optimizePrompt(currentPrompt, currentOutput, taskDescription, history = "") {
+  async optimizePrompt(currentPrompt, currentOutput, taskDescription, history = "", temperature = 0.7, usage = null) {
     const promptTemplate = `你是一个专业的提示词优化专家。请分析以下当前提示及其生成的输出，并创建一个改进版提示。
     
     任务需求: ${taskDescription}
@@ -165,18 +283,32 @@ class LLMService {
     
     仅返回改进后的完整提示词，不需要解释。`;
     
-    return this.callModel(promptTemplate, "optimizer", 0.7, true);
+    return this.callModel(promptTemplate, "optimizer", temperature, true, usage);
   }
   
   /**
    * 执行提示词
    * @param {string} prompt - 提示词
    * @param {string} question - 问题/测试样本
+   * @param {Object} usage - 可选，写入模型和 token 用量
    * @returns {Promise<string>} - 执行结果
    */
-  async executePrompt(prompt, question) {
+  async executePrompt(prompt, question, usage = null) {
     const fullPrompt = `${prompt}\n\n${question}`;
-    return this.callModel(fullPrompt, "executor", 0.7, true);
+    return this.callModel(fullPrompt, "executor", 0.7, true, usage);
+  }
+  
+  /**
+   * 流式执行提示词
+   * @param {string} prompt - 提示词
+   * @param {string} question - 问题/测试样本
+   * @param {Function} onToken - 每收到一段文本时调用
+   * @param {Object} usage - 可选，写入模型和 token 用量
+   * @returns {Promise<string>} - 完整执行结果
+   */
+  async executePromptStream(prompt, question, onToken, usage = null) {
+    const fullPrompt = `${prompt}\n\n${question}`;
+    return this.callModelStream(fullPrompt, "executor", 0.7, onToken, usage);
   }
   
   /**
@@ -185,9 +317,10 @@ class LLMService {
    * @param {string} outputB - 输出B
    * @param {string} taskDescription - 任务描述
    * @param {string} question - 问题/测试样本
+   * @param {Object} usage - 可选，写入模型和 token 用量
    * @returns {Promise<string>} - 评估结果
    */
-  async evaluateOutputs(outputA, outputB, taskDescription, question) {
+  async evaluateOutputs(outputA, outputB, taskDescription, question, usage = null) {
     const promptTemplate = `你是一个公正的评估专家。请比较以下两个输出，确定哪个更符合任务需求。
     
     任务需求: ${taskDescription}
@@ -201,7 +334,62 @@ class LLMService {
     请根据相关性、准确性、完整性、清晰度等方面进行评估。
     只返回一个选项: "A更好", "B更好", 或 "相似"。不需要解释。`;
     
-    return this.callModel(promptTemplate, "evaluator", 0.3, false);
+    return this.callModel(promptTemplate, "evaluator", 0.3, false, usage);
+  }
+  
+  /**
+   * 快速评估：由较小的模型比较两个输出，并给出判定的置信度
+   * @param {string} outputA - 输出A
+   * @param {string} outputB - 输出B
+   * @param {string} taskDescription - 任务描述
+   * @param {string} question - 问题/测试样本
+   * @param {Object} usage - 可选，写入模型和 token 用量
+   * @returns {Promise<Object>} - { evaluation, confidence }
+   */
+  async screenOutputs(outputA, outputB, taskDescription, question, usage = null) {
+    const promptTemplate = `你是一个公正的评估专家。请比较以下两个输出，确定哪个更符合任务需求，并给出你对这一判断的把握程度。
+    
+    任务需求: ${taskDescription}
+    
+    问题: ${question}
+    
+    输出A: ${outputA}
+    
+    输出B: ${outputB}
+    
+    请根据相关性、准确性、完整性、清晰度等方面进行评估。
+    只返回一个JSON对象，不要使用markdown格式或代码块: {"evaluation": "A更好" 或 "B更好" 或 "相似", "confidence": 0到1之间的数字}。不需要解释。`;
+    
+    const response = await this.callModel(promptTemplate, "screener", 0.1, false, usage);
+    return parseScreening(response);
+  }
+  
+  /**
+   * 在一次调用中比较多组输出
+   * @param {Array} items - 比较项，每项包含 id、question、outputA、outputB
+   * @param {string} taskDescription - 任务描述
+   * @param {Object} usage - 可选，写入模型和 token 用量
+   * @returns {Promise<string>} - 模型的原始响应，应为 {"组号": 评估结果} 形式的 JSON
+   */
+  async evaluateOutputsBatch(items, taskDescription, usage = null) {
+    const groups = items.map(item => `### 第 ${item.id} 组
+    
+    问题: ${item.question}
+    
+    输出A: ${item.outputA}
+    
+    输出B: ${item.outputB}`).join('\n\n');
+    
+    const promptTemplate = `你是一个公正的评估专家。下面有若干组比较，每组包含一个问题和针对该问题的两个输出，请分别确定每组中哪个输出更符合任务需求。
+    
+    任务需求: ${taskDescription}
+    
+    ${groups}
+    
+    请根据相关性、准确性、完整性、清晰度等方面逐组评估，各组互不影响。
+    只返回一个JSON对象，不要使用markdown格式或代码块，键为组号，值为 "A更好", "B更好" 或 "相似"，例如 {"1": "B更好", "2": "相似"}。不需要解释。`;
+    
+    return this.callModel(promptTemplate, "evaluator", 0.3, false, usage);
   }
   
   /**
@@ -209,9 +397,10 @@ class LLMService {
    * @param {string} oldPrompt - 旧提示词
    * @param {string} newPrompt - 新提示词
    * @param {string} taskDescription - 任务描述
+   * @param {Object} usage - 可选，写入模型和 token 用量
    * @returns {Promise<string>} - 分析结果
    */
-  async analyzeChanges(oldPrompt, newPrompt, taskDescription) {
+  async analyzeChanges(oldPrompt, newPrompt, taskDescription, usage = null) {
     const promptTemplate = `你是一个提示词分析专家。请分析新提示相比旧提示的改进之处，并解释这些变化的目的和预期效果。
     
     任务需求: ${taskDescription}
@@ -228,19 +417,26 @@ class LLMService {
     
     返回一个结构化的分析报告。`;
     
-    return this.callModel(promptTemplate, "analyzer", 0.5, true);
+    return this.callModel(promptTemplate, "analyzer", 0.5, true, usage);
   }
   
   /**
    * 生成测试样本
    * @param {string} taskDescription - 任务描述
+   * @param {Object} usage - 可选，写入模型和 token 用量
+   * @param {Object} options - 可选，分片生成时的 count（样本数）和 shard（分片序号，从 0 开始）
    * @returns {Promise<Array>} - 测试样本数组
    */
-  async generateSamples(taskDescription) {
-    const promptTemplate = `请根据以下任务需求，生成3个多样化且具有代表性的测试问题/场景。
+  async generateSamples(taskDescription, usage = null, options = {}) {
+    const count = options.count || 3;
+    // 并行生成的各分片侧重不同的场景，减少彼此重复的问题
+    const shardHint = Number.isInteger(options.shard)
+      ? `\n    这是第${options.shard + 1}组样本，其他组由别的请求同时生成。请避开最常见、最容易想到的问题，侧重不同的场景、难度和表达方式。\n    `
+      : '';
+    const promptTemplate = `请根据以下任务需求，生成${count}个多样化且具有代表性的测试问题/场景。
     
     任务需求: ${taskDescription}
-    
+    ${shardHint}
     这些测试样本将用于评估提示词的效果。请确保:
     1. 样本多样化，涵盖不同难度和场景
     2. 样本能够测试提示词的关键功能
@@ -253,7 +449,7 @@ class LLMService {
       {"id": 3, "question": "样本问题3"}
     ]`;
     
-    const response = await this.callModel(promptTemplate, "optimizer", 0.7, false);
+    const response = await this.callModel(promptTemplate, "optimizer", 0.7, false, usage);
     
     try {
       // 尝试清理响应中可能存在的Markdown格式
@@ -1,10 +1,51 @@
 const express = require('express');
 const router = express.Router();
 const LLMService = require('../llm-service');
+const FairQueue = require('../fair-queue');
+const SessionStore = require('../session-store');
 
-// 初始化LLM服务
+// 未携带会话标识的请求（如网页前端）使用最近一次不带会话的配置
 let llmService = null;
 
+// 各客户端会话独立的配置，会话标识在请求头中携带
+const SESSION_HEADER = 'X-SPO-Session';
+const sessions = new SessionStore(
+  parseInt(process.env.SESSION_TTL_MINUTES || '120', 10) * 60 * 1000,
+  parseInt(process.env.MAX_SESSIONS || '500', 10)
+);
+
+// 所有会话共享的模型调用并发上限，空闲额度按会话轮转分配
+const upstreamQueue = new FairQueue(parseInt(process.env.UPSTREAM_MAX_CONCURRENCY || '64', 10));
+
+// 取出请求对应的 LLMService；尚未配置或会话已过期时发送错误响应并返回 null
+function serviceFor(req, res) {
+  const sessionId = req.get(SESSION_HEADER);
+  if (sessionId) {
+    const service = sessions.get(sessionId);
+    if (!service) {
+      // 410 提示客户端重新配置
+      res.status(410).json({ error: '会话不存在或已过期，请重新配置API' });
+    }
+    return service;
+  }
+  
+  if (!llmService) {
+    res.status(400).json({ error: '请先配置API' });
+  }
+  return llmService;
+}
+
+// 模型服务限流或超时时原样返回 429/504，便于客户端降低并发；其他错误返回 500
+function errorStatus(error) {
+  if (error.response && error.response.status === 429) {
+    return 429;
+  }
+  if (error.code === 'ECONNABORTED' || error.code === 'ETIMEDOUT') {
+    return 504;
+  }
+  return 500;
+}
+
 // 获取可用模型列表
 router.get('/models', (req, res) => {
   try {
@@ -21,17 +62,28 @@ router.get('/models', (req, res) => {
 // 配置API
 router.post('/config', (req, res) => {
   try {
-    const { apiKey, baseUrl, models } = req.body;
+    const { apiKey, baseUrl, models, session } = req.body;
     
     // 验证必要参数
     if (!apiKey || !baseUrl) {
       return res.status(400).json({ error: '缺少必要参数: API Key 和 Base URL' });
     }
     
+    // 请求会话时配置只对该会话生效，请求头中带有未过期的会话标识时更新该会话
+    // 响应中的 models 为补全默认模型后各角色实际使用的模型，客户端用于区分缓存
+    if (session) {
+      const sessionId = sessions.set(
+        req.get(SESSION_HEADER),
+        (id) => new LLMService(apiKey, baseUrl, models, { sessionId: id, queue: upstreamQueue })
+      );
+      const service = sessions.get(sessionId);
+      return res.json({ success: true, message: 'API配置成功', sessionId, models: service.defaultModels });
+    }
+    
     // 初始化LLM服务
-    llmService = new LLMService(apiKey, baseUrl, models);
+    llmService = new LLMService(apiKey, baseUrl, models, { sessionId: 'default', queue: upstreamQueue });
     
-    res.json({ success: true, message: 'API配置成功' });
+    res.json({ success: true, message: 'API配置成功', models: llmService.defaultModels });
   } catch (error) {
     console.error('API配置错误:', error);
     res.status(500).json({ error: '配置API时出错', details: error.message });
@@ -41,57 +93,58 @@ router.post('/config', (req, res) => {
 // 生成测试样本
 router.post('/generate-samples', async (req, res) => {
   try {
-    if (!llmService) {
-      return res.status(400).json({ error: '请先配置API' });
-    }
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
     
-    const { taskDescription } = req.body;
+    const { taskDescription, count, shard } = req.body;
     
     if (!taskDescription) {
       return res.status(400).json({ error: '缺少任务描述' });
     }
     
-    const samples = await llmService.generateSamples(taskDescription);
-    res.json({ success: true, samples });
+    const usage = {};
+    const samples = await llmService.generateSamples(taskDescription, usage, { count, shard });
+    res.json({ success: true, samples, usage });
   } catch (error) {
     console.error('生成样本错误:', error);
-    res.status(500).json({ error: '生成测试样本时出错', details: error.message });
+    res.status(errorStatus(error)).json({ error: '生成测试样本时出错', details: error.message });
   }
 });
 
 // 优化提示
 router.post('/optimize-prompt', async (req, res) => {
   try {
-    if (!llmService) {
-      return res.status(400).json({ error: '请先配置API' });
-    }
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
     
-    const { currentPrompt, currentOutput, taskDescription, history } = req.body;
+    const { currentPrompt, currentOutput, taskDescription, history, temperature } = req.body;
     
     if (!currentPrompt || !taskDescription) {
       return res.status(400).json({ error: '缺少必要参数' });
     }
     
+    const usage = {};
     const newPrompt = await llmService.optimizePrompt(
       currentPrompt, 
       currentOutput || '', 
       taskDescription, 
-      history || ''
+      history || '',
+      typeof temperature === 'number' ? temperature : undefined,
+      usage
     );
     
-    res.json({ success: true, newPrompt });
+    res.json({ success: true, newPrompt, usage });
   } catch (error) {
     console.error('优化提示错误:', error);
-    res.status(500).json({ error: '优化提示时出错', details: error.message });
+    res.status(errorStatus(error)).json({ error: '优化提示时出错', details: error.message });
   }
 });
 
 // 执行提示
 router.post('/execute-prompt', async (req, res) => {
   try {
-    if (!llmService) {
-      return res.status(400).json({ error: '请先配置API' });
-    }
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
     
     const { prompt, question } = req.body;
     
@@ -99,20 +152,52 @@ router.post('/execute-prompt', async (req, res) => {
       return res.status(400).json({ error: '缺少必要参数' });
     }
     
-    const output = await llmService.executePrompt(prompt, question);
-    res.json({ success: true, output });
+    const usage = {};
+    const output = await llmService.executePrompt(prompt, question, usage);
+    res.json({ success: true, output, usage });
   } catch (error) {
     console.error('执行提示错误:', error);
-    res.status(500).json({ error: '执行提示时出错', details: error.message });
+    res.status(errorStatus(error)).json({ error: '执行提示时出错', details: error.message });
+  }
+});
+
+// 流式执行提示，以 text/event-stream 逐段返回输出
+// 每个事件为 {"token": "..."}，结束时发送 {"done": true, "output": "完整输出"}，出错时发送 {"error": "..."}
+router.post('/execute-prompt/stream', async (req, res) => {
+  const llmService = serviceFor(req, res);
+  if (!llmService) return;
+  
+  const { prompt, question } = req.body;
+  
+  if (!prompt || !question) {
+    return res.status(400).json({ error: '缺少必要参数' });
+  }
+  
+  res.set({
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive'
+  });
+  res.flushHeaders();
+  
+  const send = (data) => res.write(`data: ${JSON.stringify(data)}\n\n`);
+  
+  try {
+    const usage = {};
+    const output = await llmService.executePromptStream(prompt, question, (token) => send({ token }), usage);
+    send({ done: true, output, usage });
+  } catch (error) {
+    console.error('流式执行提示错误:', error);
+    send({ error: '执行提示时出错', details: error.message });
   }
+  res.end();
 });
 
 // 评估输出
 router.post('/evaluate-outputs', async (req, res) => {
   try {
-    if (!llmService) {
-      return res.status(400).json({ error: '请先配置API' });
-    }
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
     
     const { outputA, outputB, taskDescription, question } = req.body;
     
@@ -120,26 +205,78 @@ router.post('/evaluate-outputs', async (req, res) => {
       return res.status(400).json({ error: '缺少必要参数' });
     }
     
+    const usage = {};
     const evaluation = await llmService.evaluateOutputs(
       outputA, 
       outputB, 
       taskDescription, 
-      question
+      question,
+      usage
     );
     
-    res.json({ success: true, evaluation });
+    res.json({ success: true, evaluation, usage });
   } catch (error) {
     console.error('评估输出错误:', error);
-    res.status(500).json({ error: '评估输出时出错', details: error.message });
+    res.status(errorStatus(error)).json({ error: '评估输出时出错', details: error.message });
+  }
+});
+
+// 快速评估：返回判定和置信度，由调用方决定是否交给评估模型复核
+router.post('/evaluate-outputs/screen', async (req, res) => {
+  try {
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
+    
+    const { outputA, outputB, taskDescription, question } = req.body;
+    
+    if (!outputA || !outputB || !taskDescription || !question) {
+      return res.status(400).json({ error: '缺少必要参数' });
+    }
+    
+    const usage = {};
+    const { evaluation, confidence } = await llmService.screenOutputs(
+      outputA,
+      outputB,
+      taskDescription,
+      question,
+      usage
+    );
+    
+    res.json({ success: true, evaluation, confidence, usage });
+  } catch (error) {
+    console.error('快速评估错误:', error);
+    res.status(errorStatus(error)).json({ error: '快速评估时出错', details: error.message });
+  }
+});
+
+// 打包评估：一次比较多组输出
+router.post('/evaluate-outputs/batch', async (req, res) => {
+  try {
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
+    
+    const { items, taskDescription } = req.body;
+    
+    if (!Array.isArray(items) || items.length === 0 || !taskDescription ||
+        items.some(item => item.id === undefined || !item.question)) {
+      return res.status(400).json({ error: '缺少必要参数' });
+    }
+    
+    const usage = {};
+    const evaluation = await llmService.evaluateOutputsBatch(items, taskDescription, usage);
+    
+    res.json({ success: true, evaluation, usage });
+  } catch (error) {
+    console.error('打包评估错误:', error);
+    res.status(errorStatus(error)).json({ error: '打包评估时出错', details: error.message });
   }
 });
 
 // 分析提示变化
 router.post('/analyze-changes', async (req, res) => {
   try {
-    if (!llmService) {
-      return res.status(400).json({ error: '请先配置API' });
-    }
+    const llmService = serviceFor(req, res);
+    if (!llmService) return;
     
     const { oldPrompt, newPrompt, taskDescription } = req.body;
     
@@ -147,22 +284,29 @@ router.post('/analyze-changes', async (req, res) => {
       return res.status(400).json({ error: '缺少必要参数' });
     }
     
+    const usage = {};
     const analysis = await llmService.analyzeChanges(
       oldPrompt, 
       newPrompt, 
-      taskDescription
+      taskDescription,
+      usage
     );
     
-    res.json({ success: true, analysis });
+    res.json({ success: true, analysis, usage });
   } catch (error) {
     console.error('分析变化错误:', error);
-    res.status(500).json({ error: '分析提示变化时出错', details: error.message });
+    res.status(errorStatus(error)).json({ error: '分析提示变化时出错', details: error.message });
   }
 });
 
 // 健康检查
 router.get('/health', (req, res) => {
-  res.json({ status: 'ok', message: 'SPO+ API服务正常运行' });
+  res.json({
+    status: 'ok',
+    message: 'SPO+ API服务正常运行',
+    sessions: sessions.size,
+    upstream: upstreamQueue.snapshot()
+  });
 });
 
 module.exports = router; 
\ No newline at end of file
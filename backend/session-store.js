@@ -0,0 +1,79 @@
+const crypto = require('crypto');
+
+/**
+ * 会话配置
+ *
+ * 每个客户端会话有独立的 API Key、Base URL 和模型配置，以 sessionId 标识，
+ * 客户端在请求头 X-SPO-Session 中携带。长时间未使用的会话会被清理，
+ * 会话数超过上限时淘汰最久未使用的会话。
+ */
+class SessionStore {
+  /**
+   * @param {number} ttlMs - 会话的最长空闲时间（毫秒）
+   * @param {number} maxSessions - 会话数上限
+   */
+  constructor(ttlMs, maxSessions) {
+    this.ttlMs = ttlMs;
+    this.maxSessions = maxSessions;
+    // Map 保持插入顺序：每次使用时把会话移到末尾，最前面的是最久未使用的
+    this.sessions = new Map();
+
+    this.timer = setInterval(() => this.sweep(), Math.min(ttlMs, 60 * 1000));
+    // 清理定时器不阻止进程退出
+    this.timer.unref();
+  }
+
+  /**
+   * 保存会话的配置；sessionId 为空或不存在时创建新会话
+   * @param {string} sessionId - 已有的会话标识，可以为空
+   * @param {Function} createService - 以会话标识为参数，返回该会话的 LLMService
+   * @returns {string} - 会话标识
+   */
+  set(sessionId, createService) {
+    const id = sessionId && this.sessions.has(sessionId) ? sessionId : crypto.randomUUID();
+    this.sessions.delete(id);
+    this.sessions.set(id, { service: createService(id), lastUsed: Date.now() });
+
+    while (this.sessions.size > this.maxSessions) {
+      this.sessions.delete(this.sessions.keys().next().value);
+    }
+    return id;
+  }
+
+  /**
+   * 取出会话的 LLMService 并刷新使用时间，会话不存在或已过期时返回 null
+   * @param {string} sessionId - 会话标识
+   * @returns {Object|null}
+   */
+  get(sessionId) {
+    const session = this.sessions.get(sessionId);
+    if (!session) {
+      return null;
+    }
+    if (Date.now() - session.lastUsed > this.ttlMs) {
+      this.sessions.delete(sessionId);
+      return null;
+    }
+
+    session.lastUsed = Date.now();
+    this.sessions.delete(sessionId);
+    this.sessions.set(sessionId, session);
+    return session.service;
+  }
+
+  sweep() {
+    const now = Date.now();
+    for (const [id, session] of this.sessions) {
+      if (now - session.lastUsed <= this.ttlMs) {
+        break;
+      }
+      this.sessions.delete(id);
+    }
+  }
+
+  get size() {
+    return this.sessions.size;
+  }
+}
+
+module.exports = SessionStore;
@@ -0,0 +1,9 @@
+"""SPO+ 提示优化核心模块
+
+各子模块在导入时读取环境变量（并发上限、超时、缓存和检查点路径等），
+因此在导入任何子模块之前先加载 .env，界面、命令行和批量运行都能读到其中的配置。
+已经设置的环境变量不会被 .env 覆盖。
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,246 @@
+"""批量优化任务
+
+从 JSONL 文件读取多个优化任务并发运行，所有任务共享一个全局的后端调用预算；
+每个任务结束后立即把结果追加到输出 JSONL 文件，中断后重新运行会跳过已完成的任务。
+
+    python -m spo.batch tasks.jsonl --output results.jsonl
+
+任务文件每行一个 JSON 对象：
+
+    {"id": "poem", "task_description": "...", "initial_prompt": "...",
+     "max_iterations": 5, "models": {"executor": "..."}, "settings": {"population_size": 2}}
+
+模型配置相同的任务共用一个客户端（一个后端会话），不同配置的任务各自使用独立的会话，
+全部任务一起并发运行。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from .budget import describe_payload
+from .client import SPOClient
+from .concurrency import run_parallel
+from .engine import OptimizationState, Optimizer, OptimizerSettings
+from .transport import TransportError
+
+DEFAULT_BUDGET = 8
+DEFAULT_PARALLEL_TASKS = 4
+
+
+def load_tasks(path):
+    """读取任务文件，缺少 id 的任务按行号命名"""
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            task = json.loads(line)
+            task.setdefault("id", f"task-{line_number}")
+            tasks.append(task)
+    return tasks
+
+
+def load_completed_ids(path):
+    """读取输出文件中已成功完成的任务 id"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下不完整的最后一行
+                continue
+            if record.get("status") == "completed":
+                completed.add(record["id"])
+    return completed
+
+
+class BatchRunner:
+    """批量运行优化任务
+
+    Args:
+        backend_url: 后端 API 地址
+        api_key: 模型服务 API Key
+        base_url: 模型服务 Base URL
+        output_path: 结果输出的 JSONL 文件
+        budget: 所有任务共享的最大并发后端调用数
+        parallel_tasks: 同时运行的最大任务数
+        use_cache: 是否复用缓存的响应
+        on_event: 可选的事件回调 on_event(task_id, event, data)
+    """
+
+    def __init__(self, backend_url, api_key, base_url, output_path,
+                 budget=DEFAULT_BUDGET, parallel_tasks=DEFAULT_PARALLEL_TASKS,
+                 use_cache=True, on_event=None):
+        self.backend_url = backend_url
+        self.api_key = api_key
+        self.base_url = base_url
+        self.output_path = output_path
+        self.parallel_tasks = parallel_tasks
+        self.use_cache = use_cache
+        self.on_event = on_event
+        self.limiter = threading.BoundedSemaphore(budget)
+        self._output_lock = threading.Lock()
+
+    def emit(self, task_id, event, **data):
+        if self.on_event:
+            self.on_event(task_id, event, data)
+
+    def run(self, tasks):
+        """运行所有未完成的任务，返回 {"completed": n, "failed": n, "skipped": n}"""
+        completed_ids = load_completed_ids(self.output_path)
+        pending = [task for task in tasks if task["id"] not in completed_ids]
+        summary = {"completed": 0, "failed": 0, "skipped": len(tasks) - len(pending)}
+
+        # 按模型配置分组，每组一个在独立后端会话中配置的客户端；所有客户端共享同一个并发预算
+        groups = {}
+        for task in pending:
+            groups.setdefault(self._group_key(task), []).append(task)
+
+        clients = {}
+        for key, group in groups.items():
+            client = SPOClient(self.backend_url, use_cache=self.use_cache, limiter=self.limiter)
+            try:
+                client.configure(self.api_key, self.base_url, group[0].get("models"))
+            except TransportError as e:
+                for task in group:
+                    self._write(self._failure_record(task, f"API配置失败: {e}"))
+                    summary["failed"] += 1
+                continue
+            clients[key] = client
+
+        # 不同配置的任务在同一个任务池中同时运行
+        runnable = [task for task in pending if self._group_key(task) in clients]
+        results, errors = run_parallel(
+            lambda task: self.run_task(clients[self._group_key(task)], task),
+            runnable,
+            key=lambda task: task["id"],
+            max_workers=self.parallel_tasks
+        )
+
+        for record in results.values():
+            summary[record["status"]] += 1
+        for task in runnable:
+            if task["id"] in errors:
+                self._write(self._failure_record(task, errors[task["id"]]))
+                summary["failed"] += 1
+
+        return summary
+
+    @staticmethod
+    def _group_key(task):
+        return json.dumps(task.get("models") or {}, sort_keys=True)
+
+    def run_task(self, client, task):
+        """运行单个任务并写出结果记录"""
+        task_id = task["id"]
+        started = time.time()
+
+        settings = OptimizerSettings(**dict(
+            task.get("settings") or {},
+            max_iterations=task.get("max_iterations", OptimizerSettings.max_iterations)
+        ))
+        state = OptimizationState(
+            task_description=task["task_description"],
+            current_best_prompt=task["initial_prompt"]
+        )
+        optimizer = Optimizer(
+            client,
+            state,
+            settings,
+            on_event=lambda event, data: self.emit(task_id, event, **data)
+        )
+
+        self.emit(task_id, "task_started")
+        ok = optimizer.prepare() and optimizer.run()
+
+        record = {
+            "id": task_id,
+            "status": "completed" if ok else "failed",
+            "task_description": state.task_description,
+            "initial_prompt": task["initial_prompt"],
+            "final_prompt": state.current_best_prompt,
+            "iterations": state.current_iteration,
+            "improvements": sum(1 for item in state.optimization_history if item["is_better"]),
+            "elapsed": round(time.time() - started, 3),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "history": state.to_dict()["optimization_history"]
+        }
+        self._write(record)
+        self.emit(task_id, "task_finished", record=record)
+        return record
+
+    def _failure_record(self, task, error):
+        return {
+            "id": task["id"],
+            "status": "failed",
+            "task_description": task.get("task_description"),
+            "initial_prompt": task.get("initial_prompt"),
+            "error": str(error),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._output_lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m spo.batch", description="SPO+ 批量提示优化")
+    parser.add_argument("tasks", help="任务 JSONL 文件")
+    parser.add_argument("--output", required=True, help="结果 JSONL 文件，已完成的任务在重新运行时跳过")
+    parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET, help="所有任务共享的最大并发后端调用数")
+    parser.add_argument("--parallel-tasks", type=int, default=DEFAULT_PARALLEL_TASKS, help="同时运行的最大任务数")
+    parser.add_argument("--api-key", default=os.getenv("DEFAULT_API_KEY"), help="模型服务 API Key")
+    parser.add_argument("--base-url", default=os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn"),
+                        help="模型服务 Base URL")
+    parser.add_argument("--backend-url", default=f"http://localhost:{os.getenv('PORT', '3000')}/api",
+                        help="SPO+ 后端 API 地址")
+    parser.add_argument("--no-cache", action="store_true", help="不复用缓存的响应")
+    parser.add_argument("--quiet", action="store_true", help="不输出进度信息")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("需要提供 API Key（--api-key 或环境变量 DEFAULT_API_KEY）")
+
+    def on_event(task_id, event, data):
+        if args.quiet:
+            return
+        if event in ("warning", "error"):
+            print(f"[{task_id}] [{event}] {data['message']}", file=sys.stderr)
+        elif event == "optimizer_payload":
+            print(f"[{task_id}] 迭代 {data['iteration']}: {describe_payload(data)}", file=sys.stderr)
+        elif event == "iteration_finished":
+            item = data["item"]
+            print(f"[{task_id}] 迭代 {item['iteration']}: {'改进成功' if item['is_better'] else '未改进'}",
+                  file=sys.stderr)
+        elif event == "task_finished":
+            print(f"[{task_id}] {data['record']['status']}", file=sys.stderr)
+
+    runner = BatchRunner(
+        args.backend_url,
+        args.api_key,
+        args.base_url,
+        args.output,
+        budget=args.budget,
+        parallel_tasks=args.parallel_tasks,
+        use_cache=not args.no_cache and os.getenv("RESPONSE_CACHE", "on") != "off",
+        on_event=on_event
+    )
+    summary = runner.run(load_tasks(args.tasks))
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
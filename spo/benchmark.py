@@ -0,0 +1,213 @@
+"""优化器基准测试
+
+针对本地模拟后端（spo.mockserver）运行完整的优化流程，不产生任何模型调用费用。
+对不同的样本数和迭代次数分别测量每次迭代的耗时、调用数和峰值内存，
+并与保存的基线比较：
+
+    python -m spo.benchmark --samples 5,10,20 --iterations 3
+    python -m spo.benchmark --save-baseline
+
+超过基线（加上容差）的指标会被标记为回归，此时以非零状态退出。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .client import SPOClient
+from .engine import OptimizationState, Optimizer, OptimizerSettings
+from .metrics import MetricsRecorder
+from .mockserver import MockBackend
+from .ratelimit import RequestScheduler
+
+DEFAULT_SAMPLE_COUNTS = [5, 10, 20]
+DEFAULT_ITERATION_COUNTS = [3]
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+DEFAULT_TOLERANCE = 0.2
+
+# 模拟后端的默认延迟，量级按真实调用缩小约 100 倍
+DEFAULT_LATENCY = {
+    "generate-samples": "fixed:0.05",
+    "optimize-prompt": "uniform:0.03,0.08",
+    "execute-prompt": "uniform:0.02,0.06",
+    "evaluate-outputs": "uniform:0.01,0.03",
+    "evaluate-outputs/batch": "uniform:0.02,0.05",
+    "evaluate-outputs/screen": "uniform:0.003,0.01",
+    "analyze-changes": "uniform:0.02,0.05"
+}
+
+# 与基线比较的指标，数值越大越差
+COMPARED_METRICS = ("time_per_iteration", "calls_per_iteration", "peak_memory_kb")
+
+TASK_DESCRIPTION = "为用户的问题写一段简洁准确的回答"
+INITIAL_PROMPT = "你是一个乐于助人的助手。"
+
+
+def scenario_name(samples, iterations):
+    return f"samples={samples},iterations={iterations}"
+
+
+def run_scenario(samples, iterations, settings=None, latency=None, error_rate=None, seed=0):
+    """运行一个场景并返回测量结果
+
+    峰值内存由 tracemalloc 统计，包含同一进程中模拟后端的分配。
+    """
+    random.seed(seed)
+    latency = DEFAULT_LATENCY if latency is None else latency
+
+    with MockBackend(samples=samples, latency=latency, error_rate=error_rate, seed=seed) as backend:
+        metrics = MetricsRecorder(prices={})
+        client = SPOClient(backend.url, use_cache=False, scheduler=RequestScheduler(), metrics=metrics)
+        client.configure("benchmark", "http://mock.local")
+
+        state = OptimizationState(task_description=TASK_DESCRIPTION, current_best_prompt=INITIAL_PROMPT)
+        # 不复用保存的测试样本，每次测量都包含生成样本的调用
+        settings = OptimizerSettings(**dict(settings or {}, max_iterations=iterations, reuse_samples=False))
+        optimizer = Optimizer(client, state, settings)
+
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            prepared = optimizer.prepare()
+            prepare_time = time.perf_counter() - started
+
+            iteration_times = []
+            while prepared and not optimizer.finished:
+                started = time.perf_counter()
+                if optimizer.run_step() is None:
+                    break
+                iteration_times.append(time.perf_counter() - started)
+
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    summary = metrics.summary()
+    iteration_calls = [count for iteration, count in summary["calls_per_iteration"].items() if iteration > 0]
+    evaluator_calls = summary["by_role"].get("evaluator", {}).get("calls", 0)
+    cascade = summary.get("cascade")
+
+    return {
+        "name": scenario_name(samples, iterations),
+        "samples": samples,
+        "iterations": iterations,
+        "completed_iterations": len(iteration_times),
+        "prepare_time": round(prepare_time, 4),
+        "time_per_iteration": round(statistics.mean(iteration_times), 4) if iteration_times else None,
+        "max_iteration_time": round(max(iteration_times), 4) if iteration_times else None,
+        "calls_per_iteration": round(statistics.mean(iteration_calls), 2) if iteration_calls else None,
+        "evaluator_calls_per_iteration": round(evaluator_calls / len(iteration_times), 2) if iteration_times else None,
+        # 分级评估中快速评估直接采用的比例，其余交给评估模型
+        "cascade_hit_rate": cascade["hit_rate"] if cascade else None,
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+        "improvements": sum(1 for item in state.optimization_history if item["is_better"]),
+        "errors": sum(stats["errors"] for stats in summary["by_role"].values())
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """与基线比较，返回回归列表 [{"scenario", "metric", "baseline", "current"}]"""
+    baseline_by_name = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    regressions = []
+    for result in results:
+        reference = baseline_by_name.get(result["name"])
+        if reference is None:
+            continue
+        for metric in COMPARED_METRICS:
+            current = result.get(metric)
+            expected = reference.get(metric)
+            if current is None or expected is None:
+                continue
+            if current > expected * (1 + tolerance):
+                regressions.append({
+                    "scenario": result["name"],
+                    "metric": metric,
+                    "baseline": expected,
+                    "current": current
+                })
+    return regressions
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m spo.benchmark", description="SPO+ 优化器基准测试")
+    parser.add_argument("--samples", type=_int_list, default=DEFAULT_SAMPLE_COUNTS, help="样本数列表，逗号分隔")
+    parser.add_argument("--iterations", type=_int_list, default=DEFAULT_ITERATION_COUNTS, help="迭代次数列表，逗号分隔")
+    parser.add_argument("--population", type=int, default=1, help="每轮候选数")
+    parser.add_argument("--racing", action="store_true", help="启用竞速模式")
+    parser.add_argument("--packed-judging", action="store_true", help="启用打包评估")
+    parser.add_argument("--cascade", action="store_true", help="启用分级评估")
+    parser.add_argument("--speculative", action="store_true", help="启用提前生成下一轮候选")
+    parser.add_argument("--max-concurrency", type=int, help="最大并发数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="允许超出基线的比例")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    settings = {"population_size": args.population, "racing_enabled": args.racing}
+    if args.max_concurrency:
+        settings["max_concurrency"] = args.max_concurrency
+    if args.packed_judging:
+        settings["packed_judging"] = True
+    if args.cascade:
+        settings["cascade_enabled"] = True
+    if args.speculative:
+        settings["speculative"] = True
+
+    results = []
+    for iterations in args.iterations:
+        for samples in args.samples:
+            result = run_scenario(samples, iterations, settings, seed=args.seed)
+            results.append(result)
+            cascade = f"，快速评估直接采用 {result['cascade_hit_rate']:.0%}" if result["cascade_hit_rate"] is not None else ""
+            print(f"{result['name']}: 每次迭代 {result['time_per_iteration']} 秒，"
+                  f"{result['calls_per_iteration']} 次调用（评估模型 {result['evaluator_calls_per_iteration']} 次）"
+                  f"{cascade}，峰值内存 {result['peak_memory_kb']} KB",
+                  file=sys.stderr)
+
+    report = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": settings,
+        "scenarios": results
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"未找到基线 {args.baseline}，跳过比较", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print("基线使用的设置与本次不同，比较结果仅供参考", file=sys.stderr)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"回归: {regression['scenario']} 的 {regression['metric']} "
+              f"从 {regression['baseline']} 上升到 {regression['current']}", file=sys.stderr)
+    if not regressions:
+        print("没有发现回归", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""优化器输入的上下文预算
+
+optimize-prompt 请求附带当前最佳提示在全部样本上的输出，长度随样本数和输出长度增长，
+逐渐逼近优化模型的上下文长度，延迟也随之上升。这里按角色的 token 和字节预算构造
+输出部分：放得下时原样发送；放不下时按信息量排序（在比较中落败、判定有分歧的样本优先），
+依次放入并在必要时截断，预算用完后其余样本不再附带。
+"""
+import json
+import os
+
+from .decision import BETTER, WORSE
+from .judging import PROMPT_OVERHEAD_TOKENS, context_limit, estimate_tokens
+
+# 未配置预算的角色最多使用模型上下文的这一比例，其余留给模型的回复
+DEFAULT_BUDGET_FRACTION = 0.5
+
+# 截断后每个输出至少保留的 token 数，剩余预算不足时不再加入更多样本
+MIN_OUTPUT_TOKENS = 60
+
+TRUNCATION_MARK = "\n…（中间部分已省略）…\n"
+
+
+def load_payload_budgets():
+    """读取各角色的预算（环境变量 PAYLOAD_BUDGETS），格式为 {"角色": {"tokens": 数, "bytes": 数}}"""
+    value = os.getenv("PAYLOAD_BUDGETS")
+    if not value:
+        return {}
+    try:
+        return {role: dict(budget) for role, budget in json.loads(value).items()}
+    except (ValueError, TypeError, AttributeError):
+        return {}
+
+
+def payload_budget(role, model, budgets=None):
+    """角色的 token 预算；配置了字节预算时取两者中较小的一个（按 estimate_tokens 换算）"""
+    budgets = load_payload_budgets() if budgets is None else budgets
+    budget = budgets.get(role) or {}
+    tokens = int(budget.get("tokens") or context_limit(model) * DEFAULT_BUDGET_FRACTION)
+    if budget.get("bytes"):
+        tokens = min(tokens, int(budget["bytes"]) // 3)
+    return tokens
+
+
+def truncate_text(text, max_tokens):
+    """保留开头和结尾，截断到约 max_tokens 个 token"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    data = text.encode("utf-8")
+    keep = max(0, max_tokens * 3 - len(TRUNCATION_MARK.encode("utf-8")))
+    head = data[:keep * 2 // 3].decode("utf-8", errors="ignore")
+    tail = data[len(data) - (keep - keep * 2 // 3):].decode("utf-8", errors="ignore") if keep else ""
+    return head + TRUNCATION_MARK + tail
+
+
+def _json_tokens(text):
+    return estimate_tokens(json.dumps(text, ensure_ascii=False))
+
+
+def rank_samples(sample_ids, history):
+    """按信息量对样本排序
+
+    只看与当前最佳提示有关的比较：最近一次改进成功的记录（最佳提示作为 B），
+    以及之后各轮候选的比较（最佳提示作为 A）。最佳提示在样本上落败一次计 2 分，
+    同一样本既有胜也有负时再加 1 分；同分的样本保持原有顺序。
+
+    Args:
+        sample_ids: 样本 id 列表
+        history: 紧凑形式的优化历史（各条记录中的 evaluations 与完整形式相同）
+    """
+    start = 0
+    for index in range(len(history) - 1, -1, -1):
+        if history[index]["is_better"]:
+            start = index
+            break
+
+    losses = {sample_id: 0 for sample_id in sample_ids}
+    wins = {sample_id: 0 for sample_id in sample_ids}
+    for index, item in enumerate(history[start:], start):
+        promoted = index == start and item["is_better"]
+        lost, won = (WORSE, BETTER) if promoted else (BETTER, WORSE)
+        for candidate in item.get("candidates") or [item]:
+            for sample_id, evaluation in candidate["evaluations"].items():
+                if sample_id not in losses:
+                    continue
+                if evaluation == lost:
+                    losses[sample_id] += 1
+                elif evaluation == won:
+                    wins[sample_id] += 1
+
+    def score(sample_id):
+        return losses[sample_id] * 2 + (1 if losses[sample_id] and wins[sample_id] else 0)
+
+    return sorted(sample_ids, key=score, reverse=True)
+
+
+def build_outputs_payload(outputs, budget_tokens, ranking=None, reserved_tokens=0):
+    """在预算内构造输出部分（JSON 对象，键为样本 id）
+
+    Args:
+        outputs: {样本 id: 输出}
+        budget_tokens: 整个请求的 token 预算
+        ranking: 按信息量排序的样本 id，默认按 outputs 的顺序
+        reserved_tokens: 请求中其余部分（提示词、任务描述等）占用的 token
+
+    Returns:
+        (JSON 字符串, 统计)；统计包含 bytes、tokens、samples（附带的样本数）、
+        omitted（未附带的样本数）和 truncated（被截断的样本数）
+    """
+    budget = budget_tokens - reserved_tokens
+    payload = json.dumps(outputs, ensure_ascii=False)
+
+    if estimate_tokens(payload) <= budget:
+        selected, truncated = outputs, 0
+    else:
+        order = [sample_id for sample_id in (ranking or outputs) if sample_id in outputs]
+        selected, truncated = {}, 0
+        # JSON 的括号
+        remaining = budget - 1
+        for position, sample_id in enumerate(order):
+            # 剩余预算在尚未放入的样本间平分，短的输出用不完的份额留给后面的样本
+            share = max(remaining // (len(order) - position), MIN_OUTPUT_TOKENS)
+            # 键、引号和分隔符，另加 1 个 token 抵消逐项估计的舍入误差
+            overhead = estimate_tokens(json.dumps(str(sample_id))) + 2
+            if remaining - overhead < MIN_OUTPUT_TOKENS:
+                break
+            text = outputs[sample_id]
+            cost = _json_tokens(text)
+            limit = min(share, remaining) - overhead
+            if cost > limit:
+                # 换行、引号等在 JSON 中需要转义，按转义后的长度折算截断位置
+                text = truncate_text(text, limit * estimate_tokens(text) // cost)
+                cost = _json_tokens(text)
+                truncated += 1
+            selected[sample_id] = text
+            remaining -= cost + overhead
+        payload = json.dumps(selected, ensure_ascii=False)
+        # 逐项估计的舍入误差可能使总量略超预算，此时去掉信息量最低的样本
+        while len(selected) > 1 and estimate_tokens(payload) > budget:
+            sample_id = list(selected)[-1]
+            truncated -= selected.pop(sample_id) != outputs[sample_id]
+            payload = json.dumps(selected, ensure_ascii=False)
+
+    return payload, {
+        "bytes": len(payload.encode("utf-8")),
+        "tokens": estimate_tokens(payload),
+        "samples": len(selected),
+        "omitted": len(outputs) - len(selected),
+        "truncated": truncated
+    }
+
+
+def describe_payload(size):
+    """把 build_outputs_payload 的统计写成一行说明，供命令行输出"""
+    trimmed = []
+    if size["omitted"]:
+        trimmed.append(f"省略 {size['omitted']} 个样本")
+    if size["truncated"]:
+        trimmed.append(f"截断 {size['truncated']} 个样本")
+    detail = f"，{'，'.join(trimmed)}" if trimmed else ""
+    return f"优化器输入的当前输出部分约 {size['tokens']} token（{size['bytes']} 字节，附带 {size['samples']} 个样本{detail}）"
+
+
+def reserved_tokens(*texts):
+    """请求中其余文本及固定说明占用的 token"""
+    return PROMPT_OVERHEAD_TOKENS + sum(estimate_tokens(text or "") for text in texts)
@@ -0,0 +1,174 @@
+"""后端调用的录制与回放
+
+录制模式把每次后端调用的请求指纹和响应追加到 JSONL 文件（以 .gz 结尾时使用 gzip 压缩）；
+回放模式完全不访问后端，按请求指纹从录制文件中取出响应，用于离线复现一次运行
+或在相同的模型响应下比较优化器的改动。
+
+并发调用的先后顺序每次运行都可能不同，因此回放按请求内容而不是顺序匹配；
+同一请求出现多次时按录制顺序依次返回。找不到匹配的请求说明调用序列已经偏离录制，
+会记录到 mismatches 并抛出 CassetteMismatch。
+
+提前判定、竞速模式和提前生成候选使发起哪些调用取决于运行时的先后顺序，因此录制文件中
+还保存引擎的决定（trace）：竞速模式的随机种子，以及每个候选跳过了哪些评估、取消了哪些执行。
+回放时引擎按这些记录进行；提前生成的候选在录制中被取消而没有调用时，回放也视为取消，不算不一致。
+
+录制期间文件保持打开，结束时调用 close()（或使用 with 语句）；以 .gz 结尾时整个文件是一个 gzip 流。
+"""
+import gzip
+import json
+import os
+import threading
+from collections import deque
+
+from .cache import make_cache_key
+from .transport import TransportError
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMismatch(TransportError):
+    """回放时请求与录制不一致"""
+
+
+class CassetteSkipped(TransportError):
+    """回放时可选的调用（如提前生成的候选）在录制中被取消，没有响应"""
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """录制或回放后端调用
+
+    Args:
+        path: 录制文件路径
+        mode: RECORD 或 REPLAY；录制时追加到已有文件
+    """
+
+    def __init__(self, path, mode):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"未知的模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.mismatches = []
+        self._entries = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+        if mode == REPLAY:
+            self._load()
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._writer = _open(path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """结束录制，写完并关闭录制文件"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 录制中断时可能留下不完整的最后一行
+                        continue
+                    self._entries.setdefault(entry["key"], deque()).append(entry)
+            except EOFError:
+                # 录制中断时 gzip 流没有正常结束，已经读到的条目仍然可用
+                pass
+
+    def record(self, endpoint, data, model, response=None, error=None):
+        """录制一次调用的响应，或调用失败时的 TransportError"""
+        entry = {"key": make_cache_key(endpoint, data, model), "endpoint": endpoint}
+        if error is not None:
+            entry["error"] = error.args[0]
+            entry["status"] = error.status
+        else:
+            entry["response"] = response
+
+        self._write(entry)
+
+    def record_trace(self, name, data, trace):
+        """录制引擎的一个决定，回放时由 trace(name, data) 取出"""
+        self._write({"key": make_cache_key(name, data), "endpoint": name, "trace": trace})
+
+    def _write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            # 录制结束后才完成的后台调用（如作废的提前生成）不再录制
+            if self._writer is None:
+                return
+            self._writer.write(line + "\n")
+            # 未压缩的文件逐行写出，中断时不丢失已完成的调用；gzip 流在关闭时写完
+            if not self.path.endswith(".gz"):
+                self._writer.flush()
+
+    def trace(self, name, data, consume=True):
+        """取出录制的决定，没有时返回 None；consume 为 False 时保留，供之后再次读取"""
+        with self._lock:
+            queue = self._entries.get(make_cache_key(name, data))
+            if not queue:
+                return None
+            return (queue.popleft() if consume else queue[0])["trace"]
+
+    def play(self, endpoint, data, model, optional=False):
+        """返回录制的响应；录制时失败的调用再次抛出 TransportError
+
+        optional 为 True 的调用在录制中可能已被取消，没有匹配时抛出 CassetteSkipped，不计为不一致
+        """
+        key = make_cache_key(endpoint, data, model)
+        with self._lock:
+            index = self._calls.get(endpoint, 0) + 1
+            self._calls[endpoint] = index
+            queue = self._entries.get(key)
+            entry = queue.popleft() if queue else None
+            if entry is None and not optional:
+                self.mismatches.append({"endpoint": endpoint, "call": index, "key": key})
+
+        if entry is None and optional:
+            raise CassetteSkipped(endpoint, "录制中没有这次调用，视为已取消")
+        if entry is None:
+            raise CassetteMismatch(endpoint, f"回放记录中没有匹配的请求（第 {index} 次 {endpoint} 调用）")
+        if "error" in entry:
+            raise TransportError(endpoint, entry["error"], status=entry.get("status"))
+        return entry["response"]
+
+    def unused(self):
+        """回放结束后尚未使用的录制条目数，按端点统计"""
+        with self._lock:
+            counts = {}
+            for queue in self._entries.values():
+                for entry in queue:
+                    # 未使用的决定（如回放时没有再次评估的候选）不单独统计
+                    if "trace" in entry:
+                        continue
+                    counts[entry["endpoint"]] = counts.get(entry["endpoint"], 0) + 1
+            return counts
+
+    def report(self):
+        """回放与录制的差异摘要"""
+        return {
+            "mismatches": list(self.mismatches),
+            "unused": self.unused()
+        }
@@ -0,0 +1,194 @@
+"""优化运行的检查点
+
+每次运行对应 .spo/runs/ 下的一个只追加 JSONL 文件。引擎在每个阶段完成后
+写入一条记录：样本与初始输出、生成的候选、逐样本的执行和评估结果、分析结果
+以及完成的迭代。恢复时按顺序重放这些记录，未完成迭代中已经得到的结果会被
+直接复用，不再重复调用模型。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict
+
+from .engine import EVALUATION_SKIPPED, OptimizationState, OptimizerSettings, restore_sample_keys
+
+DEFAULT_CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(".spo", "runs"))
+
+
+class Recovery:
+    """从检查点恢复的运行
+
+    Attributes:
+        meta: 运行的元信息（任务、模型、设置等）
+        settings: OptimizerSettings
+        state: 最后一个完成阶段之后的 OptimizationState
+        pending: 未完成迭代中已得到的结果，交给 Optimizer 复用
+    """
+
+    def __init__(self, meta, settings, state, pending):
+        self.meta = meta
+        self.settings = settings
+        self.state = state
+        self.pending = pending
+
+
+class Checkpoint:
+    """单次运行的只追加检查点"""
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        self._lock = threading.Lock()
+
+    def append(self, stage, **data):
+        record = dict(data, stage=stage, time=time.time())
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+
+    def handle(self, event, data, state):
+        """把引擎事件写成检查点记录，可能在工作线程中调用"""
+        if event in ("samples_generated", "best_outputs_ready"):
+            self.append("state", state=state.to_dict())
+        elif event == "candidate_generated":
+            self.append("candidate", iteration=data["iteration"],
+                        temperature=data["temperature"], prompt=data["prompt"])
+        elif event == "sample_evaluated":
+            # 因提前判定而跳过评估的样本不记录，恢复时重新判定
+            if data["evaluation"] != EVALUATION_SKIPPED:
+                self.append("sample", **data)
+        elif event == "analysis_ready":
+            self.append("analysis", **data)
+        elif event == "iteration_finished":
+            item = data["item"]
+            self.append(
+                "iteration",
+                item=item,
+                new_outputs=state.new_outputs,
+                current_best_failures=state.current_best_failures if item["is_better"] else None
+            )
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 中断时可能留下不完整的最后一行
+                    continue
+        return records
+
+    def load(self):
+        """重放检查点记录，返回 Recovery"""
+        meta = {}
+        state = OptimizationState()
+        pending = None
+
+        for record in self.records():
+            stage = record["stage"]
+            if stage == "run":
+                meta = record
+                state = OptimizationState(
+                    task_description=record["task_description"],
+                    current_best_prompt=record["initial_prompt"]
+                )
+            elif stage == "state":
+                state = OptimizationState.from_dict(record["state"])
+                pending = None
+            elif stage == "iteration":
+                _apply_iteration(state, record)
+                pending = None
+            elif stage in ("candidate", "sample", "analysis"):
+                if pending is None or pending["iteration"] != record["iteration"]:
+                    pending = {"iteration": record["iteration"], "candidates": {}, "samples": {}, "analyses": {}}
+                if stage == "candidate":
+                    pending["candidates"][record["temperature"]] = record["prompt"]
+                elif stage == "sample":
+                    pending["samples"].setdefault(record["prompt"], {})[record["sample_id"]] = (
+                        record["output"], record["evaluation"], record["error"]
+                    )
+                else:
+                    pending["analyses"][record["prompt"]] = record["analysis"]
+
+        settings = OptimizerSettings(**meta.get("settings", {}))
+        return Recovery(meta, settings, state, pending)
+
+
+def _apply_iteration(state, record):
+    item = record["item"]
+    for key in ("evaluations", "failures"):
+        item[key] = restore_sample_keys(item.get(key) or {}, state.samples)
+    for candidate in item.get("candidates", []):
+        candidate["evaluations"] = restore_sample_keys(candidate["evaluations"], state.samples)
+
+    new_outputs = restore_sample_keys(record["new_outputs"], state.samples)
+
+    state.current_iteration = item["iteration"]
+    state.new_prompt = item["prompt"]
+    state.new_outputs = new_outputs
+    state.evaluations = item["evaluations"]
+    state.analysis = item["analysis"]
+    if item["is_better"]:
+        state.current_best_prompt = item["prompt"]
+        state.current_best_outputs = new_outputs
+        state.current_best_failures = restore_sample_keys(record["current_best_failures"] or {}, state.samples)
+    state.add_history(item, new_outputs)
+
+
+class CheckpointStore:
+    """检查点目录"""
+
+    def __init__(self, directory=DEFAULT_CHECKPOINT_DIR):
+        self.directory = directory
+
+    def create(self, state, settings, models=None, base_url=None, auto_mode=True):
+        """为新的运行创建检查点并写入元信息"""
+        os.makedirs(self.directory, exist_ok=True)
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        checkpoint = Checkpoint(os.path.join(self.directory, f"{run_id}.jsonl"))
+        checkpoint.append(
+            "run",
+            task_description=state.task_description,
+            initial_prompt=state.current_best_prompt,
+            settings=asdict(settings),
+            models=models or {},
+            base_url=base_url,
+            auto_mode=auto_mode
+        )
+        return checkpoint
+
+    def open(self, run_id):
+        return Checkpoint(os.path.join(self.directory, f"{run_id}.jsonl"))
+
+    def list_runs(self):
+        """按更新时间倒序列出可恢复的运行"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        runs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jsonl"):
+                continue
+            checkpoint = Checkpoint(os.path.join(self.directory, name))
+            records = checkpoint.records()
+            if not records or records[0]["stage"] != "run":
+                continue
+            meta = records[0]
+            iterations = [record["item"]["iteration"] for record in records if record["stage"] == "iteration"]
+            runs.append({
+                "run_id": checkpoint.run_id,
+                "task_description": meta["task_description"],
+                "iteration": max(iterations, default=0),
+                "max_iterations": meta["settings"]["max_iterations"],
+                "updated": records[-1]["time"]
+            })
+
+        return sorted(runs, key=lambda run: run["updated"], reverse=True)
@@ -0,0 +1,205 @@
+"""SPO+ 命令行入口
+
+无需 Streamlit，直接针对后端运行一次完整的提示优化：
+
+    python -m spo --task "任务描述" --prompt "初始提示词" --iterations 5
+
+每次运行都会在 .spo/runs/ 下写入检查点，中断后可以继续：
+
+    python -m spo --resume <运行 ID>
+
+--record 把所有模型调用录制到文件，--replay 不访问后端，按录制的响应重放一次运行：
+
+    python -m spo --task "任务描述" --prompt "初始提示词" --record run.jsonl.gz
+    python -m spo --task "任务描述" --prompt "初始提示词" --replay run.jsonl.gz
+"""
+import argparse
+import json
+import os
+import sys
+
+from .cassette import RECORD, REPLAY, Cassette
+from .budget import describe_payload
+from .checkpoint import CheckpointStore
+from .client import SPOClient
+from .concurrency import DEFAULT_MAX_CONCURRENCY
+from .dedup import DEFAULT_SIMILARITY_THRESHOLD
+from .engine import DEFAULT_RACING_STAGES, OptimizationState, Optimizer, OptimizerSettings
+from .judging import MAX_PACKED_SAMPLES
+from .transport import TransportError
+
+MODEL_ROLES = ("optimizer", "executor", "evaluator", "analyzer", "screener")
+
+
+def _read_text(value, path):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m spo", description="SPO+ 无界面提示优化")
+    parser.add_argument("--task", help="任务需求描述")
+    parser.add_argument("--task-file", help="从文件读取任务需求描述")
+    parser.add_argument("--prompt", help="初始提示词")
+    parser.add_argument("--prompt-file", help="从文件读取初始提示词")
+    parser.add_argument("--iterations", type=int, default=10, help="最大迭代次数")
+    parser.add_argument("--api-key", default=os.getenv("DEFAULT_API_KEY"), help="模型服务 API Key")
+    parser.add_argument("--base-url", default=os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn"),
+                        help="模型服务 Base URL")
+    parser.add_argument("--backend-url", default=f"http://localhost:{os.getenv('PORT', '3000')}/api",
+                        help="SPO+ 后端 API 地址")
+    for role in MODEL_ROLES:
+        parser.add_argument(f"--{role}", help=f"{role} 模型，默认使用后端配置")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="最大并发数")
+    parser.add_argument("--population", type=int, default=1, help="每轮候选数")
+    parser.add_argument("--racing", action="store_true", help="启用竞速模式")
+    parser.add_argument("--racing-stages", default=",".join(str(size) for size in DEFAULT_RACING_STAGES),
+                        help="竞速模式的子集大小，逗号分隔")
+    parser.add_argument("--promotion-threshold", type=float, default=0.5, help="竞速模式晋级所需胜率")
+    parser.add_argument("--no-early-stopping", action="store_true", help="关闭提前判定胜负")
+    parser.add_argument("--confidence", type=float, help="提前判定的统计置信度，如 0.95")
+    parser.add_argument("--packed-judging", action="store_true", help="把多个样本的比较打包在一次评估调用中")
+    parser.add_argument("--max-packed-samples", type=int, default=MAX_PACKED_SAMPLES, help="打包评估时每次调用最多的样本数")
+    parser.add_argument("--cascade", action="store_true", help="分级评估：先由 screener 模型判定，不确定时再交给 evaluator")
+    parser.add_argument("--cascade-confidence", type=float, default=0.8, help="分级评估中直接采用快速判定所需的置信度")
+    parser.add_argument("--cascade-accept-ties", action="store_true", help="分级评估中有把握的“相似”也直接采用，不再交给 evaluator 复核")
+    parser.add_argument("--speculative", action="store_true", help="评估本轮候选的同时提前生成下一轮的候选")
+    parser.add_argument("--no-dedup", action="store_true", help="不跳过与已尝试提示重复的候选")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help="候选与已尝试提示的相似度达到该值时视为重复")
+    parser.add_argument("--no-cache", action="store_true", help="不复用缓存的响应")
+    parser.add_argument("--samples", type=int, help="测试样本数，较多时拆成多个并行的生成请求；默认使用后端一次生成的样本数")
+    parser.add_argument("--sample-version", type=int, help="使用该任务保存的第几版测试样本，默认使用最新版本")
+    parser.add_argument("--no-sample-store", action="store_true",
+                        help="不复用该任务保存的测试样本，也不保存本次生成的样本；录制和回放时总是如此")
+    parser.add_argument("--resume", metavar="RUN_ID", help="从检查点继续中断的运行，任务和设置沿用原运行")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="PATH", help="把模型调用录制到文件，以 .gz 结尾时压缩")
+    cassette.add_argument("--replay", metavar="PATH", help="不访问后端，回放录制文件中的响应")
+    parser.add_argument("--output", help="将最终状态写入 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--quiet", action="store_true", help="不输出进度信息")
+    return parser
+
+
+def settings_from_args(args):
+    return OptimizerSettings(
+        max_iterations=args.iterations,
+        max_concurrency=args.max_concurrency,
+        early_stopping=not args.no_early_stopping,
+        decision_confidence=args.confidence,
+        racing_enabled=args.racing,
+        racing_stages=[int(size) for size in args.racing_stages.split(",") if size.strip()],
+        promotion_threshold=args.promotion_threshold,
+        population_size=args.population,
+        speculative=args.speculative,
+        packed_judging=args.packed_judging,
+        max_packed_samples=args.max_packed_samples,
+        cascade_enabled=args.cascade,
+        cascade_confidence=args.cascade_confidence,
+        cascade_accept_ties=args.cascade_accept_ties,
+        deduplicate=not args.no_dedup,
+        similarity_threshold=args.similarity_threshold,
+        # 录制的运行需要包含生成样本的调用，回放时才不依赖本机保存的样本
+        reuse_samples=not (args.no_sample_store or args.record or args.replay),
+        sample_count=args.samples,
+        sample_version=args.sample_version
+    )
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    task_description = _read_text(args.task, args.task_file)
+    initial_prompt = _read_text(args.prompt, args.prompt_file)
+    if not args.resume and (not task_description or not initial_prompt):
+        parser.error("需要提供任务需求描述和初始提示词")
+    if not args.api_key and not args.replay:
+        parser.error("需要提供 API Key（--api-key 或环境变量 DEFAULT_API_KEY）")
+
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr)
+
+    def on_event(event, data):
+        if event in ("warning", "error"):
+            log(f"[{event}] {data['message']}")
+        elif event == "samples_generated":
+            if data["reused"]:
+                log(f"复用第 {data['version']} 版测试样本（{len(data['samples'])} 个）")
+            else:
+                removed = f"，去掉 {data['removed']} 个重复问题" if data["removed"] else ""
+                version = f"，保存为第 {data['version']} 版" if data["version"] else ""
+                log(f"已生成 {len(data['samples'])} 个测试样本{removed}{version}")
+        elif event == "optimizer_payload":
+            speculative = "（提前生成）" if data["speculative"] else ""
+            log(f"迭代 {data['iteration']}{speculative}: {describe_payload(data)}")
+        elif event == "iteration_finished":
+            item = data["item"]
+            speculation = {"hit": "，提前生成命中", "miss": "，提前生成作废"}.get(item.get("speculation"), "")
+            log(f"迭代 {item['iteration']}: {'改进成功' if item['is_better'] else '未改进'} (净胜 {item['score']}){speculation}")
+
+    store = CheckpointStore()
+    pending = None
+    if args.resume:
+        checkpoint = store.open(args.resume)
+        if not checkpoint.records():
+            parser.error(f"找不到运行 {args.resume} 的检查点")
+        recovery = checkpoint.load()
+        settings, state, pending = recovery.settings, recovery.state, recovery.pending
+        models = recovery.meta.get("models") or {}
+        log(f"从迭代 {state.current_iteration} 继续运行 {args.resume}")
+    else:
+        settings = settings_from_args(args)
+        state = OptimizationState(task_description=task_description, current_best_prompt=initial_prompt)
+        models = {role: getattr(args, role) for role in MODEL_ROLES if getattr(args, role)}
+
+    use_cache = not args.no_cache and os.getenv("RESPONSE_CACHE", "on") != "off"
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, RECORD)
+    elif args.replay:
+        if not os.path.exists(args.replay):
+            parser.error(f"找不到录制文件 {args.replay}")
+        cassette = Cassette(args.replay, REPLAY)
+
+    try:
+        client = SPOClient(args.backend_url, use_cache=use_cache, cassette=cassette)
+        try:
+            client.configure(args.api_key, args.base_url, models or None)
+        except TransportError as e:
+            log(f"API配置失败: {e}")
+            return 1
+
+        if not args.resume:
+            checkpoint = store.create(state, settings, models, args.base_url)
+            log(f"检查点: {checkpoint.path}（使用 --resume {checkpoint.run_id} 继续中断的运行）")
+
+        optimizer = Optimizer(client, state, settings, on_event=on_event, checkpoint=checkpoint, pending=pending)
+
+        # 中断发生在初始输出完成之前时重新准备
+        ok = (bool(state.current_best_outputs) or optimizer.prepare()) and optimizer.run()
+    finally:
+        # 录制文件在运行结束（或中断）时写完
+        if cassette is not None:
+            cassette.close()
+
+    if cassette is not None and cassette.replaying:
+        report = cassette.report()
+        for mismatch in report["mismatches"]:
+            log(f"[回放] 第 {mismatch['call']} 次 {mismatch['endpoint']} 调用与录制不一致")
+        if report["unused"]:
+            log(f"[回放] 未使用的录制条目: {report['unused']}")
+        if report["mismatches"]:
+            ok = False
+
+    result = json.dumps(state.to_dict(), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(result)
+    else:
+        print(result)
+
+    return 0 if ok else 1
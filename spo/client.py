@@ -0,0 +1,357 @@
+"""SPO+ 后端 API 客户端
+
+封装 backend/routes/api.js 中的各个端点，不依赖 Streamlit，
+调用失败时抛出 TransportError。
+"""
+import threading
+import time
+from contextlib import nullcontext
+
+from .cache import get_cache, make_cache_key
+from .metrics import current_tags, json_size
+from .ratelimit import ADAPTIVE_CONCURRENCY, get_scheduler
+from .transport import TransportError, get_transport
+
+# 可缓存的端点及其使用的模型角色
+CACHED_ENDPOINT_ROLES = {
+    "execute-prompt": "executor",
+    "evaluate-outputs": "evaluator",
+    "evaluate-outputs/batch": "evaluator",
+    "evaluate-outputs/screen": "screener",
+    "analyze-changes": "analyzer"
+}
+
+# 各端点调用的模型角色，用于按角色限流
+ENDPOINT_ROLES = dict(CACHED_ENDPOINT_ROLES, **{
+    "generate-samples": "optimizer",
+    "optimize-prompt": "optimizer",
+    "execute-prompt/stream": "executor"
+})
+
+# 会话标识所在的请求头；后端找不到会话（过期或重启）时返回 410，客户端重新配置后重试
+SESSION_HEADER = "X-SPO-Session"
+SESSION_EXPIRED_STATUS = 410
+
+
+class SPOClient:
+    """后端 API 客户端
+
+    configure() 在后端创建一个会话，之后的调用都带有会话标识，
+    同一后端上的多个客户端（如多个 Streamlit 用户）各自使用自己的 API Key 和模型配置。
+
+    Args:
+        backend_url: 后端 API 地址，如 http://localhost:3000/api
+        use_cache: 是否复用缓存的响应
+        cache: 响应缓存，默认使用共享的磁盘缓存
+        limiter: 可选的并发限制（如 threading.Semaphore），多个客户端共享时
+            构成全局的后端调用预算；缓存命中不占用额度
+        scheduler: 按模型角色限流的 RequestScheduler，默认使用进程内共享的调度器
+        metrics: 可选的 MetricsRecorder，记录每次调用的耗时和用量
+        cassette: 可选的 Cassette，录制模型调用，或在回放时代替后端
+    """
+
+    def __init__(self, backend_url, use_cache=True, cache=None, limiter=None, scheduler=None, metrics=None,
+                 cassette=None):
+        self.backend_url = backend_url
+        self.transport = get_transport(backend_url)
+        self.cache = cache if cache is not None else get_cache()
+        self.use_cache = use_cache
+        self.limiter = limiter
+        if scheduler is None and ADAPTIVE_CONCURRENCY:
+            scheduler = get_scheduler()
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.cassette = cassette
+        self.models = {}
+        # 后端补全默认模型后各角色实际使用的模型，以及模型服务的 Base URL；用于区分缓存
+        self.resolved_models = {}
+        self.base_url = None
+        self.session_id = None
+        self._configuration = None
+        self._session_lock = threading.Lock()
+
+    def call_api(self, endpoint, data=None):
+        """调用后端端点，失败时抛出 TransportError"""
+        role = CACHED_ENDPOINT_ROLES.get(endpoint)
+        use_cache = self.use_cache and role is not None
+        started = time.monotonic()
+
+        if self._replaying():
+            return self._play(endpoint, data, started)
+
+        if use_cache:
+            cache_key = self._cache_key(endpoint, data, role)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record(endpoint, data, started, cached, cached=True)
+                self._tape(endpoint, data, cached)
+                return cached
+
+        try:
+            response = self._request(endpoint, data)
+            if not response.get('success', True):
+                raise TransportError(endpoint, response.get('error', '未知错误'))
+        except TransportError as e:
+            self._record(endpoint, data, started, error=str(e))
+            self._tape(endpoint, data, error=e)
+            raise
+
+        self._record(endpoint, data, started, response)
+        self._tape(endpoint, data, response)
+        if use_cache:
+            self.cache.set(cache_key, response)
+        return response
+
+    def _request(self, endpoint, data):
+        session_id = self.session_id
+        try:
+            return self._send(endpoint, data, session_id)
+        except TransportError as e:
+            if not self._renew(e, session_id):
+                raise
+        return self._send(endpoint, data, self.session_id)
+
+    def _send(self, endpoint, data, session_id):
+        with self._slot(endpoint) as slot, self._limited():
+            return self.transport.request(endpoint, data, headers=self._headers(session_id), **self._hooks(slot))
+
+    def _headers(self, session_id):
+        return {SESSION_HEADER: session_id} if session_id else None
+
+    def _renew(self, error, session_id):
+        """会话在后端已不存在时重新配置，返回是否可以重试
+
+        多个线程同时遇到过期时只重新配置一次，其余线程直接使用新的会话重试
+        """
+        if error.status != SESSION_EXPIRED_STATUS or self._configuration is None:
+            return False
+        with self._session_lock:
+            if self.session_id == session_id:
+                self.configure(*self._configuration)
+        return True
+
+    def _replaying(self):
+        return self.cassette is not None and self.cassette.replaying
+
+    def _play(self, endpoint, data, started):
+        """回放时代替后端响应；config 等不调用模型的端点不录制，直接视为成功"""
+        role = ENDPOINT_ROLES.get(endpoint)
+        if role is None:
+            return {"success": True}
+        try:
+            # 提前生成的候选在录制中可能尚未调用就被取消，回放时缺少录制不算不一致
+            response = self.cassette.play(endpoint, data, self.models.get(role),
+                                          optional=bool(current_tags().get("speculative")))
+        except TransportError as e:
+            self._record(endpoint, data, started, error=str(e))
+            raise
+        self._record(endpoint, data, started, response)
+        return response
+
+    def _tape(self, endpoint, data, response=None, error=None):
+        """录制模式下记录一次模型调用的响应或错误"""
+        role = ENDPOINT_ROLES.get(endpoint)
+        if self.cassette is None or role is None:
+            return
+        self.cassette.record(endpoint, data, self.models.get(role), response, error)
+
+    def _record(self, endpoint, data, started, response=None, cached=False, error=None):
+        if self.metrics is None:
+            return
+
+        role = ENDPOINT_ROLES.get(endpoint)
+        self.metrics.record(
+            endpoint,
+            role,
+            self.models.get(role),
+            time.monotonic() - started,
+            json_size(data),
+            json_size(response),
+            # 缓存命中没有实际消耗 token
+            usage=None if cached or response is None else response.get('usage'),
+            cached=cached,
+            error=error
+        )
+
+    def _cache_key(self, endpoint, data, role):
+        """缓存键包含服务商和实际使用的模型：使用后端默认模型的角色取后端返回的模型，
+        更换服务商或后端默认模型后不会取到旧的响应"""
+        model = self.resolved_models.get(role) or self.models.get(role)
+        return make_cache_key(endpoint, data, model, self.base_url)
+
+    def _limited(self):
+        return self.limiter if self.limiter is not None else nullcontext()
+
+    def _slot(self, endpoint):
+        role = ENDPOINT_ROLES.get(endpoint)
+        if self.scheduler is None or role is None:
+            return nullcontext()
+        return self.scheduler.slot(role, self.models.get(role), session=self.session_id or id(self))
+
+    @staticmethod
+    def _hooks(slot):
+        """调度器额度对应的 Transport 回调：每次尝试报告结果，每次重试重新申请额度"""
+        if slot is None:
+            return {}
+        return {"on_attempt": slot.record, "before_retry": slot.renew}
+
+    def get_available_models(self):
+        return self.call_api("models").get('models', [])
+
+    def configure(self, api_key, base_url, models=None):
+        """在后端创建（或更新已有的）会话配置；后端不支持会话时退回全局配置"""
+        data = {
+            "apiKey": api_key,
+            "baseUrl": base_url,
+            "models": models,
+            "session": True
+        }
+
+        response = self.call_api("config", data)
+        self.models = dict(models or {})
+        self.resolved_models = dict(response.get('models') or {})
+        self.base_url = base_url
+        self.session_id = response.get('sessionId')
+        self._configuration = (api_key, base_url, models)
+
+    def generate_samples(self, task_description, count=None, shard=None):
+        """生成测试样本；count 和 shard 为分片生成时每个分片的样本数和分片序号"""
+        data = {
+            "taskDescription": task_description
+        }
+        if count:
+            data["count"] = count
+        if shard is not None:
+            data["shard"] = shard
+
+        return self.call_api("generate-samples", data).get('samples', [])
+
+    def execute_prompt(self, prompt, question):
+        data = {
+            "prompt": prompt,
+            "question": question
+        }
+
+        return self.call_api("execute-prompt", data).get('output', "")
+
+    def execute_prompt_stream(self, prompt, question, on_token):
+        """流式执行提示词，每收到一段输出时调用 on_token(文本)，返回完整输出
+
+        与 execute_prompt 共享缓存，命中缓存时整段回调一次。
+        """
+        endpoint = "execute-prompt/stream"
+        data = {
+            "prompt": prompt,
+            "question": question
+        }
+
+        started = time.monotonic()
+
+        # 与 execute-prompt 使用同一录制条目，流式和非流式运行可以互相回放
+        if self._replaying():
+            output = self._play("execute-prompt", data, started).get('output', "")
+            on_token(output)
+            return output
+
+        if self.use_cache:
+            cache_key = self._cache_key("execute-prompt", data, "executor")
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record(endpoint, data, started, cached, cached=True)
+                self._tape("execute-prompt", data, cached)
+                output = cached.get('output', "")
+                on_token(output)
+                return output
+
+        try:
+            session_id = self.session_id
+            try:
+                done = self._stream(endpoint, data, on_token, session_id)
+            except TransportError as e:
+                # 会话过期在收到任何输出之前就会返回，重新配置后可以安全地重试
+                if not self._renew(e, session_id):
+                    raise
+                done = self._stream(endpoint, data, on_token, self.session_id)
+
+            if done is None:
+                raise TransportError(endpoint, "流式响应意外结束")
+        except TransportError as e:
+            self._record(endpoint, data, started, error=str(e))
+            self._tape("execute-prompt", data, error=e)
+            raise
+
+        response = {"success": True, "output": done.get('output', ""), "usage": done.get('usage')}
+        self._record(endpoint, data, started, response)
+        self._tape("execute-prompt", data, response)
+        if self.use_cache:
+            self.cache.set(cache_key, response)
+        return response["output"]
+
+    def _stream(self, endpoint, data, on_token, session_id):
+        """读取事件流直到结束事件并返回该事件，流提前结束时返回 None"""
+        with self._slot(endpoint) as slot, self._limited():
+            stream = self.transport.stream(endpoint, data, headers=self._headers(session_id), **self._hooks(slot))
+            for event in stream:
+                if event.get('error'):
+                    message = event['error']
+                    if event.get('details'):
+                        message = f"{message}: {event['details']}"
+                    raise TransportError(endpoint, message)
+                if event.get('done'):
+                    return event
+                on_token(event.get('token', ""))
+        return None
+
+    def optimize_prompt(self, current_prompt, current_output, task_description, history="", temperature=None):
+        data = {
+            "currentPrompt": current_prompt,
+            "currentOutput": current_output,
+            "taskDescription": task_description,
+            "history": history
+        }
+
+        if temperature is not None:
+            data["temperature"] = temperature
+
+        return self.call_api("optimize-prompt", data).get('newPrompt', "")
+
+    def evaluate_outputs(self, output_a, output_b, task_description, question):
+        data = {
+            "outputA": output_a,
+            "outputB": output_b,
+            "taskDescription": task_description,
+            "question": question
+        }
+
+        return self.call_api("evaluate-outputs", data).get('evaluation', "相似")
+
+    def screen_outputs(self, output_a, output_b, task_description, question):
+        """由快速评估模型比较两个输出，返回 (评估结果, 置信度)"""
+        data = {
+            "outputA": output_a,
+            "outputB": output_b,
+            "taskDescription": task_description,
+            "question": question
+        }
+
+        response = self.call_api("evaluate-outputs/screen", data)
+        return response.get('evaluation', "相似"), float(response.get('confidence') or 0)
+
+    def evaluate_outputs_batch(self, task_description, items):
+        """在一次调用中比较多组输出，items 为 [{"id", "question", "outputA", "outputB"}]，
+        返回评估模型的原始响应，由 spo.judging.parse_packed_verdicts 解析"""
+        data = {
+            "taskDescription": task_description,
+            "items": items
+        }
+
+        return self.call_api("evaluate-outputs/batch", data).get('evaluation', "")
+
+    def analyze_changes(self, old_prompt, new_prompt, task_description):
+        data = {
+            "oldPrompt": old_prompt,
+            "newPrompt": new_prompt,
+            "taskDescription": task_description
+        }
+
+        return self.call_api("analyze-changes", data).get('analysis', "")
@@ -0,0 +1,65 @@
+"""并发执行工具
+
+为逐样本的 LLM 调用提供带并发上限的线程池执行。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 默认并发上限，可通过环境变量 MAX_CONCURRENCY 覆盖
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "5"))
+
+
+def run_parallel(func, items, key, max_workers=None, initializer=None, on_result=None):
+    """并发地对每个元素调用 func
+
+    Args:
+        func: 对单个元素执行的函数
+        items: 待处理的元素列表
+        key: 从元素中取出结果键的函数（如样本 id）
+        max_workers: 最大并发数，默认使用 DEFAULT_MAX_CONCURRENCY
+        initializer: 工作线程启动时调用的函数
+        on_result: 每个元素成功完成时在调用线程中以 (键, 结果) 调用，
+            返回 True 时取消所有尚未开始的任务
+
+    Returns:
+        (results, errors): results 按 items 原始顺序排列；
+        errors 记录抛出异常的元素，单个失败不会中断整批任务；
+        被取消的元素不出现在两者中
+    """
+    items = list(items)
+    if not items:
+        return {}, {}
+
+    workers = max(1, min(max_workers or DEFAULT_MAX_CONCURRENCY, len(items)))
+    completed = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer) as pool:
+        futures = {pool.submit(func, item): key(item) for item in items}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+
+            item_key = futures[future]
+            try:
+                completed[item_key] = future.result()
+            except Exception as e:
+                errors[item_key] = str(e)
+                continue
+
+            if on_result and on_result(item_key, completed[item_key]):
+                for pending in futures:
+                    pending.cancel()
+
+    # 按原始顺序组织结果
+    results = {key(item): completed[key(item)] for item in items if key(item) in completed}
+    return results, errors
+
+
+def run_in_background(func, *args, initializer=None):
+    """在独立线程中运行 func，立即返回 Future"""
+    executor = ThreadPoolExecutor(max_workers=1, initializer=initializer)
+    future = executor.submit(func, *args)
+    # 不等待任务结束，线程在任务完成后自行退出
+    executor.shutdown(wait=False)
+    return future
@@ -0,0 +1,118 @@
+"""增量胜负判定
+
+随评估结果逐个到达统计 "B更好" 与 "A更好" 的票数，一旦结果在数学上
+已经确定（或达到设定的统计置信度）即给出结论，剩余评估可以取消。
+竞速模式下候选提示在逐级扩大的样本子集上比较，未胜出者提前淘汰。
+"""
+from collections import defaultdict
+
+BETTER = "B更好"
+WORSE = "A更好"
+SIMILAR = "相似"
+
+
+class VerdictTally:
+    """新提示 (B) 对当前最佳提示 (A) 的增量投票
+
+    新提示获胜的条件与全量统计一致：B更好 的票数严格多于 A更好。
+
+    Args:
+        total: 参与投票的样本总数
+        confidence: 可选的统计置信度（如 0.95），为 None 时只在结果
+            数学上确定时提前结束
+        min_votes: 启用统计判定前至少需要的有效票数
+    """
+
+    def __init__(self, total, confidence=None, min_votes=3):
+        self.total = total
+        self.confidence = confidence
+        self.min_votes = min_votes
+        self.better = 0
+        self.worse = 0
+        self.similar = 0
+        self.seen = 0
+        self.decision = None
+        self.decided_early = False
+
+    @property
+    def remaining(self):
+        return self.total - self.seen
+
+    @property
+    def settled(self):
+        return self.decision is not None
+
+    def add(self, verdict):
+        """记录一个评估结果，返回当前结论（True/False，未确定时为 None）"""
+        self.seen += 1
+        if verdict == BETTER:
+            self.better += 1
+        elif verdict == WORSE:
+            self.worse += 1
+        elif verdict == SIMILAR:
+            self.similar += 1
+
+        if self.decision is None:
+            self.decision = self._decide()
+            self.decided_early = self.decision is not None and self.remaining > 0
+        return self.decision
+
+    def result(self):
+        """最终结论；未提前判定时按已有票数比较"""
+        if self.decision is not None:
+            return self.decision
+        return self.better > self.worse
+
+    def _decide(self):
+        remaining = self.remaining
+
+        # 剩余样本全部判 A更好 仍然获胜
+        if self.better > self.worse + remaining:
+            return True
+        # 剩余样本全部判 B更好 仍然不能获胜
+        if self.better + remaining <= self.worse:
+            return False
+
+        if self.confidence is None or self.better + self.worse + self.similar < self.min_votes:
+            return None
+
+        probability = win_probability(self.better, self.worse, self.similar, remaining)
+        if probability >= self.confidence:
+            return True
+        if probability <= 1 - self.confidence:
+            return False
+        return None
+
+
+def win_probability(better, worse, similar, remaining):
+    """按已有票数的平滑比例估计剩余样本的投票分布，返回新提示最终获胜的概率"""
+    votes = better + worse + similar
+    p_better = (better + 1) / (votes + 3)
+    p_worse = (worse + 1) / (votes + 3)
+    p_similar = 1 - p_better - p_worse
+
+    # 票差分布的逐样本卷积
+    distribution = {better - worse: 1.0}
+    for _ in range(remaining):
+        step = defaultdict(float)
+        for diff, p in distribution.items():
+            step[diff + 1] += p * p_better
+            step[diff - 1] += p * p_worse
+            step[diff] += p * p_similar
+        distribution = step
+
+    return sum(p for diff, p in distribution.items() if diff > 0)
+
+
+def racing_schedule(total, stage_sizes):
+    """返回逐级扩大的累计样本数，最后一级总是全部样本"""
+    schedule = sorted({size for size in stage_sizes if 0 < size < total})
+    return schedule + [total]
+
+
+def should_promote(tally, threshold=0.5):
+    """候选在已评估的子集上胜过当前最佳提示，且胜率不低于阈值时晋级"""
+    decisive = tally.better + tally.worse
+    if tally.better <= tally.worse:
+        return False
+    return tally.better / decisive >= threshold
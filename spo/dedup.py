@@ -0,0 +1,99 @@
+"""候选提示去重
+
+连续几轮未改进之后，优化器经常给出与已经尝试过的提示完全相同或几乎相同的候选。
+PromptIndex 记录每个评估过的提示：规范化后的哈希用于识别完全重复，
+字符 shingle 的 MinHash 签名（bottom-k 形式）用于估计与已有提示的 Jaccard 相似度。
+"""
+import hashlib
+import re
+import threading
+
+# 字符 shingle 的长度，按字符切分对中英文都适用
+SHINGLE_SIZE = 5
+
+# MinHash 签名保留的最小哈希数，估计误差约为 1/sqrt(k)
+SIGNATURE_SIZE = 64
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+def normalize_prompt(prompt):
+    """忽略空白和大小写差异"""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+def prompt_fingerprint(prompt):
+    return hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(prompt, size=SIGNATURE_SIZE):
+    """规范化文本的字符 shingle 中最小的 size 个哈希（升序）"""
+    text = normalize_prompt(prompt)
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return sorted({_hash(shingle) for shingle in shingles})[:size]
+
+
+def estimate_similarity(a, b, size=SIGNATURE_SIZE):
+    """由两个签名估计 Jaccard 相似度：并集中最小的 size 个哈希里同时出现在两边的比例"""
+    if not a or not b:
+        return 0.0
+    a_set, b_set = set(a), set(b)
+    union = sorted(a_set | b_set)[:size]
+    return sum(1 for value in union if value in a_set and value in b_set) / len(union)
+
+
+class PromptIndex:
+    """已评估提示的索引，线程安全
+
+    每个条目包含 fingerprint、signature、iteration 和 verdict；verdict 在评估
+    完成前为 None，之后为 {"score", "is_better", "evaluations"}。
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, prompt, iteration=None, verdict=None):
+        """登记提示；已存在时只在给出 verdict 时更新"""
+        fingerprint = prompt_fingerprint(prompt)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = {
+                    "fingerprint": fingerprint,
+                    "signature": minhash_signature(prompt),
+                    "iteration": iteration,
+                    "verdict": None
+                }
+                self._entries[fingerprint] = entry
+            if verdict is not None:
+                entry["verdict"] = verdict
+                entry["iteration"] = iteration
+            return entry
+
+    def find(self, prompt):
+        """返回与 prompt 最相似的条目及相似度 (条目, 相似度)，完全重复时相似度为 1.0"""
+        fingerprint = prompt_fingerprint(prompt)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                return entry, 1.0
+
+            signature = minhash_signature(prompt)
+            best, best_similarity = None, 0.0
+            for candidate in self._entries.values():
+                similarity = estimate_similarity(signature, candidate["signature"])
+                if similarity > best_similarity:
+                    best, best_similarity = candidate, similarity
+            return best, best_similarity
@@ -0,0 +1,1093 @@
+"""提示优化引擎
+
+不依赖 Streamlit 的优化流程：显式的状态对象加上事件回调，
+既可以作为 app.py 的后端，也可以在命令行中无界面运行。
+"""
+import math
+import random
+import threading
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+
+from .budget import build_outputs_payload, payload_budget, rank_samples, reserved_tokens
+from .concurrency import DEFAULT_MAX_CONCURRENCY, run_in_background, run_parallel
+from .decision import SIMILAR, VerdictTally, racing_schedule, should_promote
+from .dedup import DEFAULT_SIMILARITY_THRESHOLD, PromptIndex, prompt_fingerprint
+from .history import apply_prompt_delta, get_blob_store, prompt_delta
+from .judging import MAX_PACKED_SAMPLES, context_limit, pack_comparisons, parse_packed_verdicts
+from .metrics import call_context
+from .samples import MAX_TOP_UP_ROUNDS, SHARD_SIZE, get_sample_store, merge_samples, plan_shards
+from .transport import TransportError
+
+# 评估调用失败或因提前判定而跳过时记录的结果，不计入投票
+EVALUATION_FAILED = "评估失败"
+EVALUATION_SKIPPED = "已跳过"
+
+# 竞速模式默认的子集大小，最后一级总是全部样本
+DEFAULT_RACING_STAGES = [3, 6]
+
+# 种群模式下候选提示的生成温度范围
+CANDIDATE_TEMPERATURE_RANGE = (0.4, 1.0)
+
+# 候选与已尝试的提示过于相似时，重新生成所附加的提示
+DIVERSITY_HINT = "注意：上一次生成的提示词与已经尝试过的提示词几乎相同，请从明显不同的方向改进。"
+
+
+class OptimizationCancelled(Exception):
+    """优化被取消，由 Optimizer.cancel() 触发"""
+
+
+class Settlement:
+    """候选的胜负是否已定，已定之后跳过剩余样本的评估
+
+    回放录制的运行时，评估结果的到达顺序与录制时不同，因此改为按录制中
+    跳过了哪些样本决定（recorded_skips），使回放发起的调用与录制一致。
+    """
+
+    def __init__(self, recorded_skips=None):
+        self._event = threading.Event()
+        self._recorded_skips = None if recorded_skips is None else set(recorded_skips)
+
+    def set(self):
+        self._event.set()
+
+    def skips(self, sample_id):
+        if self._recorded_skips is not None:
+            return sample_id in self._recorded_skips
+        return self._event.is_set()
+
+
+@dataclass
+class OptimizerSettings:
+    """优化参数"""
+    max_iterations: int = 10
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    early_stopping: bool = True
+    decision_confidence: float = None
+    racing_enabled: bool = False
+    racing_stages: list = field(default_factory=lambda: list(DEFAULT_RACING_STAGES))
+    promotion_threshold: float = 0.5
+    population_size: int = 1
+    stream_outputs: bool = False
+    deduplicate: bool = True
+    similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD
+    packed_judging: bool = False
+    max_packed_samples: int = MAX_PACKED_SAMPLES
+    cascade_enabled: bool = False
+    cascade_confidence: float = 0.8
+    cascade_accept_ties: bool = False
+    speculative: bool = False
+    reuse_samples: bool = True
+    sample_count: int = None
+    sample_version: int = None
+
+
+@dataclass
+class OptimizationState:
+    """一次优化任务的全部状态
+
+    optimization_history 以紧凑形式保存：提示词只保存相对于父提示的差异，
+    分析和各样本输出只保存内容哈希。用 history_item() 取得完整的记录。
+    """
+    task_description: str = ""
+    current_best_prompt: str = ""
+    initial_prompt: str = ""
+    samples: list = field(default_factory=list)
+    sample_version: int = None
+    current_best_outputs: dict = field(default_factory=dict)
+    current_best_failures: dict = field(default_factory=dict)
+    current_iteration: int = 0
+    new_prompt: str = ""
+    new_outputs: dict = field(default_factory=dict)
+    evaluations: dict = field(default_factory=dict)
+    analysis: str = ""
+    optimization_history: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.initial_prompt:
+            self.initial_prompt = self.current_best_prompt
+
+    def to_dict(self):
+        """完整的状态，历史记录展开为包含提示词和分析的形式"""
+        data = asdict(self)
+        data["optimization_history"] = [self.history_item(index) for index in range(len(self.optimization_history))]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 to_dict 的结果（可能经过 JSON 序列化）恢复状态"""
+        history = data.get("optimization_history") or []
+        state = cls(**dict(data, optimization_history=[]))
+        samples = state.samples
+        state.current_best_outputs = restore_sample_keys(state.current_best_outputs, samples)
+        state.current_best_failures = restore_sample_keys(state.current_best_failures, samples)
+        state.new_outputs = restore_sample_keys(state.new_outputs, samples)
+        state.evaluations = restore_sample_keys(state.evaluations, samples)
+        for item in history:
+            item["evaluations"] = restore_sample_keys(item.get("evaluations") or {}, samples)
+            item["failures"] = restore_sample_keys(item.get("failures") or {}, samples)
+            item["output_refs"] = restore_sample_keys(item.get("output_refs") or {}, samples)
+            for candidate in item.get("candidates", []):
+                candidate["evaluations"] = restore_sample_keys(candidate["evaluations"], samples)
+            state.add_history(item)
+        return state
+
+    def _parent_prompt(self, index):
+        """第 index 次记录的父提示：此前最近一次改进成功的提示，没有时为初始提示"""
+        for previous in range(index - 1, -1, -1):
+            if self.optimization_history[previous]["is_better"]:
+                return self.history_prompt(previous)
+        return self.initial_prompt
+
+    def add_history(self, item, outputs=None):
+        """以紧凑形式追加一条历史记录
+
+        Args:
+            item: 包含 prompt 和 analysis 的完整记录
+            outputs: 本轮选中候选在各样本上的输出，写入内容寻址存储
+        """
+        blobs = get_blob_store()
+        parent = self._parent_prompt(len(self.optimization_history))
+
+        entry = {key: value for key, value in item.items() if key not in ("prompt", "analysis", "candidates")}
+        entry["prompt_delta"] = prompt_delta(parent, item["prompt"])
+        entry["analysis_ref"] = blobs.put(item.get("analysis") or "")
+        if outputs is not None:
+            entry["output_refs"] = {sample_id: blobs.put(output) for sample_id, output in outputs.items()}
+
+        if "candidates" in item:
+            entry["candidates"] = [
+                dict({key: value for key, value in candidate.items() if key != "prompt"},
+                     prompt_delta=prompt_delta(parent, candidate["prompt"]))
+                for candidate in item["candidates"]
+            ]
+
+        self.optimization_history.append(entry)
+        return entry
+
+    def history_prompt(self, index):
+        entry = self.optimization_history[index]
+        return apply_prompt_delta(self._parent_prompt(index), entry["prompt_delta"])
+
+    def history_outputs(self, index):
+        """第 index 次记录中各样本的输出，从内容寻址存储读取"""
+        blobs = get_blob_store()
+        refs = self.optimization_history[index].get("output_refs") or {}
+        return {sample_id: blobs.get(ref) for sample_id, ref in refs.items()}
+
+    def history_item(self, index):
+        """第 index 次记录的完整形式，与 iteration_finished 事件中的记录一致"""
+        entry = self.optimization_history[index]
+        parent = self._parent_prompt(index)
+
+        item = {key: value for key, value in entry.items() if key not in ("prompt_delta", "analysis_ref", "candidates")}
+        item["prompt"] = apply_prompt_delta(parent, entry["prompt_delta"])
+        item["analysis"] = get_blob_store().get(entry["analysis_ref"])
+        if "candidates" in entry:
+            item["candidates"] = [
+                dict({key: value for key, value in candidate.items() if key != "prompt_delta"},
+                     prompt=apply_prompt_delta(parent, candidate["prompt_delta"]))
+                for candidate in entry["candidates"]
+            ]
+        return item
+
+
+# JSON 序列化会把以样本 id 为键的字典键变成字符串，这里按样本列表恢复原始类型
+def restore_sample_keys(mapping, samples):
+    ids = {str(sample['id']): sample['id'] for sample in samples}
+    return {ids.get(str(key), key): value for key, value in mapping.items()}
+
+
+# 判断是否应该更新最佳提示
+def should_update_best_prompt(evaluations, tally=None):
+    # 提前判定时以增量统计的结论为准
+    if tally is not None and tally.settled:
+        return tally.decision
+
+    better_count = 0
+    worse_count = 0
+
+    for sample_id, result in evaluations.items():
+        if result == "B更好":
+            better_count += 1
+        elif result == "A更好":
+            worse_count += 1
+
+    # 如果有更多样本认为新提示更好，则更新
+    return better_count > worse_count
+
+
+# 从本轮的候选中选出一个：优先选胜过当前最佳提示且净胜票最多的；都没有胜出时只在实际评估过的候选中选，
+# 跳过评估的重复候选没有输出，其沿用的分数不能与本轮的评估结果比较
+def select_candidate(candidates):
+    winners = [candidate for candidate in candidates if candidate["is_better"]]
+    evaluated = [candidate for candidate in candidates if candidate.get("duplicate_of") is None]
+    return max(winners or evaluated or candidates, key=lambda candidate: candidate["score"])
+
+
+# 种群模式下各候选使用的温度，在区间内均匀分布；单个候选时使用后端默认温度
+def candidate_temperatures(count):
+    if count <= 1:
+        return [None]
+
+    low, high = CANDIDATE_TEMPERATURE_RANGE
+    step = (high - low) / (count - 1)
+    return [round(low + step * i, 2) for i in range(count)]
+
+
+class Optimizer:
+    """提示优化引擎
+
+    Args:
+        client: SPOClient 实例
+        state: OptimizationState，引擎会原地更新
+        settings: OptimizerSettings
+        on_event: 事件回调 on_event(event, data)，可能在工作线程中调用。
+            事件包括 warning、error（data 含 message）、samples_generated（data 含
+            samples、样本集版本 version、是否复用 reused 和去掉的重复问题数 removed）、
+            best_outputs_ready、iteration_started、candidate_generated、
+            sample_evaluated、analysis_ready、iteration_finished（data 含 item）、
+            iteration_cancelled，以及开启 stream_outputs 时逐段产生的 output_token
+        checkpoint: 可选的 Checkpoint，所有事件同时交给它持久化
+        pending: 从检查点恢复的未完成迭代，其中已有的候选、样本结果和分析会被复用
+        sample_store: 开启 reuse_samples 时使用的 SampleStore，默认为共享的存储
+    """
+
+    def __init__(self, client, state, settings=None, on_event=None, checkpoint=None, pending=None,
+                 sample_store=None):
+        self.client = client
+        self.state = state
+        self.settings = settings or OptimizerSettings()
+        self.on_event = on_event
+        self.checkpoint = checkpoint
+        self.pending = pending
+        self.sample_store = sample_store
+        self.cancelled = threading.Event()
+        self._prompt_index = None
+        self._speculation = None
+        self._sample_slots = None
+        self.racing_seed = self._racing_seed()
+
+    @property
+    def _recording(self):
+        cassette = self.client.cassette
+        return cassette is not None and not cassette.replaying
+
+    @property
+    def _replaying(self):
+        cassette = self.client.cassette
+        return cassette is not None and cassette.replaying
+
+    # 竞速模式选取样本子集的随机种子；录制时写入录制文件，回放时沿用录制的种子
+    def _racing_seed(self):
+        if not self.settings.racing_enabled:
+            return None
+        if self._replaying:
+            recorded = self.client.cassette.trace("racing-seed", {}, consume=False)
+            if recorded:
+                return recorded["seed"]
+        seed = random.getrandbits(32)
+        if self._recording:
+            self.client.cassette.record_trace("racing-seed", {}, {"seed": seed})
+        return seed
+
+    @property
+    def finished(self):
+        return self.state.current_iteration >= self.settings.max_iterations
+
+    @property
+    def prompt_index(self):
+        """已评估提示的索引，首次使用时由初始提示和优化历史建立"""
+        if self._prompt_index is None:
+            index = PromptIndex()
+            index.add(self.state.initial_prompt, iteration=0)
+            for position in range(len(self.state.optimization_history)):
+                item = self.state.history_item(position)
+                for candidate in item.get("candidates") or [item]:
+                    index.add(candidate["prompt"], iteration=item["iteration"], verdict={
+                        "score": candidate["score"],
+                        "is_better": candidate["is_better"],
+                        "evaluations": candidate["evaluations"]
+                    })
+            self._prompt_index = index
+        return self._prompt_index
+
+    # 请求取消：尚未开始的调用不再执行，当前迭代作废，已完成的调用仍写入检查点
+    def cancel(self):
+        self.cancelled.set()
+        self.discard_speculation()
+
+    # 为当前线程中的后端调用附加迭代序号等标签；工作线程不继承调用方的标签，需各自设置
+    def _tags(self, **tags):
+        return call_context(**dict({"iteration": self.state.current_iteration}, **tags))
+
+    # 逐样本调用（执行和评估）的并发额度；种群模式下由本轮所有候选共享，总并发不超过 max_concurrency
+    def _sample_slot(self):
+        return self._sample_slots if self._sample_slots is not None else nullcontext()
+
+    def emit(self, event, **data):
+        if self.checkpoint:
+            self.checkpoint.handle(event, data, self.state)
+        if self.on_event:
+            self.on_event(event, data)
+
+    # 准备测试样本：开启 reuse_samples 时优先取出该任务保存的样本集，不足时生成补充并保存为新版本
+    def generate_samples(self):
+        settings = self.settings
+        task_description = self.state.task_description
+        store = (self.sample_store or get_sample_store()) if settings.reuse_samples else None
+
+        version, stored = store.get(task_description, settings.sample_version) if store else (None, [])
+        if settings.sample_version is not None and store and not stored:
+            version, stored = store.get(task_description)
+            fallback = f"使用最新的第 {version} 版" if stored else "重新生成"
+            self.emit("warning", message=f"找不到第 {settings.sample_version} 版测试样本，{fallback}")
+
+        count = settings.sample_count or len(stored)
+        reused = bool(stored) and len(stored) >= count
+        removed = 0
+        if reused:
+            samples = stored[:count]
+        else:
+            try:
+                samples, removed = self.fetch_samples(stored, count)
+            except TransportError as e:
+                self.emit("error", message=f"API调用失败: {str(e)}")
+                return []
+            if samples and store:
+                version = store.save(task_description, samples)
+
+        if not samples:
+            self.emit("error", message="生成测试样本失败")
+            return []
+
+        self.state.samples = samples
+        self.state.sample_version = version
+        self.emit("samples_generated", samples=samples, version=version, reused=reused, removed=removed)
+        return samples
+
+    # 生成样本并与已有的样本合并，返回 (样本, 去掉的重复问题数)
+    # count 为空时按原来的方式发起一次请求；否则按 SHARD_SIZE 拆成并行的分片请求，
+    # 合并去重后仍然不足时再补充生成，最多 MAX_TOP_UP_ROUNDS 轮
+    def fetch_samples(self, existing, count):
+        if not count:
+            with self._tags():
+                return self.client.generate_samples(self.state.task_description), 0
+
+        def fetch(shard):
+            index, size = shard
+            with self._tags(shard=index):
+                return self.client.generate_samples(self.state.task_description, count=size, shard=index)
+
+        groups = [existing]
+        samples, removed = merge_samples(groups)
+        # 分片序号接在已有样本之后，补充生成时不会重复命中之前分片的缓存响应
+        next_shard = math.ceil(len(existing) / SHARD_SIZE)
+        for round_index in range(1 + MAX_TOP_UP_ROUNDS):
+            missing = count - len(samples)
+            if missing <= 0:
+                break
+            # 补充生成时多要一倍，抵消其中再次出现的重复问题，多余的样本舍去
+            shards = plan_shards(missing * 2 if round_index else missing, start=next_shard)
+            next_shard += len(shards)
+            results, errors = run_parallel(fetch, shards, key=lambda shard: shard[0],
+                                           max_workers=self.settings.max_concurrency)
+            for index, error in errors.items():
+                self.emit("warning", message=f"第 {index + 1} 组测试样本生成失败: {error}")
+            if not results:
+                break
+            groups.extend(results.values())
+            samples, removed = merge_samples(groups)
+
+        if len(samples) < count:
+            self.emit("warning", message=f"只得到 {len(samples)} 个不重复的测试样本，少于要求的 {count} 个")
+        return samples[:count], removed
+
+    # 在单个样本上执行提示词；开启流式输出时逐段发出 output_token 事件
+    def execute_prompt(self, prompt, sample):
+        with self._tags(sample_id=sample['id']), self._sample_slot():
+            if not self.settings.stream_outputs:
+                return self.client.execute_prompt(prompt, sample['question'])
+
+            return self.client.execute_prompt_stream(
+                prompt,
+                sample['question'],
+                lambda token: self.emit("output_token", prompt=prompt, sample_id=sample['id'], token=token)
+            )
+
+    # 在所有样本上并发执行提示词，返回 (输出, 失败样本及原因)
+    def execute_prompt_on_samples(self, prompt, samples):
+        results, errors = run_parallel(
+            lambda sample: self.execute_prompt(prompt, sample),
+            samples,
+            key=lambda sample: sample['id'],
+            max_workers=self.settings.max_concurrency
+        )
+
+        for sample_id, error in errors.items():
+            self.emit("warning", message=f"样本 {sample_id} 执行失败: {error}")
+
+        # 保持样本顺序，失败的样本输出为空
+        outputs = {sample['id']: results.get(sample['id'], "") for sample in samples}
+        return outputs, errors
+
+    # 执行当前最佳提示词
+    def run_current_best_prompt(self):
+        outputs, errors = self.execute_prompt_on_samples(
+            self.state.current_best_prompt,
+            self.state.samples
+        )
+
+        self.state.current_best_outputs = outputs
+        self.state.current_best_failures = errors
+
+        # 所有样本都失败时视为执行失败
+        if len(errors) == len(outputs):
+            self.emit("error", message="执行当前提示词失败")
+            return {}
+
+        self.emit("best_outputs_ready", outputs=outputs)
+        return outputs
+
+    # 生成测试样本（如尚未生成）并执行当前最佳提示词
+    def prepare(self):
+        if not self.state.samples and not self.generate_samples():
+            return False
+        return bool(self.run_current_best_prompt())
+
+    # 获取优化历史摘要；assumed 为 (迭代序号, 是否改进)，表示假定结果的尚未完成的迭代
+    def get_optimization_history_summary(self, assumed=None):
+        history = [(item['iteration'], item['is_better']) for item in self.state.optimization_history]
+        if assumed is not None:
+            history.append(assumed)
+        if not history:
+            return ""
+
+        # 只取最近3次迭代的历史
+        return "\n".join([
+            f"迭代{iteration}: {'改进成功' if is_better else '未改进'}"
+            for iteration, is_better in history[-3:]
+        ])
+
+    # 在单个样本上执行新提示并立即与当前最佳输出比较
+    # 执行失败时抛出异常；评估失败时返回 (输出, EVALUATION_FAILED, 错误信息)
+    def execute_and_evaluate(self, prompt, sample, best_outputs, best_failures, settled, recorded):
+        sample_id = sample['id']
+        if sample_id in recorded:
+            return tuple(recorded[sample_id])
+        if self.cancelled.is_set():
+            raise OptimizationCancelled()
+
+        output = self.execute_prompt(prompt, sample)
+        result = self._compare(output, sample, best_outputs, best_failures, settled)
+        self.emit(
+            "sample_evaluated",
+            iteration=self.state.current_iteration,
+            prompt=prompt,
+            sample_id=sample_id,
+            output=result[0],
+            evaluation=result[1],
+            error=result[2]
+        )
+        return result
+
+    def _compare(self, output, sample, best_outputs, best_failures, settled):
+        sample_id = sample['id']
+
+        # 胜负已定，不再需要评估
+        if settled.skips(sample_id):
+            return output, EVALUATION_SKIPPED, None
+
+        # 当前最佳提示在该样本上执行失败时无法比较
+        if sample_id in best_failures:
+            return output, EVALUATION_FAILED, None
+
+        try:
+            if self.settings.cascade_enabled:
+                with self._sample_slot():
+                    evaluation = self.cascade_evaluate(best_outputs.get(sample_id, ""), output, sample)
+            else:
+                with self._tags(sample_id=sample_id), self._sample_slot():
+                    evaluation = self.client.evaluate_outputs(
+                        best_outputs.get(sample_id, ""),
+                        output,
+                        self.state.task_description,
+                        sample['question']
+                    )
+        except TransportError as e:
+            return output, EVALUATION_FAILED, str(e)
+
+        return output, evaluation, None
+
+    # 分级评估：先由快速评估模型判定，判为相似、置信度不足或调用失败时再交给评估模型
+    # “相似”决定是否采用新提示，默认总是复核；开启 cascade_accept_ties 后有把握的“相似”也直接采用
+    # 交给评估模型的调用带有 escalation 标签（tie、low_confidence、error），用于统计各级的命中率
+    def cascade_evaluate(self, output_a, output_b, sample):
+        try:
+            with self._tags(sample_id=sample['id']):
+                evaluation, confidence = self.client.screen_outputs(
+                    output_a, output_b, self.state.task_description, sample['question']
+                )
+        except TransportError:
+            escalation = "error"
+        else:
+            if evaluation == SIMILAR and not self.settings.cascade_accept_ties:
+                escalation = "tie"
+            elif confidence < self.settings.cascade_confidence:
+                escalation = "low_confidence"
+            else:
+                return evaluation
+
+        with self._tags(sample_id=sample['id'], escalation=escalation):
+            return self.client.evaluate_outputs(output_a, output_b, self.state.task_description, sample['question'])
+
+    # 打包评估模式下处理一批样本：先执行全部样本，再把比较按上下文长度分块，每块一次评估调用
+    # 返回值与逐样本模式的 run_parallel 相同
+    def run_packed_stage(self, prompt, samples, best_outputs, best_failures, settled, recorded, max_workers, on_verdict):
+        results = {}
+        cancel = False
+        for sample in samples:
+            if sample['id'] in recorded:
+                results[sample['id']] = tuple(recorded[sample['id']])
+                cancel = on_verdict(sample['id'], results[sample['id']]) or cancel
+
+        def execute(sample):
+            if self.cancelled.is_set():
+                raise OptimizationCancelled()
+            return self.execute_prompt(prompt, sample)
+
+        pending = [sample for sample in samples if sample['id'] not in recorded]
+        if cancel:
+            pending = []
+        outputs, failures = run_parallel(execute, pending, key=lambda sample: sample['id'], max_workers=max_workers)
+        if self.cancelled.is_set():
+            raise OptimizationCancelled()
+
+        def finish(sample, result):
+            results[sample['id']] = result
+            self.emit(
+                "sample_evaluated",
+                iteration=self.state.current_iteration,
+                prompt=prompt,
+                sample_id=sample['id'],
+                output=result[0],
+                evaluation=result[1],
+                error=result[2]
+            )
+            return on_verdict(sample['id'], result)
+
+        comparisons = []
+        for sample in pending:
+            if sample['id'] not in outputs:
+                continue
+            if sample['id'] in best_failures:
+                finish(sample, (outputs[sample['id']], EVALUATION_FAILED, None))
+                continue
+            comparisons.append(sample)
+
+        items = [{
+            "id": sample['id'],
+            "question": sample['question'],
+            "outputA": best_outputs.get(sample['id'], ""),
+            "outputB": outputs[sample['id']]
+        } for sample in comparisons]
+        chunks = pack_comparisons(
+            items,
+            self.state.task_description,
+            context_limit(self.client.models.get("evaluator")),
+            self.settings.max_packed_samples
+        )
+        by_id = {sample['id']: sample for sample in comparisons}
+
+        def on_chunk(chunk_key, chunk_results):
+            stop = False
+            for sample_id, result in chunk_results.items():
+                stop = finish(by_id[sample_id], result) or stop
+            return stop
+
+        run_parallel(
+            lambda chunk: self.judge_packed(chunk, by_id, best_outputs, best_failures, settled, max_workers),
+            chunks,
+            key=lambda chunk: chunk[0]["id"],
+            max_workers=max_workers,
+            on_result=on_chunk
+        )
+
+        # 因提前判定而未评估的样本
+        for sample in comparisons:
+            if sample['id'] not in results:
+                finish(sample, (outputs[sample['id']], EVALUATION_SKIPPED, None))
+
+        return results, failures
+
+    # 用一次调用评估一块比较，返回 {样本 id: (输出, 评估结果, 错误信息)}
+    # 调用失败或响应中缺少的样本改为逐个评估
+    def judge_packed(self, chunk, samples, best_outputs, best_failures, settled, max_workers):
+        if all(settled.skips(item["id"]) for item in chunk):
+            return {item["id"]: (item["outputB"], EVALUATION_SKIPPED, None) for item in chunk}
+
+        try:
+            with self._tags(), self._sample_slot():
+                text = self.client.evaluate_outputs_batch(self.state.task_description, chunk)
+        except TransportError as e:
+            self.emit("warning", message=f"打包评估失败，改为逐个评估: {str(e)}")
+            verdicts = {}
+        else:
+            verdicts = parse_packed_verdicts(text, [item["id"] for item in chunk])
+            if len(verdicts) < len(chunk):
+                self.emit("warning", message=f"打包评估的响应中有 {len(chunk) - len(verdicts)} 个样本的结果无法解析，改为逐个评估")
+
+        results = {item["id"]: (item["outputB"], verdicts[item["id"]], None) for item in chunk if item["id"] in verdicts}
+        missing = [item for item in chunk if item["id"] not in verdicts]
+
+        fallback, errors = run_parallel(
+            lambda item: self._compare(item["outputB"], samples[item["id"]], best_outputs, best_failures, settled),
+            missing,
+            key=lambda item: item["id"],
+            max_workers=max_workers
+        )
+        results.update(fallback)
+        for item in missing:
+            if item["id"] in errors:
+                results[item["id"]] = (item["outputB"], EVALUATION_FAILED, errors[item["id"]])
+        return results
+
+    # 在测试样本上执行并评估候选提示
+    # 竞速模式下先在随机子集上比较，只有胜过当前最佳提示才扩大到更多样本
+    # 录制时把评估结果计入统计的顺序、跳过评估和取消执行的样本写入录制文件，回放时照此进行
+    def evaluate_candidate(self, new_prompt, best_outputs, best_failures, max_workers, recorded=None):
+        samples = self.state.samples
+        settings = self.settings
+        early_stopping = settings.early_stopping
+        trace_key = {"iteration": self.state.current_iteration, "prompt": new_prompt}
+        trace = self.client.cassette.trace("evaluate-candidate", trace_key) if self._replaying else None
+
+        if settings.racing_enabled:
+            # 每个候选的子集顺序由运行的随机种子和候选提示决定，与并行候选的完成顺序无关
+            order = random.Random(f"{self.racing_seed}:{new_prompt}").sample(samples, len(samples))
+            stages = racing_schedule(len(samples), settings.racing_stages)
+        else:
+            order = samples
+            stages = [len(samples)]
+
+        # 评估结果逐个到达时增量统计，胜负已定后跳过剩余评估；
+        # 新提示确定落败时还会取消尚未开始的执行
+        tally = VerdictTally(
+            len(samples),
+            confidence=settings.decision_confidence if early_stopping else None
+        )
+        settled = Settlement(trace["skipped"] if trace else None)
+        counted = []
+
+        def on_verdict(sample_id, result):
+            if result[1] == EVALUATION_SKIPPED:
+                return False
+            counted.append(sample_id)
+            was_settled = tally.settled
+            tally.add(result[1])
+            if not early_stopping or was_settled or not tally.settled:
+                return False
+            settled.set()
+            return not tally.decision
+
+        results = {}
+        execution_failures = {}
+        evaluated = 0
+        eliminated_at = None
+
+        for stage_size in stages:
+            stage_samples = order[evaluated:stage_size]
+            stage_on_verdict = on_verdict
+            if trace:
+                # 回放时不取消执行，录制中取消的样本直接不执行；全部结果到达后按录制的顺序计入统计
+                stage_samples = [sample for sample in stage_samples if sample['id'] not in trace["cancelled"]]
+                stage_on_verdict = lambda sample_id, result: False
+
+            if settings.packed_judging:
+                stage_results, stage_failures = self.run_packed_stage(
+                    new_prompt, stage_samples, best_outputs, best_failures,
+                    settled, recorded or {}, max_workers, stage_on_verdict
+                )
+            else:
+                stage_results, stage_failures = run_parallel(
+                    lambda sample: self.execute_and_evaluate(
+                        new_prompt, sample, best_outputs, best_failures, settled, recorded or {}
+                    ),
+                    stage_samples,
+                    key=lambda sample: sample['id'],
+                    max_workers=max_workers,
+                    on_result=stage_on_verdict
+                )
+            if trace:
+                recorded_order = [sample_id for sample_id in trace["order"] if sample_id in stage_results]
+                for sample_id in recorded_order + [sample_id for sample_id in stage_results if sample_id not in recorded_order]:
+                    on_verdict(sample_id, stage_results[sample_id])
+            results.update(stage_results)
+            execution_failures.update(stage_failures)
+            evaluated = stage_size
+
+            if tally.settled and not tally.decision:
+                break
+
+            # 未在当前子集上胜过最佳提示的候选直接淘汰
+            if stage_size < len(samples) and not tally.settled and \
+                    not should_promote(tally, settings.promotion_threshold):
+                eliminated_at = stage_size
+                break
+
+        if self.cancelled.is_set():
+            raise OptimizationCancelled()
+
+        evaluated_ids = {sample['id'] for sample in order[:evaluated]}
+        outputs = {}
+        evaluations = {}
+        failures = dict(execution_failures)
+        for sample in samples:
+            sample_id = sample['id']
+            if sample_id not in evaluated_ids:
+                continue
+
+            if sample_id in execution_failures:
+                self.emit("warning", message=f"样本 {sample_id} 执行失败: {execution_failures[sample_id]}")
+                outputs[sample_id] = ""
+                evaluations[sample_id] = EVALUATION_FAILED
+                continue
+
+            if sample_id not in results:
+                # 因提前判定落败而取消
+                outputs[sample_id] = ""
+                evaluations[sample_id] = EVALUATION_SKIPPED
+                continue
+
+            output, evaluation, error = results[sample_id]
+            outputs[sample_id] = output
+            evaluations[sample_id] = evaluation
+            if error:
+                self.emit("warning", message=f"样本 {sample_id} 评估失败: {error}")
+                failures[sample_id] = error
+
+        if self._recording:
+            self.client.cassette.record_trace("evaluate-candidate", trace_key, {
+                "order": counted,
+                "skipped": [sample_id for sample_id, result in results.items() if result[1] == EVALUATION_SKIPPED],
+                "cancelled": [sample_id for sample_id, evaluation in evaluations.items()
+                              if evaluation == EVALUATION_SKIPPED and sample_id not in results]
+            })
+
+        return {
+            "outputs": outputs,
+            "evaluations": evaluations,
+            "failures": failures,
+            "execution_failures": execution_failures,
+            "is_better": eliminated_at is None and should_update_best_prompt(evaluations, tally),
+            "score": tally.better - tally.worse,
+            "decided_early": early_stopping and tally.decided_early,
+            "eliminated_at": eliminated_at
+        }
+
+    # 分析提示变化，失败时返回空字符串
+    def analyze_changes(self, old_prompt, new_prompt):
+        try:
+            with self._tags():
+                analysis = self.client.analyze_changes(old_prompt, new_prompt, self.state.task_description)
+        except TransportError as e:
+            self.emit("warning", message=f"分析提示变化失败: {str(e)}")
+            return ""
+
+        self.emit("analysis_ready", iteration=self.state.current_iteration, prompt=new_prompt, analysis=analysis)
+        return analysis
+
+    # 在优化模型的上下文预算内构造当前输出部分，返回 (JSON 字符串, 统计)
+    def optimizer_payload(self, current_best_prompt, best_outputs, history_summary):
+        return build_outputs_payload(
+            best_outputs,
+            payload_budget("optimizer", self.client.models.get("optimizer")),
+            ranking=rank_samples(list(best_outputs), self.state.optimization_history),
+            reserved_tokens=reserved_tokens(current_best_prompt, self.state.task_description, history_summary)
+        )
+
+    # 调用优化器，payload 为 optimizer_payload 的结果；输出部分的大小作为 payload_* 标签记录在调用统计中，
+    # 并在每次调用时以 optimizer_payload 事件发出，没有接入调用统计的运行（命令行、批量）同样能看到
+    def _call_optimizer(self, current_best_prompt, payload, history_summary, temperature, **tags):
+        payload, size = payload
+        self.emit("optimizer_payload", iteration=tags.get("iteration", self.state.current_iteration),
+                  speculative=bool(tags.get("speculative")), **size)
+        with self._tags(**tags, **{f"payload_{key}": value for key, value in size.items()}):
+            return self.client.optimize_prompt(
+                current_best_prompt,
+                payload,
+                self.state.task_description,
+                history_summary,
+                temperature
+            )
+
+    # 调用优化器生成一个候选提示
+    def optimize_prompt(self, current_best_prompt, best_outputs, history_summary, temperature):
+        if self.cancelled.is_set():
+            raise OptimizationCancelled()
+        try:
+            payload = self.optimizer_payload(current_best_prompt, best_outputs, history_summary)
+            new_prompt = self._call_optimizer(current_best_prompt, payload, history_summary, temperature)
+        except TransportError as e:
+            self.emit("error", message=f"API调用失败: {str(e)}")
+            raise
+        if not new_prompt:
+            raise RuntimeError("优化提示词失败")
+        return new_prompt
+
+    # 查找与候选重复或过于相似的已尝试提示，返回 (条目, 相似度)，没有时返回 None
+    def find_duplicate(self, prompt):
+        if not self.settings.deduplicate:
+            return None
+        entry, similarity = self.prompt_index.find(prompt)
+        if entry is None or similarity < self.settings.similarity_threshold:
+            return None
+        return entry, similarity
+
+    # 生成候选提示，返回 (提示, 重复信息)；speculated 为提前生成的候选，给出时不再调用优化器
+    # 与已尝试的提示过于相似时附加提示重新生成一次，仍然相似时返回重复信息，否则登记到索引
+    def generate_candidate(self, current_best_prompt, best_outputs, history_summary, temperature, speculated=None):
+        new_prompt = speculated or self.optimize_prompt(current_best_prompt, best_outputs, history_summary, temperature)
+        duplicate = self.find_duplicate(new_prompt)
+        if duplicate is not None and duplicate[0]["fingerprint"] != prompt_fingerprint(new_prompt):
+            hint = f"{history_summary}\n{DIVERSITY_HINT}" if history_summary else DIVERSITY_HINT
+            new_prompt = self.optimize_prompt(current_best_prompt, best_outputs, hint, temperature)
+            duplicate = self.find_duplicate(new_prompt)
+
+        if duplicate is None and self.settings.deduplicate:
+            # 先登记再评估，同一轮中并行生成的重复候选也能被发现
+            self.prompt_index.add(new_prompt, iteration=self.state.current_iteration)
+        return new_prompt, duplicate
+
+    # 重复候选的结果：完全重复时沿用记录的评估结果，过于相似时视为未改进
+    # 沿用的结果不会使候选胜出：与当前最佳提示比较胜出过的提示已经成为最佳提示
+    def duplicate_candidate(self, prompt, temperature, duplicate):
+        entry, similarity = duplicate
+        exact = entry["fingerprint"] == prompt_fingerprint(prompt)
+        verdict = entry["verdict"] if exact else None
+        if verdict is not None:
+            message = f"候选与迭代 {entry['iteration']} 中的提示重复，沿用其评估结果"
+        elif exact:
+            message = "候选与已尝试的提示相同，跳过评估"
+        else:
+            message = f"候选与已尝试的提示过于相似（相似度 {similarity:.2f}），跳过评估"
+        self.emit("warning", message=message)
+
+        return {
+            "prompt": prompt,
+            "temperature": temperature,
+            "outputs": {},
+            "evaluations": dict(verdict["evaluations"]) if verdict else {},
+            "failures": {},
+            "execution_failures": {},
+            "is_better": False,
+            "score": verdict["score"] if verdict else 0,
+            "decided_early": False,
+            "eliminated_at": None,
+            "duplicate_of": entry["iteration"],
+            "analysis": ""
+        }
+
+    # 在当前迭代评估期间提前生成下一轮的候选，假定本轮候选不会胜出（大多数候选都不会）
+    # 生成使用本轮开始时的最佳提示和输出，以及假定本轮未改进的历史摘要
+    def speculate(self, current_best_prompt, best_outputs, temperatures):
+        iteration = self.state.current_iteration
+        if not self.settings.speculative or iteration >= self.settings.max_iterations or self.cancelled.is_set():
+            return
+
+        history_summary = self.get_optimization_history_summary(assumed=(iteration, False))
+        payload = self.optimizer_payload(current_best_prompt, best_outputs, history_summary)
+        discarded = threading.Event()
+
+        def generate(temperature):
+            if discarded.is_set() or self.cancelled.is_set():
+                raise OptimizationCancelled()
+            return self._call_optimizer(
+                current_best_prompt, payload, history_summary, temperature,
+                iteration=iteration + 1, speculative=True
+            )
+
+        # 失败的生成不报告，下一轮使用时改为正常生成
+        future = run_in_background(lambda: run_parallel(
+            generate,
+            temperatures,
+            key=lambda temperature: temperature,
+            max_workers=len(temperatures)
+        )[0])
+        self._speculation = {
+            "iteration": iteration + 1,
+            "best_prompt": current_best_prompt,
+            "future": future,
+            "discarded": discarded
+        }
+
+    # 放弃提前生成的候选：尚未开始的生成不再调用优化器，已经开始的结果被丢弃
+    def discard_speculation(self):
+        speculation, self._speculation = self._speculation, None
+        if speculation is not None:
+            speculation["discarded"].set()
+        return speculation
+
+    # 取出本轮可用的提前生成的候选，返回 ({温度: 提示}, 命中情况)，没有提前生成时命中情况为 None
+    # 上一轮的候选胜出后最佳提示已经改变，提前生成的候选作废，记为 miss
+    def take_speculation(self, iteration, current_best_prompt):
+        speculation = self.discard_speculation()
+        if speculation is None or speculation["iteration"] != iteration:
+            return {}, None
+        if speculation["best_prompt"] != current_best_prompt:
+            return {}, "miss"
+        speculated = {
+            temperature: prompt for temperature, prompt in speculation["future"].result().items() if prompt
+        }
+        # 提前生成全部失败时正常生成，记为 failed
+        return speculated, "hit" if speculated else "failed"
+
+    # 运行一次优化迭代，返回本轮的历史记录；生成候选全部失败时返回 None
+    def run_step(self):
+        state = self.state
+        if self.finished:
+            return None
+
+        state.current_iteration += 1
+        self.emit("iteration_started", iteration=state.current_iteration)
+
+        # 从检查点恢复的同一迭代中已经得到的结果
+        pending = self.pending if self.pending and self.pending["iteration"] == state.current_iteration else {}
+        self.pending = None
+        pending_candidates = pending.get("candidates", {})
+        pending_samples = pending.get("samples", {})
+        pending_analyses = pending.get("analyses", {})
+
+        # 工作线程只读取这些快照
+        best_outputs = dict(state.current_best_outputs)
+        best_failures = dict(state.current_best_failures)
+        current_best_prompt = state.current_best_prompt
+        history_summary = self.get_optimization_history_summary()
+        temperatures = candidate_temperatures(self.settings.population_size)
+        speculated, speculation = self.take_speculation(state.current_iteration, current_best_prompt)
+
+        # 本轮的候选生成完毕后开始提前生成下一轮的候选，只启动一次
+        speculation_lock = threading.Lock()
+        speculation_started = []
+
+        def start_speculation():
+            with speculation_lock:
+                if not speculation_started:
+                    speculation_started.append(True)
+                    self.speculate(current_best_prompt, best_outputs, temperatures)
+
+        # 种群模式下所有候选的逐样本调用共享 max_concurrency 个额度，空闲的候选不占用额度
+        max_workers = self.settings.max_concurrency
+        self._sample_slots = threading.BoundedSemaphore(max_workers) if len(temperatures) > 1 else None
+
+        # 生成、执行、评估单个候选；分析提示变化与执行同时进行
+        def run_candidate(temperature):
+            # 1. 生成新提示候选；与已尝试的提示重复时不再执行和评估
+            new_prompt = pending_candidates.get(temperature)
+            if new_prompt is None:
+                new_prompt, duplicate = self.generate_candidate(
+                    current_best_prompt, best_outputs, history_summary, temperature, speculated.get(temperature)
+                )
+                self.emit("candidate_generated", iteration=state.current_iteration,
+                          temperature=temperature, prompt=new_prompt)
+                start_speculation()
+                if duplicate is not None:
+                    return self.duplicate_candidate(new_prompt, temperature, duplicate)
+            else:
+                start_speculation()
+
+            # 2~4. 每个样本的输出一到达即开始评估
+            if new_prompt in pending_analyses:
+                analysis_future = None
+            else:
+                analysis_future = run_in_background(self.analyze_changes, current_best_prompt, new_prompt)
+
+            candidate = self.evaluate_candidate(
+                new_prompt, best_outputs, best_failures, max_workers, pending_samples.get(new_prompt)
+            )
+            candidate["prompt"] = new_prompt
+            candidate["temperature"] = temperature
+            if analysis_future is None:
+                candidate["analysis"] = pending_analyses[new_prompt]
+            else:
+                candidate["analysis"] = analysis_future.result()
+            if self.settings.deduplicate:
+                self.prompt_index.add(new_prompt, iteration=state.current_iteration, verdict={
+                    "score": candidate["score"],
+                    "is_better": candidate["is_better"],
+                    "evaluations": candidate["evaluations"]
+                })
+            return candidate
+
+        results, errors = run_parallel(
+            run_candidate,
+            temperatures,
+            key=lambda temperature: temperature,
+            max_workers=len(temperatures)
+        )
+
+        if self.cancelled.is_set():
+            self.discard_speculation()
+            state.current_iteration -= 1
+            self.emit("iteration_cancelled", iteration=state.current_iteration + 1)
+            return None
+
+        if not results:
+            self.discard_speculation()
+            self.emit("error", message="优化提示词失败")
+            return None
+
+        # 5. 在胜过当前最佳提示的候选中选出净胜票最多的一个
+        candidates = list(results.values())
+        selected = select_candidate(candidates)
+
+        new_prompt = selected["prompt"]
+        is_better = selected["is_better"]
+
+        state.new_prompt = new_prompt
+        state.new_outputs = selected["outputs"]
+        state.evaluations = selected["evaluations"]
+        state.analysis = selected["analysis"]
+
+        if is_better:
+            state.current_best_prompt = new_prompt
+            state.current_best_outputs = selected["outputs"]
+            state.current_best_failures = selected["execution_failures"]
+
+        # 记录优化历史
+        history_item = {
+            "iteration": state.current_iteration,
+            "prompt": new_prompt,
+            "is_better": is_better,
+            "score": selected["score"],
+            "analysis": selected["analysis"],
+            "evaluations": selected["evaluations"],
+            "failures": selected["failures"],
+            "decided_early": selected["decided_early"],
+            "eliminated_at": selected["eliminated_at"],
+            "duplicate_of": selected.get("duplicate_of"),
+            "speculation": speculation
+        }
+
+        # 种群模式下记录本轮所有候选及其得分
+        if len(temperatures) > 1:
+            history_item["candidates"] = [{
+                "prompt": candidate["prompt"],
+                "temperature": candidate["temperature"],
+                "score": candidate["score"],
+                "is_better": candidate["is_better"],
+                "eliminated_at": candidate["eliminated_at"],
+                "duplicate_of": candidate.get("duplicate_of"),
+                "evaluations": candidate["evaluations"]
+            } for candidate in candidates]
+
+        state.add_history(history_item, selected["outputs"])
+        self.emit("iteration_finished", item=history_item)
+        return history_item
+
+    # 连续运行优化迭代直到达到最大迭代次数，返回是否正常结束
+    def run(self):
+        while not self.finished and not self.cancelled.is_set():
+            if self.run_step() is None:
+                return False
+        return self.finished
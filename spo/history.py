@@ -0,0 +1,100 @@
+"""优化历史的紧凑存储
+
+迭代之间提示词通常只有少量改动，历史中的每个提示词只保存相对于其父提示
+（产生它的当前最佳提示）的行级差异；分析文本和各样本的输出写入按内容寻址的
+本地存储，历史中只保留哈希，显示时再按需读取。这样会话内存基本不随迭代次数增长。
+"""
+import difflib
+import hashlib
+import os
+import threading
+
+DEFAULT_BLOB_PATH = os.getenv("HISTORY_BLOB_PATH", os.path.join(".spo", "blobs"))
+
+
+def prompt_delta(parent, prompt):
+    """计算 prompt 相对于 parent 的行级差异
+
+    结果是一个列表，[起, 止] 表示复制父提示的第 起..止 行，字符串表示新增的行。
+    """
+    parent_lines = parent.splitlines(keepends=True)
+    lines = prompt.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, parent_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        else:
+            delta.extend(lines[j1:j2])
+    return delta
+
+
+def apply_prompt_delta(parent, delta):
+    """由父提示和 prompt_delta 的结果还原提示词"""
+    parent_lines = parent.splitlines(keepends=True)
+    parts = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(parent_lines[op[0]:op[1]])
+    return "".join(parts)
+
+
+class BlobStore:
+    """按内容寻址的文本存储
+
+    每段文本以 SHA-256 为名保存为一个文件，相同内容只存一份。
+    path 为 None 时只保存在内存中。
+    """
+
+    def __init__(self, path=DEFAULT_BLOB_PATH):
+        self.path = path
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def put(self, text):
+        """保存文本并返回其哈希"""
+        data = text.encode("utf-8")
+        key = hashlib.sha256(data).hexdigest()
+        if self.path is None:
+            with self._lock:
+                self._memory[key] = text
+            return key
+
+        filename = self._file(key)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # 先写临时文件再改名，并发写入同一内容时不会读到半个文件
+            temporary = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, filename)
+        return key
+
+    def get(self, key, default=""):
+        """读取文本，找不到时（例如存储目录被清理）返回 default"""
+        if self.path is None:
+            with self._lock:
+                return self._memory.get(key, default)
+
+        try:
+            with open(self._file(key), "rb") as f:
+                return f.read().decode("utf-8")
+        except OSError:
+            return default
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(path=DEFAULT_BLOB_PATH):
+    """获取指定路径的共享存储实例"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = BlobStore(path)
+        return _stores[path]
@@ -0,0 +1,113 @@
+"""打包评估
+
+把一轮迭代中多个样本的 (问题, 输出A, 输出B) 放进一次评估请求，评估调用数从
+每个样本一次降到大约 样本数 / 每块样本数。每块的大小受评估模型上下文长度的限制，
+模型返回的结果按组号解析为逐样本的判定，解析不出的样本由调用方逐个重新评估。
+"""
+import json
+import math
+import os
+import re
+
+from .decision import BETTER, SIMILAR, WORSE
+
+# 未在 MODEL_CONTEXT_TOKENS 中配置的模型假定的上下文长度
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("DEFAULT_CONTEXT_TOKENS", "32000"))
+
+# 每块最多的样本数：一次比较的组数过多时评估质量会下降
+MAX_PACKED_SAMPLES = 8
+
+# 评估说明等固定内容，以及每组的标题、格式和判定结果预留的 token
+PROMPT_OVERHEAD_TOKENS = 400
+TOKENS_PER_ITEM = 40
+
+VERDICTS = (BETTER, WORSE, SIMILAR)
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+_OBJECT_PATTERN = re.compile(r"\{[\s\S]*\}")
+_LINE_PATTERN = re.compile(r"(\d+)\D{0,8}?(A更好|B更好|相似)")
+
+
+def estimate_tokens(text):
+    """按 UTF-8 字节数粗略估计 token 数：汉字约一个 token，英文偏保守"""
+    return math.ceil(len(text.encode("utf-8")) / 3)
+
+
+def load_context_limits():
+    """读取模型上下文长度（环境变量 MODEL_CONTEXT_TOKENS），格式为 {"模型名": token 数}"""
+    value = os.getenv("MODEL_CONTEXT_TOKENS")
+    if not value:
+        return {}
+    try:
+        return {model: int(tokens) for model, tokens in json.loads(value).items()}
+    except (ValueError, TypeError, AttributeError):
+        return {}
+
+
+def context_limit(model, limits=None):
+    limits = load_context_limits() if limits is None else limits
+    return limits.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+def item_tokens(item):
+    return estimate_tokens(item["question"]) + estimate_tokens(item["outputA"]) + \
+        estimate_tokens(item["outputB"]) + TOKENS_PER_ITEM
+
+
+def pack_comparisons(items, task_description, context_tokens, max_items=MAX_PACKED_SAMPLES):
+    """把比较项分块，每块的估计 token 数不超过上下文长度
+
+    Args:
+        items: [{"id", "question", "outputA", "outputB"}]
+        task_description: 任务描述，每块都会附带一份
+        context_tokens: 评估模型的上下文长度
+        max_items: 每块最多的比较项数
+
+    Returns:
+        分块后的列表；单个比较项超出预算时独占一块
+    """
+    budget = context_tokens - PROMPT_OVERHEAD_TOKENS - estimate_tokens(task_description)
+    chunks = []
+    chunk = []
+    used = 0
+    for item in items:
+        cost = item_tokens(item)
+        if chunk and (used + cost > budget or len(chunk) >= max_items):
+            chunks.append(chunk)
+            chunk = []
+            used = 0
+        chunk.append(item)
+        used += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def parse_packed_verdicts(text, ids):
+    """把打包评估的响应解析为 {样本 id: 判定}
+
+    优先按 JSON 对象 {"组号": 判定} 解析，失败时逐行查找“组号 … 判定”；
+    无法解析或判定不合法的样本不出现在结果中。
+    """
+    by_key = {str(sample_id): sample_id for sample_id in ids}
+    verdicts = {}
+
+    match = _FENCE_PATTERN.search(text)
+    body = match.group(1) if match else text
+    match = _OBJECT_PATTERN.search(body)
+    if match:
+        try:
+            parsed = json.loads(match.group(0))
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            for key, verdict in parsed.items():
+                if str(key) in by_key and isinstance(verdict, str) and verdict.strip() in VERDICTS:
+                    verdicts[by_key[str(key)]] = verdict.strip()
+
+    if not verdicts:
+        for key, verdict in _LINE_PATTERN.findall(text):
+            if key in by_key:
+                verdicts.setdefault(by_key[key], verdict)
+
+    return verdicts
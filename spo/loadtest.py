@@ -0,0 +1,166 @@
+"""多会话负载测试
+
+在同一进程中同时运行多个优化会话，模拟一台主机上的多个 Streamlit 用户。
+所有会话针对本地模拟后端（spo.mockserver），共享一个请求调度器，
+模拟的模型调用共享一个并发上限：
+
+    python -m spo.loadtest --sessions 24 --heavy 2 --iterations 2
+
+每个会话配置不同的模型，模拟后端在 usage.model 中报告会话配置的模型，
+以此检查会话之间的配置是否互相影响。另外先单独运行一个普通会话作为参照，
+报告并发时每个普通会话的耗时相对参照的倍数，以及普通会话耗时的 Jain 公平性指数。
+出现配置串扰、调用失败或未完成的会话时以非零状态退出。
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+
+from .benchmark import DEFAULT_LATENCY, INITIAL_PROMPT, TASK_DESCRIPTION
+from .client import SPOClient
+from .engine import OptimizationState, Optimizer, OptimizerSettings
+from .metrics import MetricsRecorder, percentile
+from .mockserver import MockBackend
+from .ratelimit import ROLE_PRIORITIES, RequestScheduler
+
+# 模拟的模型服务同时处理的调用数
+DEFAULT_UPSTREAM_CONCURRENCY = 16
+
+# 普通会话和大批量会话（如自动模式下的大种群运行）的设置
+LIGHT_SETTINGS = {"population_size": 1, "max_concurrency": 4}
+HEAVY_SETTINGS = {"population_size": 4, "max_concurrency": 20}
+
+
+def session_models(index):
+    return {role: f"mock/{role}-{index}" for role in ROLE_PRIORITIES}
+
+
+def run_session(backend_url, index, heavy, iterations, scheduler, start):
+    """运行一个会话，返回测量结果；start 为各会话同时开始的 threading.Barrier"""
+    metrics = MetricsRecorder(prices={})
+    client = SPOClient(backend_url, use_cache=False, scheduler=scheduler, metrics=metrics)
+    models = session_models(index)
+    client.configure(f"loadtest-{index}", "http://mock.local", models)
+
+    state = OptimizationState(task_description=TASK_DESCRIPTION, current_best_prompt=INITIAL_PROMPT)
+    settings = dict(HEAVY_SETTINGS if heavy else LIGHT_SETTINGS, max_iterations=iterations, early_stopping=False,
+                    reuse_samples=False)
+    optimizer = Optimizer(client, state, OptimizerSettings(**settings))
+
+    start.wait()
+    started = time.perf_counter()
+    ok = optimizer.prepare() and optimizer.run()
+    elapsed = time.perf_counter() - started
+
+    calls = metrics.calls
+    latencies = [call["elapsed"] for call in calls if not call["error"]]
+    # 模拟后端报告的模型与本会话的配置不同，说明用了其他会话的配置
+    leaks = [call for call in calls if call["role"] and not call["error"] and call["model"] != models[call["role"]]]
+    return {
+        "session": index,
+        "heavy": heavy,
+        "completed": bool(ok),
+        "time": round(elapsed, 3),
+        "calls": len(calls),
+        "errors": sum(1 for call in calls if call["error"]),
+        "p95_latency": percentile(latencies, 0.95),
+        "leaks": len(leaks)
+    }
+
+
+def run_sessions(backend, sessions, heavy, iterations, expire_after=None):
+    """同时运行 sessions 个会话，其中前 heavy 个为大批量会话
+
+    expire_after: 可选，开始后经过该秒数清除后端的全部会话，检查客户端能否重新配置并继续
+    """
+    scheduler = RequestScheduler()
+    start = threading.Barrier(sessions)
+    results = [None] * sessions
+
+    def target(index):
+        try:
+            results[index] = run_session(backend.url, index, index < heavy, iterations, scheduler, start)
+        except Exception as e:
+            results[index] = {"session": index, "heavy": index < heavy, "completed": False, "error": str(e),
+                              "time": None, "calls": 0, "errors": 1, "p95_latency": None, "leaks": 0}
+
+    threads = [threading.Thread(target=target, args=(index,), daemon=True) for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+    if expire_after is not None:
+        timer = threading.Timer(expire_after, backend.expire_sessions)
+        timer.daemon = True
+        timer.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def jain_index(values):
+    """Jain 公平性指数：1 表示完全均等，1/n 表示只有一个会话得到服务"""
+    if not values:
+        return None
+    return sum(values) ** 2 / (len(values) * sum(value * value for value in values))
+
+
+def summarize(results, reference_time):
+    light_times = [result["time"] for result in results if not result["heavy"] and result["time"] is not None]
+    slowdowns = [value / reference_time for value in light_times] if reference_time else []
+    return {
+        "sessions": len(results),
+        "completed": sum(1 for result in results if result["completed"]),
+        "errors": sum(result["errors"] for result in results),
+        "leaks": sum(result["leaks"] for result in results),
+        "reference_time": reference_time,
+        "light_time_p50": round(statistics.median(light_times), 3) if light_times else None,
+        "light_time_max": round(max(light_times), 3) if light_times else None,
+        "light_slowdown_max": round(max(slowdowns), 2) if slowdowns else None,
+        "light_fairness": round(jain_index(light_times), 3) if light_times else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m spo.loadtest", description="SPO+ 多会话负载测试")
+    parser.add_argument("--sessions", type=int, default=24, help="同时运行的会话数")
+    parser.add_argument("--heavy", type=int, default=2, help="其中大批量会话的个数")
+    parser.add_argument("--iterations", type=int, default=2, help="每个会话的迭代次数")
+    parser.add_argument("--samples", type=int, default=10, help="每个会话的样本数")
+    parser.add_argument("--upstream-concurrency", type=int, default=DEFAULT_UPSTREAM_CONCURRENCY,
+                        help="模拟的模型服务同时处理的调用数")
+    parser.add_argument("--expire-sessions", action="store_true",
+                        help="运行途中清除后端的全部会话，检查客户端能否重新配置")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    with MockBackend(samples=args.samples, latency=DEFAULT_LATENCY, seed=args.seed,
+                     max_concurrency=args.upstream_concurrency) as backend:
+        reference = run_sessions(backend, 1, 0, args.iterations)[0]
+        print(f"单独运行一个普通会话: {reference['time']} 秒", file=sys.stderr)
+
+        expire_after = reference["time"] / 2 if args.expire_sessions else None
+        results = run_sessions(backend, args.sessions, args.heavy, args.iterations, expire_after)
+
+    summary = summarize(results, reference["time"])
+    print(f"{summary['completed']}/{summary['sessions']} 个会话完成，{summary['errors']} 次调用失败，"
+          f"{summary['leaks']} 次配置串扰", file=sys.stderr)
+    print(f"普通会话耗时中位数 {summary['light_time_p50']} 秒，最长 {summary['light_time_max']} 秒"
+          f"（单独运行的 {summary['light_slowdown_max']} 倍），公平性指数 {summary['light_fairness']}",
+          file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "summary": summary,
+                "sessions": results
+            }, f, ensure_ascii=False, indent=2)
+
+    failed = summary["completed"] < summary["sessions"] or summary["errors"] or summary["leaks"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
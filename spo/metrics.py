@@ -0,0 +1,173 @@
+"""后端调用的计时、用量和成本统计
+
+SPOClient 在每次调用后写入一条记录：端点、模型角色、迭代序号、样本 id、
+耗时、请求和响应大小，以及后端报告的 token 用量。迭代序号和样本 id 来自
+call_context() 设置的线程上下文，由优化引擎在发起调用前设置。
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_context = threading.local()
+
+
+@contextmanager
+def call_context(**tags):
+    """为当前线程中发起的后端调用附加标签（如 iteration、sample_id），可以嵌套"""
+    previous = getattr(_context, "tags", {})
+    _context.tags = dict(previous, **tags)
+    try:
+        yield
+    finally:
+        _context.tags = previous
+
+
+def current_tags():
+    return dict(getattr(_context, "tags", {}))
+
+
+def load_model_prices():
+    """读取模型单价（环境变量 MODEL_PRICES），格式为
+    {"模型名": [每千输入 token 价格, 每千输出 token 价格]}"""
+    value = os.getenv("MODEL_PRICES")
+    if not value:
+        return {}
+    try:
+        return {model: tuple(price) for model, price in json.loads(value).items()}
+    except (ValueError, TypeError):
+        return {}
+
+
+def percentile(values, fraction):
+    """最近秩法百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def json_size(data):
+    """数据按 JSON 编码后的字节数"""
+    if data is None:
+        return 0
+    return len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+class MetricsRecorder:
+    """记录后端调用，线程安全
+
+    Args:
+        prices: {模型: (每千输入 token 价格, 每千输出 token 价格)}，默认读取 MODEL_PRICES
+    """
+
+    def __init__(self, prices=None):
+        self.prices = prices if prices is not None else load_model_prices()
+        self._calls = []
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def record(self, endpoint, role, model, elapsed, request_bytes, response_bytes,
+               usage=None, cached=False, error=None):
+        usage = usage or {}
+        prompt_tokens = usage.get("promptTokens")
+        completion_tokens = usage.get("completionTokens")
+        call = dict(
+            current_tags(),
+            endpoint=endpoint,
+            role=role,
+            model=usage.get("model") or model,
+            time=round(time.time() - self._started, 3),
+            elapsed=round(elapsed, 4),
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=self._cost(usage.get("model") or model, prompt_tokens, completion_tokens),
+            cached=cached,
+            error=error
+        )
+        with self._lock:
+            self._calls.append(call)
+        return call
+
+    def _cost(self, model, prompt_tokens, completion_tokens):
+        price = self.prices.get(model)
+        if price is None or prompt_tokens is None:
+            return None
+        return (prompt_tokens * price[0] + (completion_tokens or 0) * price[1]) / 1000
+
+    @property
+    def calls(self):
+        with self._lock:
+            return list(self._calls)
+
+    def summary(self):
+        """按角色汇总延迟分位数、token 和成本，并统计每次迭代的调用数"""
+        calls = self.calls
+        roles = {}
+        for call in calls:
+            roles.setdefault(call["role"] or call["endpoint"], []).append(call)
+
+        by_role = {}
+        for role, role_calls in roles.items():
+            # 缓存命中不反映模型延迟，不计入分位数
+            latencies = [call["elapsed"] for call in role_calls if not call["cached"] and not call["error"]]
+            by_role[role] = {
+                "calls": len(role_calls),
+                "cached": sum(1 for call in role_calls if call["cached"]),
+                "errors": sum(1 for call in role_calls if call["error"]),
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "tokens": sum((call["prompt_tokens"] or 0) + (call["completion_tokens"] or 0) for call in role_calls),
+                "cost": sum(call["cost"] or 0 for call in role_calls)
+            }
+
+        per_iteration = {}
+        for call in calls:
+            iteration = call.get("iteration", 0)
+            per_iteration[iteration] = per_iteration.get(iteration, 0) + 1
+
+        summary = {
+            "calls": len(calls),
+            "total_tokens": sum(stats["tokens"] for stats in by_role.values()),
+            "total_cost": sum(stats["cost"] for stats in by_role.values()),
+            "by_role": by_role,
+            "calls_per_iteration": dict(sorted(per_iteration.items()))
+        }
+
+        # 分级评估：快速评估模型的判定中直接采用的比例，以及交给评估模型的原因
+        screened = sum(1 for call in calls if call["role"] == "screener")
+        if screened:
+            escalations = {}
+            for call in calls:
+                if call.get("escalation"):
+                    escalations[call["escalation"]] = escalations.get(call["escalation"], 0) + 1
+            accepted = max(0, screened - sum(escalations.values()))
+            summary["cascade"] = {
+                "screened": screened,
+                "accepted": accepted,
+                "hit_rate": accepted / screened,
+                "escalations": escalations
+            }
+
+        # 优化器请求中输出部分的估计大小，以及因超出预算而省略或截断样本的调用数
+        sized = [call for call in calls if call.get("payload_tokens") is not None]
+        if sized:
+            summary["payload"] = {
+                "calls": len(sized),
+                "mean_tokens": sum(call["payload_tokens"] for call in sized) / len(sized),
+                "max_tokens": max(call["payload_tokens"] for call in sized),
+                "trimmed": sum(1 for call in sized if call["payload_omitted"] or call["payload_truncated"])
+            }
+
+        return summary
+
+    def to_dict(self):
+        return {
+            "summary": self.summary(),
+            "calls": self.calls
+        }
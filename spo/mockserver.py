@@ -0,0 +1,441 @@
+"""本地模拟后端
+
+实现 backend/routes/api.js 中的 /api 端点，不调用任何模型，用于基准测试和离线调试：
+
+    python -m spo.mockserver --port 3000 --samples 10 --latency execute-prompt=lognormal:-1.5,0.4
+
+延迟分布和错误率可以按端点配置；评估结果是确定的：每个提示词有一个由内容哈希决定的
+“质量分”，执行结果中带有该分数，评估时比较两个输出的分数。
+
+与真实后端一样支持会话：配置时请求会话的客户端得到 sessionId，之后在请求头中携带；
+响应的 usage.model 为该会话配置的模型，用于检查会话之间的配置是否互相影响。
+设置 max_concurrency 时模拟的模型调用共享该并发上限，按会话轮转分配。
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_MODELS = ["mock/optimizer", "mock/executor", "mock/evaluator", "mock/analyzer", "mock/screener"]
+
+# 输出中携带质量分的标记
+QUALITY_PATTERN = re.compile(r"\[quality=(\d+)\]")
+
+# 分差不超过该值时判为相似
+SIMILAR_MARGIN = 3
+
+# optimize-prompt 在提示末尾追加的改进行前缀
+IMPROVEMENT_PREFIX = "改进 "
+
+SESSION_HEADER = "X-SPO-Session"
+
+# 分片生成的样本问题所侧重的方面
+SAMPLE_ASPECTS = ["基础用法", "边界情况", "含糊的提问", "多步骤推理", "需要拒绝回答", "严格的格式要求", "专业术语", "很长的输入"]
+
+
+def parse_latency(spec):
+    """解析延迟分布
+
+    支持 fixed:秒、uniform:最小,最大 和 lognormal:mu,sigma（对数秒）。
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+
+def _digest(text, digits=8):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:digits], 16)
+
+
+def quality(prompt):
+    """提示词的确定性质量分（0-99）
+
+    初始提示在 0-49 之间，optimize-prompt 追加的每一行“改进”使分数变化 -8 到 +12，
+    因此优化过程中大约一半的候选能胜过当前最佳提示。
+    """
+    lines = prompt.split("\n")
+    score = _digest(lines[0]) % 50
+    for line in lines[1:]:
+        if line.startswith(IMPROVEMENT_PREFIX):
+            score += _digest(line) % 21 - 8
+    return min(99, max(0, score))
+
+
+def _token_count(text):
+    return max(1, math.ceil(len(text) / 2))
+
+
+class FairSlots:
+    """按会话轮转分配的并发额度，与 backend/fair-queue.js 的分配方式相同"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._queues = OrderedDict()
+        self._granted = set()
+        self._cond = threading.Condition()
+
+    def _dispatch(self):
+        while self.active < self.limit and self._queues:
+            session, queue = self._queues.popitem(last=False)
+            self._granted.add(queue.popleft())
+            if queue:
+                self._queues[session] = queue
+            self.active += 1
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, session):
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._dispatch()
+            while ticket not in self._granted:
+                self._cond.wait()
+            self._granted.remove(ticket)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._dispatch()
+
+
+class MockBackend:
+    """在后台线程中运行的模拟后端
+
+    Args:
+        port: 监听端口，0 表示自动选择
+        samples: generate-samples 返回的样本数
+        latency: {端点: 分布描述}，未列出的端点没有延迟
+        error_rate: {端点: 失败概率}，失败时返回 HTTP 500
+        seed: 随机数种子，决定延迟和错误的序列
+        max_concurrency: 可选，所有会话共享的模拟模型调用并发上限
+    """
+
+    def __init__(self, port=0, samples=10, latency=None, error_rate=None, seed=0, max_concurrency=None):
+        self.samples = samples
+        self.latency = {endpoint: parse_latency(spec) for endpoint, spec in (latency or {}).items()}
+        self.error_rate = dict(error_rate or {})
+        self.calls = {}
+        self.slots = FairSlots(max_concurrency) if max_concurrency else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._configured = False
+        self._models = {}
+        self._sessions = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/api"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="spo-mock-backend", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行，直到被中断"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def expire_sessions(self):
+        """清除所有会话，模拟后端重启或会话过期"""
+        with self._lock:
+            self._sessions = {}
+
+    def slot(self, session):
+        """占用一个模拟模型调用的并发额度"""
+        return self.slots.slot(session) if self.slots is not None else nullcontext()
+
+    def _draw(self, endpoint):
+        """记录调用并抽取本次的 (延迟, 是否失败)"""
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            delay = self.latency[endpoint](self._rng) if endpoint in self.latency else 0
+            failed = self._rng.random() < self.error_rate.get(endpoint, 0)
+        return max(0.0, delay), failed
+
+    def handle(self, endpoint, body, session=None):
+        """处理一次 POST 请求，返回 (状态码, 响应)；session 为请求头中的会话标识"""
+        if endpoint == "config":
+            if not body.get("apiKey") or not body.get("baseUrl"):
+                return 400, {"error": "缺少必要参数: API Key 和 Base URL"}
+            models = dict(body.get("models") or {})
+            # 与真实后端一样返回补全默认模型后各角色实际使用的模型
+            resolved = {}
+            for default in MOCK_MODELS:
+                role = default.split("/", 1)[1]
+                resolved[role] = models.get(role) or default
+            if body.get("session"):
+                with self._lock:
+                    if session not in self._sessions:
+                        session = str(uuid.uuid4())
+                    self._sessions[session] = models
+                return 200, {"success": True, "message": "API配置成功", "sessionId": session, "models": resolved}
+            self._configured = True
+            self._models = models
+            return 200, {"success": True, "message": "API配置成功", "models": resolved}
+
+        if session:
+            with self._lock:
+                models = self._sessions.get(session)
+            if models is None:
+                return 410, {"error": "会话不存在或已过期，请重新配置API"}
+        elif self._configured:
+            models = self._models
+        else:
+            return 400, {"error": "请先配置API"}
+
+        status, response = self._respond(endpoint, body)
+        # 与真实后端一样在 usage 中报告所用的模型
+        if response.get("usage"):
+            role = response["usage"]["model"].split("/", 1)[1]
+            response["usage"]["model"] = models.get(role) or response["usage"]["model"]
+        return status, response
+
+    def _respond(self, endpoint, body):
+
+        if endpoint == "generate-samples":
+            task = body.get("taskDescription", "")
+            count = body.get("count") or self.samples
+            shard = body.get("shard")
+            if shard is None:
+                samples = [{"id": i + 1, "question": f"{task[:20]} 测试问题 {i + 1}"} for i in range(count)]
+            else:
+                samples = [{"id": i + 1, "question": self._sharded_question(task, shard, i)} for i in range(count)]
+            return 200, {"success": True, "samples": samples, "usage": self._usage("optimizer", task, samples)}
+
+        if endpoint == "optimize-prompt":
+            current = body.get("currentPrompt", "")
+            # 温度和历史参与哈希，使同一轮的不同候选得到不同的提示
+            salt = f"{_digest(json.dumps([current, body.get('history'), body.get('temperature')], ensure_ascii=False)):08x}"
+            new_prompt = f"{current}\n{IMPROVEMENT_PREFIX}{salt}"
+            return 200, {"success": True, "newPrompt": new_prompt, "usage": self._usage("optimizer", current, new_prompt)}
+
+        if endpoint == "execute-prompt":
+            output = self._execute(body.get("prompt", ""), body.get("question", ""))
+            return 200, {"success": True, "output": output, "usage": self._usage("executor", body.get("prompt", ""), output)}
+
+        if endpoint == "evaluate-outputs":
+            evaluation = self._evaluate(body.get("outputA", ""), body.get("outputB", ""))
+            return 200, {"success": True, "evaluation": evaluation,
+                         "usage": self._usage("evaluator", body.get("outputA", "") + body.get("outputB", ""), evaluation)}
+
+        if endpoint == "evaluate-outputs/screen":
+            output_a, output_b = body.get("outputA", ""), body.get("outputB", "")
+            evaluation = self._evaluate(output_a, output_b)
+            # 分差越大越有把握，分差在相似范围附近时置信度低
+            confidence = min(1.0, abs(self._score(output_b) - self._score(output_a)) / 10)
+            return 200, {"success": True, "evaluation": evaluation, "confidence": confidence,
+                         "usage": self._usage("screener", output_a + output_b, evaluation)}
+
+        if endpoint == "evaluate-outputs/batch":
+            items = body.get("items") or []
+            verdicts = {str(item.get("id")): self._evaluate(item.get("outputA", ""), item.get("outputB", "")) for item in items}
+            evaluation = json.dumps(verdicts, ensure_ascii=False)
+            prompt = body.get("taskDescription", "") + json.dumps(items, ensure_ascii=False)
+            return 200, {"success": True, "evaluation": evaluation, "usage": self._usage("evaluator", prompt, evaluation)}
+
+        if endpoint == "analyze-changes":
+            analysis = f"新提示的质量分为 {quality(body.get('newPrompt', ''))}，旧提示为 {quality(body.get('oldPrompt', ''))}。"
+            return 200, {"success": True, "analysis": analysis, "usage": self._usage("analyzer", body.get("newPrompt", ""), analysis)}
+
+        return 404, {"error": "未知端点"}
+
+    def _sharded_question(self, task, shard, index):
+        # 与真实模型一样，各分片的第一个问题往往是同一个最常见的问题，只在措辞上略有差别
+        if index == 0:
+            return f"{task[:20]}：最常见的基础问题" + "？" * min(shard, 1)
+        aspect = SAMPLE_ASPECTS[_digest(f"{task}/{shard}/{index}") % len(SAMPLE_ASPECTS)]
+        return f"{task[:20]}：{aspect}（第 {shard + 1} 组第 {index + 1} 题，{_digest(f'{shard}/{index}', 6):06x}）"
+
+    def _execute(self, prompt, question):
+        # 每个样本在提示词质量分附近有固定的偏移
+        offset = _digest(question, 2) % 7 - 3
+        score = min(99, max(0, quality(prompt) + offset))
+        return f"[quality={score}] 针对“{question}”的回答"
+
+    def _score(self, output):
+        match = QUALITY_PATTERN.search(output)
+        return int(match.group(1)) if match else 0
+
+    def _evaluate(self, output_a, output_b):
+        scores = [self._score(output_a), self._score(output_b)]
+        if abs(scores[1] - scores[0]) <= SIMILAR_MARGIN:
+            return "相似"
+        return "B更好" if scores[1] > scores[0] else "A更好"
+
+    def _usage(self, role, prompt, completion):
+        if not isinstance(completion, str):
+            completion = json.dumps(completion, ensure_ascii=False)
+        return {
+            "model": f"mock/{role}",
+            "promptTokens": _token_count(prompt),
+            "completionTokens": _token_count(completion),
+            "totalTokens": _token_count(prompt) + _token_count(completion)
+        }
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _endpoint(self):
+                return self.path.split("/api/", 1)[-1].split("?", 1)[0]
+
+            def _send(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _event(self, data):
+                chunk = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                endpoint = self._endpoint()
+                if endpoint == "models":
+                    self._send(200, {"success": True, "models": MOCK_MODELS})
+                elif endpoint == "health":
+                    self._send(200, {"status": "ok", "message": "SPO+ 模拟后端"})
+                else:
+                    self._send(404, {"error": "未知端点"})
+
+            def do_POST(self):
+                endpoint = self._endpoint()
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send(400, {"error": "请求不是有效的 JSON"})
+                    return
+
+                session = self.headers.get(SESSION_HEADER)
+                delay, failed = backend._draw(endpoint)
+                if delay:
+                    with backend.slot(session):
+                        time.sleep(delay)
+                if failed:
+                    self._send(500, {"error": "模拟的服务端错误"})
+                    return
+
+                if endpoint == "execute-prompt/stream":
+                    self._stream(body, session)
+                    return
+
+                status, response = backend.handle(endpoint, body, session)
+                self._send(status, response)
+
+            def _stream(self, body, session):
+                status, response = backend.handle("execute-prompt", body, session)
+                if status != 200:
+                    self._send(status, response)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                output = response["output"]
+                for start in range(0, len(output), 8):
+                    self._event({"token": output[start:start + 8]})
+                self._event({"done": True, "output": output, "usage": response["usage"]})
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def _checked_latency(spec):
+    parse_latency(spec)
+    return spec
+
+
+def parse_endpoint_options(values, convert):
+    """把 端点=值 形式的命令行参数解析为字典"""
+    options = {}
+    for value in values or []:
+        endpoint, _, option = value.partition("=")
+        if not option:
+            raise ValueError(f"参数格式应为 端点=值: {value}")
+        options[endpoint] = convert(option)
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m spo.mockserver", description="SPO+ 本地模拟后端")
+    parser.add_argument("--port", type=int, default=3000, help="监听端口")
+    parser.add_argument("--samples", type=int, default=10, help="生成的测试样本数")
+    parser.add_argument("--latency", action="append", metavar="ENDPOINT=SPEC",
+                        help="端点延迟分布，如 execute-prompt=uniform:0.1,0.3，可重复")
+    parser.add_argument("--error-rate", action="append", metavar="ENDPOINT=RATE",
+                        help="端点失败概率，如 evaluate-outputs=0.05，可重复")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--max-concurrency", type=int, help="所有会话共享的模拟模型调用并发上限")
+    args = parser.parse_args(argv)
+
+    try:
+        latency = parse_endpoint_options(args.latency, _checked_latency)
+        error_rate = parse_endpoint_options(args.error_rate, float)
+    except ValueError as e:
+        parser.error(str(e))
+
+    backend = MockBackend(args.port, samples=args.samples, latency=latency, error_rate=error_rate, seed=args.seed,
+                          max_concurrency=args.max_concurrency)
+    print(f"模拟后端运行在 {backend.url}")
+    try:
+        backend.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
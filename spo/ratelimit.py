@@ -0,0 +1,261 @@
+"""按模型角色的限流与自适应并发控制
+
+各模型角色（optimizer、executor、evaluator、analyzer、screener）可能使用不同的模型甚至
+不同的服务商，限流额度各不相同。调度器为每个模型维护一个令牌桶和一个 AIMD
+并发上限：调用成功时上限加性增长，遇到 429 或超时时乘性下降。等待中的请求
+按优先级排队，关键路径上的 optimizer/executor 调用排在 analyzer 调用之前。
+同一进程中有多个会话（如多个 Streamlit 用户）时，额度先分给进行中调用最少的会话，
+一个大批量运行的会话不会让其他会话一直等待。
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .concurrency import DEFAULT_MAX_CONCURRENCY
+from .transport import ATTEMPT_OK, ATTEMPT_OVERLOADED
+
+# 设置 ADAPTIVE_CONCURRENCY=off 关闭调度，只保留各处的固定并发上限
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "on") != "off"
+
+# 数值越小越先获得调用额度
+ROLE_PRIORITIES = {
+    "optimizer": 0,
+    "executor": 0,
+    "evaluator": 1,
+    "screener": 1,
+    "analyzer": 2
+}
+
+# 自适应并发上限的范围
+MIN_CONCURRENCY = 1
+MAX_ROLE_CONCURRENCY = int(os.getenv("MAX_ROLE_CONCURRENCY", "32"))
+
+# 两次乘性下降之间的最短间隔（秒），避免同一批失败把上限连续砍到底
+DECREASE_COOLDOWN = 1.0
+
+
+def role_rate_limit(role):
+    """读取角色的每秒请求数限制（环境变量 RATE_LIMIT_<ROLE>），未设置时返回 None"""
+    value = os.getenv(f"RATE_LIMIT_{role.upper()}")
+    return float(value) if value else None
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，允许 burst 个突发请求"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def lower(self, rate):
+        """把速率降到 rate（已经更低时不变）"""
+        with self._lock:
+            if rate < self.rate:
+                self.rate = rate
+                self.capacity = max(1.0, rate)
+                self._tokens = min(self._tokens, self.capacity)
+
+
+class AdaptiveLimit:
+    """AIMD 并发上限
+
+    每次成功使上限增加 increase / limit（约每轮满载调用增加 increase），
+    过载时乘以 decrease。
+    """
+
+    def __init__(self, initial, min_limit=MIN_CONCURRENCY, max_limit=MAX_ROLE_CONCURRENCY,
+                 increase=1.0, decrease=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._decreased_at = None
+
+    @property
+    def available(self):
+        return self.in_flight < int(self.limit)
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if self._decreased_at is not None and now - self._decreased_at < DECREASE_COOLDOWN:
+            return
+        self._decreased_at = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class RequestScheduler:
+    """按模型分配调用额度的调度器
+
+    使用同一个模型的角色共享一个并发上限和令牌桶，因此当多个角色配置为
+    同一模型时，优先级决定谁先获得额度；令牌桶的速率取这些角色中最低的限制。不同会话之间按公平份额分配：
+    在该模型上进行中调用最少的会话先获得额度，其次才比较优先级和排队顺序。
+
+    Args:
+        initial_limit: 每个模型的初始并发上限
+        max_limit: 并发上限的最大值
+        rate_limits: {角色: 每秒请求数}，默认读取环境变量 RATE_LIMIT_<ROLE>
+    """
+
+    def __init__(self, initial_limit=DEFAULT_MAX_CONCURRENCY, max_limit=MAX_ROLE_CONCURRENCY, rate_limits=None):
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.rate_limits = rate_limits if rate_limits is not None else {
+            role: role_rate_limit(role) for role in ROLE_PRIORITIES
+        }
+        self._limits = {}
+        self._buckets = {}
+        self._waiting = []
+        self._active = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _limit(self, key):
+        if key not in self._limits:
+            self._limits[key] = AdaptiveLimit(self.initial_limit, max_limit=self.max_limit)
+        return self._limits[key]
+
+    def _bucket(self, key, role):
+        rate = self.rate_limits.get(role)
+        if not rate:
+            return None
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(rate)
+        else:
+            # 多个角色使用同一模型时共享服务商的额度，按其中最低的限制
+            self._buckets[key].lower(rate)
+        return self._buckets[key]
+
+    def _rank(self, entry):
+        priority, sequence, key, session = entry
+        return self._active.get((key, session), 0), priority, sequence
+
+    def _grantable(self, entry):
+        key = entry[2]
+        if not self._limits[key].available:
+            return False
+        # 同一模型上进行中调用最少的会话先获得额度，其次是优先级更高或更早排队的请求
+        rank = self._rank(entry)
+        return all(other[2] != key or self._rank(other) >= rank for other in self._waiting)
+
+    def acquire(self, key, role, priority=None, session=None):
+        if priority is None:
+            priority = ROLE_PRIORITIES.get(role, len(ROLE_PRIORITIES))
+
+        with self._cond:
+            limit = self._limit(key)
+            bucket = self._bucket(key, role)
+            entry = (priority, next(self._sequence), key, session)
+            heapq.heappush(self._waiting, entry)
+            while not self._grantable(entry):
+                self._cond.wait()
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            limit.in_flight += 1
+            self._active[(key, session)] = self._active.get((key, session), 0) + 1
+
+        if bucket is not None:
+            bucket.acquire()
+
+    def release(self, key, session=None):
+        with self._cond:
+            self._limits[key].in_flight -= 1
+            self._active[(key, session)] -= 1
+            if not self._active[(key, session)]:
+                del self._active[(key, session)]
+            self._cond.notify_all()
+
+    def record(self, key, outcome):
+        """记录一次尝试的结果并调整并发上限"""
+        with self._cond:
+            limit = self._limit(key)
+            if outcome == ATTEMPT_OK:
+                limit.on_success()
+            elif outcome == ATTEMPT_OVERLOADED:
+                limit.on_overload()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, role, model=None, priority=None, session=None):
+        """占用一个调用额度，产出 Slot：record 作为 Transport 的 on_attempt 回调，
+        renew 作为 before_retry 回调
+
+        session 标识发起调用的会话，用于在会话之间公平分配额度
+        """
+        key = model or role
+        self.acquire(key, role, priority, session)
+        try:
+            yield Slot(self, key, role, priority, session)
+        finally:
+            self.release(key, session)
+
+    def snapshot(self):
+        """各模型当前的并发上限、进行中和排队中的请求数"""
+        with self._cond:
+            return {
+                key: {
+                    "limit": round(limit.limit, 2),
+                    "in_flight": limit.in_flight,
+                    "waiting": sum(1 for entry in self._waiting if entry[2] == key),
+                    "sessions": sum(1 for active_key, _ in self._active if active_key == key)
+                }
+                for key, limit in self._limits.items()
+            }
+
+
+class Slot:
+    """RequestScheduler.slot() 占用的调用额度"""
+
+    def __init__(self, scheduler, key, role, priority, session):
+        self.scheduler = scheduler
+        self.key = key
+        self.role = role
+        self.priority = priority
+        self.session = session
+
+    def record(self, outcome):
+        self.scheduler.record(self.key, outcome)
+
+    def renew(self):
+        """重试前归还额度并重新排队，重新申请并发额度和令牌
+
+        每次尝试都各自受并发上限和速率限制约束，降低后的并发上限对重试同样生效
+        """
+        self.scheduler.release(self.key, self.session)
+        self.scheduler.acquire(self.key, self.role, self.priority, self.session)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """获取进程内共享的调度器，同一服务商的限流额度由所有客户端共同遵守"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
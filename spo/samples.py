@@ -0,0 +1,135 @@
+"""测试样本集的存储与生成
+
+同一任务的每次运行原本都要先调用一次 generate-samples，等待模型生成样本后才能
+开始执行当前最佳提示。SampleStore 按规范化后的任务描述保存生成过的样本集，
+同一任务每次重新生成或补充样本都保存为新版本，之后的运行直接取出最新（或指定）
+版本，不再调用模型。
+
+需要的样本较多时，按 SHARD_SIZE 拆成多个并行的 generate-samples 请求，
+每个分片带有不同的序号，使模型侧重不同的场景；合并时去掉完全相同和几乎相同的问题，
+并按顺序重新编号。
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from .dedup import estimate_similarity, minhash_signature, normalize_prompt, prompt_fingerprint
+
+DEFAULT_SAMPLE_STORE_PATH = os.getenv("SAMPLE_STORE_PATH", os.path.join(".spo", "samples.sqlite3"))
+
+# 每个分片请求生成的样本数
+SHARD_SIZE = int(os.getenv("SAMPLE_SHARD_SIZE", "5"))
+
+# 两个问题的相似度达到该值时视为重复，只保留先出现的一个
+DEFAULT_SAMPLE_SIMILARITY = 0.8
+
+# 去重后样本不足时最多再补充生成的轮数
+MAX_TOP_UP_ROUNDS = 1
+
+
+def task_key(task_description):
+    """样本集的键：忽略空白和大小写差异后的任务描述哈希"""
+    return prompt_fingerprint(task_description)
+
+
+def plan_shards(count, shard_size=SHARD_SIZE, start=0):
+    """把 count 个样本拆成分片，返回 [(分片序号, 样本数)]；start 为第一个分片的序号"""
+    shards = max(1, math.ceil(count / shard_size))
+    return [(start + index, min(shard_size, count - index * shard_size)) for index in range(shards)]
+
+
+def merge_samples(groups, threshold=DEFAULT_SAMPLE_SIMILARITY):
+    """合并多组样本，去掉重复的问题并从 1 开始重新编号
+
+    Returns:
+        (合并后的样本, 去掉的问题数)
+    """
+    merged, signatures, seen = [], [], set()
+    removed = 0
+    for samples in groups:
+        for sample in samples:
+            question = str(sample.get("question") or "").strip()
+            if not question:
+                continue
+            normalized = normalize_prompt(question)
+            signature = minhash_signature(question)
+            if normalized in seen or any(estimate_similarity(signature, other) >= threshold for other in signatures):
+                removed += 1
+                continue
+            seen.add(normalized)
+            signatures.append(signature)
+            merged.append(dict(sample, id=len(merged) + 1, question=question))
+    return merged, removed
+
+
+class SampleStore:
+    """按任务保存的版本化样本集（SQLite）
+
+    path 为空时只保存在内存中。版本号从 1 开始，每个任务独立递增。
+    """
+
+    def __init__(self, path=DEFAULT_SAMPLE_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sample_sets ("
+            "key TEXT NOT NULL, version INTEGER NOT NULL, task_description TEXT NOT NULL, "
+            "samples TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (key, version))"
+        )
+        self._db.commit()
+
+    def get(self, task_description, version=None):
+        """返回 (版本, 样本)；version 为空时取最新版本，不存在时返回 (None, [])"""
+        query = "SELECT version, samples FROM sample_sets WHERE key = ?"
+        params = [task_key(task_description)]
+        if version is not None:
+            query += " AND version = ?"
+            params.append(version)
+        with self._lock:
+            row = self._db.execute(query + " ORDER BY version DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None, []
+        return row[0], json.loads(row[1])
+
+    def save(self, task_description, samples):
+        """保存为该任务的新版本，返回版本号"""
+        key = task_key(task_description)
+        with self._lock:
+            row = self._db.execute("SELECT MAX(version) FROM sample_sets WHERE key = ?", (key,)).fetchone()
+            version = (row[0] or 0) + 1
+            self._db.execute(
+                "INSERT INTO sample_sets (key, version, task_description, samples, created) VALUES (?, ?, ?, ?, ?)",
+                (key, version, task_description, json.dumps(samples, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+        return version
+
+    def versions(self, task_description):
+        """该任务的全部版本：[{"version", "samples"（样本数）, "created"}]，按版本升序"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version, samples, created FROM sample_sets WHERE key = ? ORDER BY version",
+                (task_key(task_description),)
+            ).fetchall()
+        return [{"version": version, "samples": len(json.loads(samples)), "created": created}
+                for version, samples, created in rows]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_sample_store(path=DEFAULT_SAMPLE_STORE_PATH):
+    """获取指定路径的共享样本集存储"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SampleStore(path)
+        return _stores[path]
@@ -0,0 +1,249 @@
+"""后端 HTTP 传输层
+
+所有对 BACKEND_URL 的请求共享同一个连接池，并统一处理超时、
+带抖动的指数退避重试以及熔断。调用失败时抛出 TransportError，
+而不是返回空结果。
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 表示服务端过载的状态码，与超时一起作为降低并发的信号
+OVERLOAD_STATUS = {429, 503, 504}
+
+# 每次尝试的结果，交给 on_attempt 回调
+ATTEMPT_OK = "ok"
+ATTEMPT_OVERLOADED = "overloaded"
+ATTEMPT_FAILED = "failed"
+
+# 各端点的 (连接超时, 读取超时)，单位秒
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "180"))
+
+# 连接池大小：同一进程中的所有会话共享到后端的连接
+DEFAULT_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "64"))
+ENDPOINT_TIMEOUTS = {
+    "health": (DEFAULT_CONNECT_TIMEOUT, 10),
+    "models": (DEFAULT_CONNECT_TIMEOUT, 10),
+    "config": (DEFAULT_CONNECT_TIMEOUT, 10),
+    "generate-samples": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    "optimize-prompt": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    "execute-prompt": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    # 流式响应的读取超时是两段数据之间的最长间隔
+    "execute-prompt/stream": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    "evaluate-outputs": (DEFAULT_CONNECT_TIMEOUT, 120),
+    "evaluate-outputs/batch": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    "evaluate-outputs/screen": (DEFAULT_CONNECT_TIMEOUT, 60),
+    "analyze-changes": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+}
+
+
+class TransportError(Exception):
+    """后端调用失败"""
+
+    def __init__(self, endpoint, message, status=None, attempts=1):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.status = status
+        self.attempts = attempts
+
+    def __str__(self):
+        status = f" (HTTP {self.status})" if self.status else ""
+        attempts = f"，共尝试 {self.attempts} 次" if self.attempts > 1 else ""
+        return f"{self.endpoint}{status}: {self.args[0]}{attempts}"
+
+
+class CircuitOpenError(TransportError):
+    """熔断器打开，请求被快速拒绝"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却期后放行一次试探请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            # 冷却期结束，只放行一个试探请求
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class Transport:
+    """带连接池、超时、重试和熔断的后端客户端"""
+
+    def __init__(self, base_url, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 pool_size=DEFAULT_POOL_SIZE, timeouts=None, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _timeout(self, endpoint):
+        return self.timeouts.get(endpoint, (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT))
+
+    def _backoff(self, attempt):
+        # 全抖动指数退避
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, endpoint, data=None, on_attempt=None, headers=None, before_retry=None):
+        """调用后端端点并返回 JSON 结果，失败时抛出 TransportError
+
+        on_attempt: 可选回调，每次尝试后以 ATTEMPT_OK、ATTEMPT_OVERLOADED
+            或 ATTEMPT_FAILED 调用，供自适应并发控制使用
+        headers: 可选的附加请求头，如会话标识
+        before_retry: 可选回调，每次重试前（退避等待之后）调用，
+            供限流重新申请调用额度，使重试同样受限流约束
+        """
+        return self._send(endpoint, data, lambda response: response.json(), on_attempt=on_attempt, headers=headers,
+                          before_retry=before_retry)
+
+    def stream(self, endpoint, data, on_attempt=None, headers=None, before_retry=None):
+        """调用返回 text/event-stream 的端点，逐个产生事件中的 JSON 数据
+
+        只在收到响应之前重试；开始接收数据后连接中断时直接抛出 TransportError，
+        以免重复产生已经交给调用方的内容。
+        """
+        response = self._send(endpoint, data, lambda response: response, stream=True, on_attempt=on_attempt,
+                              headers=headers, before_retry=before_retry)
+        # 事件流总是 UTF-8；chunk_size=None 使数据一到达就交给调用方
+        response.encoding = "utf-8"
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if line and line.startswith("data:"):
+                    yield json.loads(line[len("data:"):].strip())
+        except requests.RequestException as e:
+            raise TransportError(endpoint, f"流式响应中断: {e}")
+        except ValueError as e:
+            raise TransportError(endpoint, f"响应解析失败: {e}")
+        finally:
+            response.close()
+
+    def _send(self, endpoint, data, parse, stream=False, on_attempt=None, headers=None, before_retry=None):
+        url = f"{self.base_url}/{endpoint}"
+        attempts = self.max_retries + 1
+        last_error = None
+        report = on_attempt or (lambda outcome: None)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                # 重试途中熔断时报告最近一次的真实错误
+                if last_error:
+                    raise last_error
+                raise CircuitOpenError(endpoint, "后端服务不可用，熔断器已打开", attempts=0)
+            if attempt and before_retry:
+                before_retry()
+
+            status = None
+            try:
+                if data is not None:
+                    response = self.session.post(url, json=data, headers=headers, timeout=self._timeout(endpoint),
+                                                 stream=stream)
+                else:
+                    response = self.session.get(url, headers=headers, timeout=self._timeout(endpoint), stream=stream)
+                status = response.status_code
+
+                if status == 200:
+                    self.breaker.record_success()
+                    report(ATTEMPT_OK)
+                    return parse(response)
+
+                message = _error_message(response)
+                # 流式请求的连接在读完或关闭前不会归还连接池
+                response.close()
+                if status not in RETRYABLE_STATUS:
+                    # 客户端错误说明后端可达，不计入熔断
+                    self.breaker.record_success()
+                    report(ATTEMPT_FAILED)
+                    raise TransportError(endpoint, message, status=status, attempts=attempt + 1)
+                last_error = TransportError(endpoint, message, status=status, attempts=attempt + 1)
+                report(ATTEMPT_OVERLOADED if status in OVERLOAD_STATUS else ATTEMPT_FAILED)
+            except requests.Timeout as e:
+                last_error = TransportError(endpoint, f"网络错误: {e}", attempts=attempt + 1)
+                report(ATTEMPT_OVERLOADED)
+            except requests.ConnectionError as e:
+                last_error = TransportError(endpoint, f"网络错误: {e}", attempts=attempt + 1)
+                report(ATTEMPT_FAILED)
+            except ValueError as e:
+                last_error = TransportError(endpoint, f"响应解析失败: {e}", status=status, attempts=attempt + 1)
+                report(ATTEMPT_FAILED)
+            except requests.RequestException as e:
+                # 其余请求错误，如响应体传输中断、解压失败或重定向过多
+                last_error = TransportError(endpoint, f"请求失败: {e}", status=status, attempts=attempt + 1)
+                report(ATTEMPT_FAILED)
+
+            self.breaker.record_failure()
+            if attempt < attempts - 1:
+                time.sleep(self._backoff(attempt))
+
+        raise last_error
+
+
+def _error_message(response):
+    try:
+        body = response.json()
+        message = body.get("error") or "未知错误"
+        if body.get("details"):
+            message = f"{message}: {body['details']}"
+        return message
+    except ValueError:
+        return response.text[:200] or "未知错误"
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url):
+    """获取指定后端地址的共享传输实例"""
+    with _transports_lock:
+        if base_url not in _transports:
+            _transports[base_url] = Transport(base_url)
+        return _transports[base_url]
@@ -0,0 +1,127 @@
+"""后台优化线程
+
+优化循环在独立线程中运行，界面只读取状态和进度并发送暂停、继续、取消请求，
+不会在整个优化过程中阻塞 Streamlit 的脚本线程。
+"""
+import threading
+
+IDLE = "idle"
+RUNNING = "running"
+PAUSING = "pausing"
+PAUSED = "paused"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class OptimizationWorker:
+    """在后台线程中运行 Optimizer 的迭代
+
+    暂停在当前迭代结束后生效：pause() 先进入 PAUSING，迭代结束后才变为 PAUSED；
+    取消会立即停止尚未开始的调用并作废当前迭代。
+
+    Args:
+        optimizer: Optimizer 实例，其事件回调会被包装以记录进度
+        auto_mode: 为 False 时每完成一次迭代自动暂停，等待 resume()
+    """
+
+    def __init__(self, optimizer, auto_mode=True):
+        self.optimizer = optimizer
+        self.auto_mode = auto_mode
+        self.status = IDLE
+        self.error = None
+        # 当前迭代的进度：迭代序号和已完成的样本数
+        self.iteration = optimizer.state.current_iteration
+        self.samples_done = 0
+
+        self._resume = threading.Event()
+        self._resume.set()
+        self._thread = None
+        # 保护状态切换和进度计数；样本评估事件来自多个并行线程
+        self._lock = threading.Lock()
+
+        on_event = optimizer.on_event
+
+        def track(event, data):
+            if event == "iteration_started":
+                with self._lock:
+                    self.iteration = data["iteration"]
+                    self.samples_done = 0
+            elif event == "sample_evaluated":
+                with self._lock:
+                    self.samples_done += 1
+            if on_event:
+                on_event(event, data)
+
+        optimizer.on_event = track
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def active(self):
+        """是否仍在运行或等待继续"""
+        return self.status in (RUNNING, PAUSING, PAUSED, CANCELLING)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.status = RUNNING
+        self._thread = threading.Thread(target=self._loop, name="spo-optimizer", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        """请求暂停；当前迭代仍会运行到结束，之后状态才变为 PAUSED"""
+        with self._lock:
+            if self.status == RUNNING:
+                self._resume.clear()
+                self.status = PAUSING
+
+    def resume(self):
+        """继续优化；在暂停生效前调用时撤销暂停请求"""
+        with self._lock:
+            if self.status in (PAUSING, PAUSED):
+                self.status = RUNNING
+                self._resume.set()
+
+    def cancel(self):
+        with self._lock:
+            if not self.active:
+                return
+            self.status = CANCELLING
+        self.optimizer.cancel()
+        self._resume.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        optimizer = self.optimizer
+        try:
+            while not optimizer.finished:
+                # 迭代之间：请求过的暂停在这里生效
+                with self._lock:
+                    if self.status == PAUSING:
+                        self.status = PAUSED
+                self._resume.wait()
+                if optimizer.cancelled.is_set():
+                    break
+
+                if optimizer.run_step() is None:
+                    if not optimizer.cancelled.is_set():
+                        self.status = FAILED
+                        return
+                    break
+
+                if not self.auto_mode and not optimizer.finished:
+                    self.pause()
+        except Exception as e:
+            self.error = str(e)
+            self.status = FAILED
+            optimizer.emit("error", message=f"优化过程出错: {self.error}")
+            return
+
+        self.status = CANCELLED if optimizer.cancelled.is_set() else FINISHED
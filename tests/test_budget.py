@@ -0,0 +1,81 @@
+"""spo.budget 的单元测试"""
+import json
+
+from spo.budget import build_outputs_payload, describe_payload, payload_budget, rank_samples
+from spo.decision import BETTER, SIMILAR, WORSE
+from spo.judging import estimate_tokens
+
+
+def outputs_of(count, length):
+    return {str(i): f"第{i}个输出：" + "内容\n" * length for i in range(1, count + 1)}
+
+
+def test_payload_that_fits_is_sent_unchanged():
+    outputs = outputs_of(3, 5)
+    payload, size = build_outputs_payload(outputs, 10000)
+    assert payload == json.dumps(outputs, ensure_ascii=False)
+    assert size["samples"] == 3
+    assert size["omitted"] == size["truncated"] == 0
+    assert size["bytes"] == len(payload.encode("utf-8"))
+
+
+def test_payload_over_budget_stays_within_it():
+    outputs = outputs_of(10, 200)
+    for budget, reserved in [(2000, 0), (2000, 500), (800, 300), (5000, 1000)]:
+        payload, size = build_outputs_payload(outputs, budget, reserved_tokens=reserved)
+        assert size["tokens"] == estimate_tokens(payload) <= budget - reserved
+        selected = json.loads(payload)
+        assert size["samples"] == len(selected)
+        assert size["omitted"] == len(outputs) - len(selected)
+        assert size["truncated"] == sum(selected[key] != outputs[key] for key in selected)
+
+
+def test_payload_follows_the_ranking():
+    outputs = outputs_of(10, 200)
+    ranking = ["7", "3", "9"] + [key for key in outputs if key not in ("7", "3", "9")]
+    payload, size = build_outputs_payload(outputs, 400, ranking=ranking)
+    assert size["omitted"] > 0
+    assert list(json.loads(payload)) == ranking[:size["samples"]]
+
+
+def test_short_outputs_leave_their_share_to_later_samples():
+    outputs = {"1": "短", "2": "长" * 3000}
+    payload, size = build_outputs_payload(outputs, 1000)
+    selected = json.loads(payload)
+    assert selected["1"] == "短"
+    assert size["truncated"] == 1
+    assert estimate_tokens(selected["2"]) > 800
+
+
+def test_rank_samples_puts_losses_of_the_best_prompt_first():
+    history = [
+        {"is_better": True, "evaluations": {1: BETTER, 2: WORSE, 3: BETTER}},
+        {"is_better": False, "candidates": [
+            {"evaluations": {1: BETTER, 2: SIMILAR, 3: SIMILAR}},
+            {"evaluations": {1: WORSE, 2: SIMILAR, 3: BETTER}},
+        ]},
+    ]
+    # 1：输 2 次赢 1 次；2：输 1 次；3：输 1 次赢 1 次
+    assert rank_samples([1, 2, 3, 4], history) == [1, 3, 2, 4]
+
+
+def test_rank_samples_ignores_history_before_the_last_improvement():
+    history = [
+        {"is_better": False, "evaluations": {1: BETTER}},
+        {"is_better": True, "evaluations": {1: BETTER, 2: WORSE}},
+    ]
+    assert rank_samples([1, 2], history) == [2, 1]
+
+
+def test_payload_budget_uses_the_smaller_of_tokens_and_bytes():
+    budgets = {"optimize": {"tokens": 5000, "bytes": 3000}}
+    assert payload_budget("optimize", "任意模型", budgets) == 1000
+    assert payload_budget("optimize", "任意模型", {"optimize": {"tokens": 500}}) == 500
+
+
+def test_describe_payload_mentions_only_trimmed_parts():
+    size = {"bytes": 300, "tokens": 100, "samples": 3, "omitted": 0, "truncated": 0}
+    assert "省略" not in describe_payload(size) and "截断" not in describe_payload(size)
+    size.update(omitted=2, truncated=1)
+    text = describe_payload(size)
+    assert "省略 2 个样本" in text and "截断 1 个样本" in text
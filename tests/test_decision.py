@@ -0,0 +1,155 @@
+"""spo.decision 的单元测试"""
+import itertools
+
+import pytest
+
+from spo.decision import BETTER, SIMILAR, WORSE, VerdictTally, racing_schedule, should_promote, win_probability
+from spo.engine import should_update_best_prompt
+
+VERDICTS = (BETTER, WORSE, SIMILAR)
+
+
+def tally_of(verdicts, total=None, **kwargs):
+    tally = VerdictTally(len(verdicts) if total is None else total, **kwargs)
+    for verdict in verdicts:
+        tally.add(verdict)
+    return tally
+
+
+def test_win_settles_once_remaining_votes_cannot_overturn_it():
+    tally = VerdictTally(5)
+    assert tally.add(BETTER) is None
+    assert tally.add(BETTER) is None
+    # 3 > 0 + 剩余 2
+    assert tally.add(BETTER) is True
+    assert tally.decided_early
+    assert tally.remaining == 2
+
+
+def test_win_needs_a_strict_lead_over_remaining_votes():
+    # 2 票领先、剩余 2 个样本：剩余全判 A更好 时打平，打平不算获胜
+    tally = tally_of([BETTER, BETTER], total=4)
+    assert not tally.settled
+    assert tally.add(BETTER) is True
+    assert tally.decided_early
+
+
+def test_loss_settles_when_a_clean_sweep_would_only_tie():
+    tally = VerdictTally(4)
+    assert tally.add(WORSE) is None
+    # 0 + 剩余 2 <= 2：剩余全判 B更好 也只能打平
+    assert tally.add(WORSE) is False
+    assert tally.decided_early
+
+
+def test_tie_on_the_last_vote_is_a_loss_without_early_decision():
+    tally = tally_of([BETTER, WORSE])
+    assert tally.decision is False
+    assert not tally.decided_early
+    assert tally.result() is False
+
+
+def test_all_similar_is_a_loss():
+    tally = VerdictTally(3)
+    assert tally.add(SIMILAR) is None
+    assert tally.add(SIMILAR) is None
+    assert tally.add(SIMILAR) is False
+    assert not tally.decided_early
+
+
+def test_unknown_verdicts_count_as_seen_only():
+    tally = tally_of(["评估失败", BETTER], total=3)
+    assert tally.seen == 2
+    assert (tally.better, tally.worse, tally.similar) == (1, 0, 0)
+    assert not tally.settled
+
+
+def test_decision_is_sticky_after_settling():
+    tally = tally_of([BETTER, BETTER, BETTER], total=5)
+    assert tally.add(WORSE) is True
+    assert tally.add(WORSE) is True
+    assert tally.result() is True
+
+
+def test_result_without_decision_compares_counts():
+    tally = tally_of([BETTER], total=4)
+    assert not tally.settled
+    assert tally.result() is True
+
+
+@pytest.mark.parametrize("total", [1, 2, 3, 4, 5])
+def test_early_decision_always_matches_the_full_count(total):
+    # 不设置置信度时，提前给出的结论必须与全部评估完成后的结论一致
+    for verdicts in itertools.product(VERDICTS, repeat=total):
+        expected = should_update_best_prompt(dict(enumerate(verdicts)))
+        tally = VerdictTally(total)
+        for index, verdict in enumerate(verdicts):
+            decision = tally.add(verdict)
+            if decision is not None:
+                assert decision == expected, verdicts[:index + 1]
+        assert tally.result() == expected
+
+
+def test_should_update_best_prompt_prefers_a_settled_tally():
+    tally = tally_of([BETTER, BETTER, BETTER], total=5)
+    # 剩余样本还没有结果，全量统计只能看到部分票数
+    assert should_update_best_prompt({1: WORSE}, tally) is True
+    assert should_update_best_prompt({1: BETTER, 2: WORSE}) is False
+
+
+def test_confidence_waits_for_min_votes():
+    tally = tally_of([BETTER, BETTER], total=20, confidence=0.6, min_votes=3)
+    assert not tally.settled
+    tally.add(BETTER)
+    assert tally.decision is True
+    assert tally.decided_early
+
+
+def test_confidence_can_settle_a_loss_early():
+    tally = tally_of([WORSE, WORSE, WORSE, WORSE], total=20, confidence=0.9)
+    assert tally.decision is False
+    assert tally.decided_early
+
+
+def test_without_confidence_only_certain_results_settle():
+    tally = tally_of([BETTER] * 5, total=20)
+    assert not tally.settled
+
+
+def test_win_probability_with_no_remaining_votes_is_certain():
+    assert win_probability(2, 1, 0, 0) == 1.0
+    assert win_probability(1, 1, 3, 0) == 0.0
+    assert win_probability(0, 2, 0, 0) == 0.0
+
+
+def test_win_probability_grows_with_the_lead():
+    probabilities = [win_probability(better, 2, 1, 6) for better in range(5)]
+    assert probabilities == sorted(probabilities)
+    assert all(0.0 <= p <= 1.0 for p in probabilities)
+
+
+def test_racing_schedule_ends_with_all_samples():
+    assert racing_schedule(10, [2, 5]) == [2, 5, 10]
+
+
+def test_racing_schedule_sorts_dedups_and_drops_out_of_range_stages():
+    assert racing_schedule(10, [5, 0, 2, 10, 12, 5, -1]) == [2, 5, 10]
+
+
+def test_racing_schedule_with_stages_larger_than_the_sample_set():
+    assert racing_schedule(3, [4, 8]) == [3]
+    assert racing_schedule(3, []) == [3]
+
+
+def test_should_promote_requires_a_lead():
+    assert not should_promote(tally_of([BETTER, WORSE], total=6))
+    assert not should_promote(tally_of([SIMILAR, SIMILAR], total=6))
+    assert should_promote(tally_of([BETTER, SIMILAR], total=6))
+
+
+def test_should_promote_threshold_is_the_share_of_decisive_votes():
+    # 2 胜 1 负，胜率 2/3；相似不计入
+    tally = tally_of([BETTER, BETTER, WORSE, SIMILAR, SIMILAR], total=10)
+    assert should_promote(tally, threshold=0.6)
+    assert should_promote(tally, threshold=2 / 3)
+    assert not should_promote(tally, threshold=0.7)
@@ -0,0 +1,75 @@
+"""spo.dedup 的单元测试"""
+from spo.dedup import PromptIndex, estimate_similarity, minhash_signature, prompt_fingerprint
+from spo.engine import select_candidate
+
+PROMPT = (
+    "你是一名资深的技术写作助手。请阅读用户提供的材料，先概括要点，再按重要程度列出三到五条建议，"
+    "每条建议不超过两句话。Answer in the same language as the question, avoid jargon, "
+    "and finish with a one-sentence summary that a new reader can understand without context."
+)
+
+VERDICT = {"score": 2, "is_better": False, "evaluations": {}}
+
+
+def test_fingerprint_ignores_whitespace_and_case():
+    assert prompt_fingerprint("Hello  World\n") == prompt_fingerprint("  hello world")
+    assert prompt_fingerprint("hello world") != prompt_fingerprint("hello, world")
+
+
+def test_exact_duplicate_after_normalization_is_found_with_similarity_one():
+    index = PromptIndex()
+    entry = index.add(PROMPT, iteration=1)
+    found, similarity = index.find("  " + PROMPT.upper().replace(" ", "\n  ") + "\n")
+    assert found is entry
+    assert similarity == 1.0
+
+
+def test_near_duplicate_scores_high_and_unrelated_prompt_scores_low():
+    index = PromptIndex()
+    index.add(PROMPT, iteration=1)
+    _, near = index.find(PROMPT.replace("三到五条", "三到六条"))
+    _, unrelated = index.find("Translate the following text into French, keeping the original formatting.")
+    assert 0.8 < near < 1.0
+    assert unrelated < 0.2
+
+
+def test_empty_index_finds_nothing():
+    assert PromptIndex().find(PROMPT) == (None, 0.0)
+
+
+def test_add_updates_an_existing_entry_only_with_a_verdict():
+    index = PromptIndex()
+    entry = index.add(PROMPT, iteration=1)
+    assert index.add(PROMPT, iteration=2) is entry
+    assert entry["iteration"] == 1 and entry["verdict"] is None
+    index.add(PROMPT.lower(), iteration=3, verdict=VERDICT)
+    assert entry["iteration"] == 3 and entry["verdict"] == VERDICT
+    assert len(index) == 1
+
+
+def test_signature_similarity_bounds():
+    signature = minhash_signature(PROMPT)
+    assert len(signature) == 64
+    assert estimate_similarity(signature, signature) == 1.0
+    assert estimate_similarity(signature, []) == 0.0
+    assert minhash_signature("短") == minhash_signature(" 短 ")
+
+
+def candidate(score, is_better=False, duplicate_of=None):
+    return {"score": score, "is_better": is_better, "duplicate_of": duplicate_of}
+
+
+def test_select_candidate_prefers_winners():
+    candidates = [candidate(5), candidate(3, is_better=True), candidate(4, is_better=True)]
+    assert select_candidate(candidates) is candidates[2]
+
+
+def test_select_candidate_skips_duplicates_when_nothing_wins():
+    # 重复的候选沿用已有提示的分数，不应因分数较高而被选中
+    candidates = [candidate(5, duplicate_of=1), candidate(2), candidate(3)]
+    assert select_candidate(candidates) is candidates[2]
+
+
+def test_select_candidate_falls_back_to_duplicates_when_all_are_duplicates():
+    candidates = [candidate(1, duplicate_of=1), candidate(2, duplicate_of=2)]
+    assert select_candidate(candidates) is candidates[1]
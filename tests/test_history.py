@@ -0,0 +1,43 @@
+"""spo.history 的单元测试"""
+import json
+
+import pytest
+
+from spo.history import apply_prompt_delta, prompt_delta
+
+PARENT = "你是一个助手。\n请简洁回答。\n输出使用中文。\n"
+
+CASES = [
+    (PARENT, PARENT),
+    (PARENT, "你是一个助手。\n请详细回答，并给出理由。\n输出使用中文。\n"),
+    (PARENT, "新增的第一行。\n" + PARENT + "末尾新增。\n"),
+    (PARENT, "输出使用中文。\n"),
+    (PARENT, PARENT.rstrip("\n")),
+    (PARENT, ""),
+    ("", PARENT),
+    ("", ""),
+    ("第一行\r\n第二行\r\n", "第一行\r\n第二行改\r\n第三行"),
+    ("emoji 🙂\n", "emoji 🙂\nüñí©ødé\n"),
+]
+
+
+@pytest.mark.parametrize("parent, prompt", CASES)
+def test_delta_round_trips(parent, prompt):
+    delta = prompt_delta(parent, prompt)
+    assert apply_prompt_delta(parent, delta) == prompt
+    # 差异会写入 JSON 检查点
+    assert apply_prompt_delta(parent, json.loads(json.dumps(delta))) == prompt
+
+
+def test_identical_prompt_is_a_single_copy():
+    assert prompt_delta(PARENT, PARENT) == [[0, 3]]
+
+
+def test_changed_line_is_stored_as_text_between_copies():
+    prompt = PARENT.replace("请简洁回答。", "请详细回答。")
+    assert prompt_delta(PARENT, prompt) == [[0, 1], "请详细回答。\n", [2, 3]]
+
+
+def test_empty_prompt_is_an_empty_delta():
+    assert prompt_delta(PARENT, "") == []
+    assert apply_prompt_delta(PARENT, []) == ""
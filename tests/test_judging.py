@@ -0,0 +1,88 @@
+"""spo.judging 的单元测试"""
+from spo.decision import BETTER, SIMILAR, WORSE
+from spo.judging import PROMPT_OVERHEAD_TOKENS, estimate_tokens, item_tokens, pack_comparisons, parse_packed_verdicts
+
+
+def item(sample_id, size=10):
+    return {"id": sample_id, "question": "问" * size, "outputA": "甲" * size, "outputB": "乙" * size}
+
+
+def ids(chunks):
+    return [[entry["id"] for entry in chunk] for chunk in chunks]
+
+
+# pack_comparisons
+
+def test_pack_respects_max_items_and_keeps_order():
+    items = [item(i) for i in range(1, 8)]
+    assert ids(pack_comparisons(items, "任务", 100000, max_items=3)) == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_pack_splits_chunks_at_the_context_budget():
+    items = [item(i) for i in range(1, 6)]
+    task = "任务描述"
+    # 预算恰好放得下两项
+    context = PROMPT_OVERHEAD_TOKENS + estimate_tokens(task) + 2 * item_tokens(items[0])
+    chunks = pack_comparisons(items, task, context)
+    assert ids(chunks) == [[1, 2], [3, 4], [5]]
+
+
+def test_pack_puts_an_oversized_item_in_its_own_chunk():
+    items = [item(1), item(2, size=5000), item(3)]
+    context = PROMPT_OVERHEAD_TOKENS + 200
+    assert ids(pack_comparisons(items, "", context)) == [[1], [2], [3]]
+
+
+def test_pack_of_nothing_is_empty():
+    assert pack_comparisons([], "任务", 1000) == []
+
+
+# parse_packed_verdicts
+
+def test_parse_json_object():
+    text = '{"1": "B更好", "2": "A更好", "3": "相似"}'
+    assert parse_packed_verdicts(text, [1, 2, 3]) == {1: BETTER, 2: WORSE, 3: SIMILAR}
+
+
+def test_parse_json_inside_a_code_fence_with_surrounding_text():
+    text = '判定如下：\n```json\n{"1": "B更好", "2": " 相似 "}\n```\n以上。'
+    assert parse_packed_verdicts(text, [1, 2]) == {1: BETTER, 2: SIMILAR}
+
+
+def test_parse_maps_keys_back_to_the_original_id_type():
+    assert parse_packed_verdicts('{"7": "A更好"}', [7]) == {7: WORSE}
+    assert parse_packed_verdicts('{"a": "A更好"}', ["a"]) == {"a": WORSE}
+
+
+def test_parse_drops_unknown_ids_and_invalid_verdicts():
+    text = '{"1": "B更好", "2": "差不多", "3": 1, "9": "A更好"}'
+    assert parse_packed_verdicts(text, [1, 2, 3]) == {1: BETTER}
+
+
+def test_parse_falls_back_to_lines_when_json_is_malformed():
+    text = '{"1": "B更好", "2": "A更好",'
+    assert parse_packed_verdicts(text, [1, 2]) == {1: BETTER, 2: WORSE}
+
+
+def test_parse_falls_back_to_lines_when_json_has_no_usable_verdicts():
+    text = '{"结论": "见下"}\n第1组：A更好\n第2组：相似'
+    assert parse_packed_verdicts(text, [1, 2]) == {1: WORSE, 2: SIMILAR}
+
+
+def test_parse_falls_back_to_lines_when_json_is_not_an_object():
+    text = '["B更好"]\n1. B更好\n2. A更好'
+    assert parse_packed_verdicts(text, [1, 2]) == {1: BETTER, 2: WORSE}
+
+
+def test_parse_lines_keep_the_first_verdict_for_a_group():
+    text = "1: B更好\n1: A更好\n2: 相似"
+    assert parse_packed_verdicts(text, [1, 2]) == {1: BETTER, 2: SIMILAR}
+
+
+def test_parse_leaves_out_missing_groups():
+    assert parse_packed_verdicts('{"1": "B更好"}', [1, 2, 3]) == {1: BETTER}
+
+
+def test_parse_of_unrelated_text_is_empty():
+    assert parse_packed_verdicts("无法判断", [1, 2]) == {}
+    assert parse_packed_verdicts("", [1]) == {}